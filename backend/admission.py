@@ -0,0 +1,269 @@
+import contextvars
+import heapq
+import itertools
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from inference import BATCH_MAX_SIZE
+from metrics import registry
+
+# ============ Kiểm soát tải cho /predict ============
+#
+# Mỗi request /predict chiếm CPU (giải mã, đặc trưng, tiền xử lý) và một chỗ
+# trong batch của model. Không giới hạn thì một đợt tải ảnh lớn làm mọi request
+# chậm dần, client timeout rồi gửi lại và tải càng tăng. Ở đây:
+#
+# - Số pipeline chạy cùng lúc và tổng số megapixel đang xử lý bị giới hạn,
+#   request còn lại xếp hàng; hàng đợi đầy thì trả 429 + Retry-After ngay.
+# - Hàng đợi ưu tiên theo chi phí (số pixel đọc từ header ảnh): một ảnh 48MP
+#   được xếp như thể đến muộn hơn ADMISSION_SECONDS_PER_MEGAPIXEL giây cho mỗi
+#   megapixel, nên ảnh nhỏ không phải chờ sau ảnh lớn, còn ảnh lớn vẫn được chạy
+#   sau một khoảng trễ có giới hạn (không bị bỏ đói).
+# - Mỗi request có hạn chót (deadline). Request đã chờ quá hạn bị bỏ thay vì
+#   chạy cho một client đã bỏ đi; hạn chót còn lại được dùng làm timeout suy luận.
+
+# Số request /predict được chạy pipeline cùng lúc (0 = tắt kiểm soát tải)
+ADMISSION_MAX_INFLIGHT = int(os.environ.get("ADMISSION_MAX_INFLIGHT", str(max(2, BATCH_MAX_SIZE))))
+# Tổng số megapixel (theo header ảnh) được xử lý cùng lúc; một ảnh lớn hơn
+# giới hạn vẫn được chạy khi không còn request nào khác
+ADMISSION_MAX_INFLIGHT_MEGAPIXELS = float(os.environ.get("ADMISSION_MAX_INFLIGHT_MEGAPIXELS", "96"))
+# Số request tối đa chờ trong hàng đợi, vượt quá thì trả 429
+ADMISSION_MAX_QUEUE = int(os.environ.get("ADMISSION_MAX_QUEUE", "32"))
+# Độ trễ ưu tiên cho mỗi megapixel của ảnh (giây)
+ADMISSION_SECONDS_PER_MEGAPIXEL = float(os.environ.get("ADMISSION_SECONDS_PER_MEGAPIXEL", "0.05"))
+
+# Hạn chót của một request tính từ lúc request tới (hoặc từ header
+# X-Request-Start do proxy đặt), 0 = không giới hạn. Client có thể rút ngắn
+# bằng header X-Request-Timeout (giây).
+PREDICT_DEADLINE_S = float(os.environ.get("PREDICT_DEADLINE_S", "30"))
+
+ADMISSION_WAIT_SECONDS = registry.histogram(
+    "coffee_admission_wait_seconds",
+    "Thời gian request /predict chờ trong hàng đợi kiểm soát tải",
+)
+ADMISSION_SHED = registry.counter(
+    "coffee_admission_shed_total",
+    "Số request /predict bị từ chối theo lý do (queue_full, deadline)",
+    ["reason"],
+)
+
+_deadline = contextvars.ContextVar("predict_deadline", default=None)
+
+
+class AdmissionRejected(RuntimeError):
+    """Request bị từ chối để giảm tải (hàng đợi đầy hoặc quá hạn chót)."""
+
+    def __init__(self, message, reason, status_code=429, retry_after=1):
+        super().__init__(message)
+        self.reason = reason
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+def _parse_request_start(value):
+    """Thời điểm (epoch giây) từ X-Request-Start: "t=<s|ms|µs>" hoặc số trần."""
+    try:
+        start = float(value.strip().removeprefix("t="))
+    except (AttributeError, ValueError):
+        return None
+    # Proxy ghi theo giây (nginx $msec), mili giây hoặc micro giây
+    if start > 1e14:
+        start /= 1e6
+    elif start > 1e11:
+        start /= 1e3
+    return start
+
+
+def request_deadline(headers, arrived_at):
+    """
+    Hạn chót (time.monotonic()) của một request, hoặc None nếu không giới hạn.
+    arrived_at: thời điểm (time.time()) server nhận request.
+    """
+    now_wall = time.time()
+    candidates = []
+    if PREDICT_DEADLINE_S > 0:
+        start = _parse_request_start(headers.get("X-Request-Start")) or arrived_at
+        # Đồng hồ của proxy lệch về tương lai thì dùng thời điểm server nhận
+        candidates.append(min(start, arrived_at) + PREDICT_DEADLINE_S)
+    try:
+        client_timeout = float(headers.get("X-Request-Timeout", ""))
+        if client_timeout > 0:
+            candidates.append(arrived_at + client_timeout)
+    except ValueError:
+        pass
+    if not candidates:
+        return None
+    return time.monotonic() + (min(candidates) - now_wall)
+
+
+def remaining_seconds(default):
+    """Thời gian còn lại tới hạn chót của request hiện tại (tối đa default)."""
+    deadline = _deadline.get()
+    if deadline is None:
+        return default
+    return max(0.0, min(default, deadline - time.monotonic()))
+
+
+class _Waiter:
+    __slots__ = ("priority", "seq", "cost", "event", "granted")
+
+    def __init__(self, priority, seq, cost):
+        self.priority = priority
+        self.seq = seq
+        self.cost = cost
+        self.event = threading.Event()
+        self.granted = False
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class AdmissionController:
+    """
+    Giới hạn số request và số megapixel đang chạy, xếp hàng phần còn lại theo
+    thời điểm đến cộng chi phí.
+    """
+
+    def __init__(self, max_inflight=ADMISSION_MAX_INFLIGHT,
+                 max_inflight_megapixels=ADMISSION_MAX_INFLIGHT_MEGAPIXELS,
+                 max_queue=ADMISSION_MAX_QUEUE,
+                 seconds_per_megapixel=ADMISSION_SECONDS_PER_MEGAPIXEL):
+        self.max_inflight = max_inflight
+        self.max_inflight_megapixels = max_inflight_megapixels
+        self.max_queue = max(0, max_queue)
+        self.seconds_per_megapixel = seconds_per_megapixel
+        self._lock = threading.Lock()
+        self._heap = []
+        self._seq = itertools.count()
+        self._inflight = 0
+        self._inflight_megapixels = 0.0
+        # Thời gian phục vụ trung bình (EWMA) để ước lượng Retry-After
+        self._service_seconds = 1.0
+
+        self._admitted = 0
+        self._queued_total = 0
+        self._shed = {"queue_full": 0, "deadline": 0}
+
+    @property
+    def enabled(self):
+        return self.max_inflight > 0
+
+    def _fits(self, cost):
+        if self._inflight >= self.max_inflight:
+            return False
+        return self._inflight == 0 or self._inflight_megapixels + cost <= self.max_inflight_megapixels
+
+    def _dispatch(self):
+        # Cấp chỗ theo đúng thứ tự ưu tiên (không vượt mặt request đầu hàng)
+        while self._heap and self._fits(self._heap[0].cost):
+            waiter = heapq.heappop(self._heap)
+            waiter.granted = True
+            self._inflight += 1
+            self._inflight_megapixels += waiter.cost
+            waiter.event.set()
+
+    def _retry_after(self):
+        # Ước lượng thời gian để hàng đợi hiện tại chạy hết
+        rounds = len(self._heap) / max(1, self.max_inflight) + 1
+        return int(min(30, max(1, math.ceil(self._service_seconds * rounds))))
+
+    def _shed_request(self, reason, message, status_code):
+        self._shed[reason] += 1
+        ADMISSION_SHED.inc(reason=reason)
+        return AdmissionRejected(message, reason, status_code, self._retry_after())
+
+    def _acquire(self, cost, deadline):
+        if deadline is not None and time.monotonic() >= deadline:
+            with self._lock:
+                raise self._shed_request("deadline", "Request đã quá hạn chờ", 504)
+
+        with self._lock:
+            if not self._heap and self._fits(cost):
+                self._inflight += 1
+                self._inflight_megapixels += cost
+                self._admitted += 1
+                ADMISSION_WAIT_SECONDS.observe(0.0)
+                return
+            if len(self._heap) >= self.max_queue:
+                raise self._shed_request("queue_full", "Máy chủ đang quá tải, vui lòng thử lại sau", 429)
+            now = time.monotonic()
+            waiter = _Waiter(now + cost * self.seconds_per_megapixel, next(self._seq), cost)
+            heapq.heappush(self._heap, waiter)
+            self._queued_total += 1
+            self._dispatch()
+
+        timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+        waiter.event.wait(timeout)
+        with self._lock:
+            ADMISSION_WAIT_SECONDS.observe(time.monotonic() - now)
+            if not waiter.granted:
+                # Quá hạn khi còn trong hàng đợi: client đã bỏ đi, không chạy nữa
+                self._heap.remove(waiter)
+                heapq.heapify(self._heap)
+                self._dispatch()
+                raise self._shed_request("deadline", "Request đã quá hạn chờ", 504)
+            self._admitted += 1
+
+    def _release(self, cost, seconds):
+        with self._lock:
+            self._inflight -= 1
+            self._inflight_megapixels -= cost
+            self._service_seconds += 0.1 * (seconds - self._service_seconds)
+            self._dispatch()
+
+    @contextmanager
+    def admit(self, pixels, deadline=None):
+        """
+        Chờ tới lượt chạy pipeline cho một ảnh có `pixels` pixel.
+        Raises: AdmissionRejected nếu hàng đợi đầy hoặc hết hạn chót khi đang chờ.
+        Trong khối with, remaining_seconds() trả về thời gian còn lại tới hạn chót
+        (kể cả khi kiểm soát tải bị tắt).
+        """
+        if not self.enabled:
+            token = _deadline.set(deadline)
+            try:
+                yield
+            finally:
+                _deadline.reset(token)
+            return
+
+        cost = pixels / 1e6
+        self._acquire(cost, deadline)
+        token = _deadline.set(deadline)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            _deadline.reset(token)
+            self._release(cost, time.monotonic() - started)
+
+    def inflight(self):
+        with self._lock:
+            return self._inflight
+
+    def queue_depth(self):
+        with self._lock:
+            return len(self._heap)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "max_inflight": self.max_inflight,
+                "max_inflight_megapixels": self.max_inflight_megapixels,
+                "max_queue": self.max_queue,
+                "deadline_seconds": PREDICT_DEADLINE_S,
+                "inflight": self._inflight,
+                "inflight_megapixels": round(self._inflight_megapixels, 2),
+                "queue_depth": len(self._heap),
+                "admitted": self._admitted,
+                "queued": self._queued_total,
+                "shed": dict(self._shed),
+                "avg_service_seconds": round(self._service_seconds, 3),
+            }
+
+
+admission = AdmissionController()
@@ -0,0 +1,16 @@
+"""
+Bộ benchmark cho các đường xử lý nóng của backend (dự đoán và xác thực).
+
+Chạy từ thư mục backend, không cần mạng, GPU hay MongoDB thật:
+    python -m benchmarks micro --output results/micro.json
+    python -m benchmarks e2e --output results/e2e.json
+    python -m benchmarks all --output results/$(git rev-parse --short HEAD).json
+    python -m benchmarks compare results/old.json results/new.json
+
+- micro: đo từng hàm của routes/predict.py trên ảnh lá tổng hợp ở nhiều độ
+  phân giải (và ảnh mẫu nếu có --samples).
+- e2e: đo độ trễ và throughput của /predict, /auth/login, /auth/profile qua
+  Flask test client, với model giả và mongomock thay cho MongoDB.
+- Kết quả được ghi ra JSON (p50/p95/p99, requests/giây, commit, cấu hình máy)
+  để so sánh giữa các commit.
+"""
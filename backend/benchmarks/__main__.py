@@ -0,0 +1,125 @@
+from benchmarks import environment  # noqa: F401 (cấu hình môi trường trước khi import ứng dụng)
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+
+from benchmarks.images import RESOLUTIONS, load_images
+
+DEFAULT_E2E_IMAGES = "synthetic_vga,synthetic_2mp"
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _metadata(args):
+    from routes.predict import PIPELINE_CONFIG
+
+    return {
+        "commit": _git_commit(),
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "pipeline_config": PIPELINE_CONFIG,
+        "args": {k: v for k, v in vars(args).items() if k not in ("output", "command")},
+    }
+
+
+def _flatten(results):
+    """{(phần, ảnh/kịch bản, hàm): thống kê} từ một file kết quả."""
+    rows = {}
+    for image_name, entry in results.get("micro", {}).items():
+        for function_name, stats in entry["functions"].items():
+            rows[("micro", image_name, function_name)] = stats
+    for scenario, stats in results.get("e2e", {}).items():
+        rows[("e2e", scenario, "")] = stats
+    return rows
+
+
+def _change(old, new):
+    if old is None or new is None or not old:
+        return ""
+    return f"{(new - old) / old * 100:+.1f}%"
+
+
+def compare(old_path, new_path):
+    with open(old_path, encoding="utf-8") as f:
+        old = json.load(f)
+    with open(new_path, encoding="utf-8") as f:
+        new = json.load(f)
+
+    print(f"{old_path} ({old['meta'].get('commit')}) -> {new_path} ({new['meta'].get('commit')})")
+    old_rows, new_rows = _flatten(old), _flatten(new)
+    for key in sorted(set(old_rows) & set(new_rows)):
+        a, b = old_rows[key], new_rows[key]
+        line = "  " + " ".join(part for part in key if part).ljust(64)
+        for metric in ("p50_ms", "p95_ms", "p99_ms"):
+            line += f" {metric[:3]} {a.get(metric, 0):8.2f}->{b.get(metric, 0):8.2f} {_change(a.get(metric), b.get(metric)):>7}"
+        if "requests_per_second" in a:
+            rps_change = _change(a["requests_per_second"], b["requests_per_second"])
+            line += f" rps {a['requests_per_second']:.1f}->{b['requests_per_second']:.1f} {rps_change}"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="Benchmark backend Coffee Care")
+    parser.add_argument("command", choices=["micro", "e2e", "all", "compare"])
+    parser.add_argument("files", nargs="*", help="Hai file kết quả JSON (chỉ dùng với compare)")
+    parser.add_argument("--samples", help="Thư mục ảnh lá thật dùng thêm cho benchmark")
+    parser.add_argument("--resolutions", default=",".join(RESOLUTIONS),
+                        help=f"Độ phân giải ảnh tổng hợp ({', '.join(RESOLUTIONS)})")
+    parser.add_argument("--iterations", type=int, default=10, help="Số lần đo mỗi hàm (micro)")
+    parser.add_argument("--warmup", type=int, default=1, help="Số lần chạy bỏ qua trước khi đo (micro)")
+    parser.add_argument("--requests", type=int, default=100, help="Số request mỗi kịch bản (e2e)")
+    parser.add_argument("--concurrency", type=int, default=4, help="Số request song song (e2e)")
+    parser.add_argument("--e2e-images", default=DEFAULT_E2E_IMAGES, help="Ảnh dùng cho /predict (e2e)")
+    parser.add_argument("--model-ms", type=float, default=0.0,
+                        help="Thời gian giả lập của mỗi batch model giả (ms)")
+    parser.add_argument("--output", help="Ghi kết quả ra file JSON")
+    args = parser.parse_args()
+
+    if args.command == "compare":
+        if len(args.files) != 2:
+            parser.error("compare cần đúng hai file kết quả")
+        compare(*args.files)
+        return
+
+    resolutions = {name: RESOLUTIONS[name] for name in args.resolutions.split(",") if name}
+    images = load_images(args.samples, resolutions)
+    results = {"meta": _metadata(args)}
+
+    if args.command in ("micro", "all"):
+        from benchmarks import micro
+        print("Micro-benchmark:")
+        results["micro"] = micro.run(images, args.iterations, args.warmup, args.model_ms)
+
+    if args.command in ("e2e", "all"):
+        from benchmarks import e2e
+        print("End-to-end:")
+        results["e2e"] = e2e.run(
+            images, args.e2e_images.split(","), args.requests, args.concurrency, args.model_ms
+        )
+
+    if args.output:
+        directory = os.path.dirname(args.output)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        print(f"Đã ghi kết quả: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+from benchmarks import environment  # noqa: F401 (cấu hình môi trường trước khi import ứng dụng)
+
+import io
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.timing import summarize
+
+# ============ Benchmark end-to-end qua Flask test client ============
+
+BENCHMARK_EMAIL = "benchmark@example.com"
+BENCHMARK_PASSWORD = "benchmark-password"
+
+
+def run_load(app, send, requests=100, concurrency=4):
+    """
+    Gửi `requests` request với `concurrency` luồng song song.
+    send(client) trả về status code; mỗi luồng dùng test client riêng.
+    """
+    local = threading.local()
+
+    def one(_):
+        client = getattr(local, "client", None)
+        if client is None:
+            client = local.client = app.test_client()
+        started = time.perf_counter()
+        status = send(client)
+        return time.perf_counter() - started, status
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(one, range(requests)))
+    wall = time.perf_counter() - started
+
+    stats = summarize([latency for latency, _ in results])
+    status_counts = {}
+    for _, status in results:
+        status_counts[str(status)] = status_counts.get(str(status), 0) + 1
+    stats.update({
+        "concurrency": concurrency,
+        "requests_per_second": len(results) / wall if wall > 0 else 0.0,
+        "status_counts": status_counts,
+    })
+    return stats
+
+
+def _ensure_user(client):
+    client.post("/auth/register", json={
+        "email": BENCHMARK_EMAIL,
+        "password": BENCHMARK_PASSWORD,
+        "fullName": "Benchmark User",
+    })
+    response = client.post("/auth/login", json={"email": BENCHMARK_EMAIL, "password": BENCHMARK_PASSWORD})
+    if response.status_code != 200:
+        raise RuntimeError(f"Không đăng nhập được user benchmark: {response.get_data(as_text=True)}")
+    return response.get_json()["access_token"]
+
+
+def scenarios(images, image_names, token):
+    """(tên, hàm gửi request) cho từng endpoint cần đo."""
+    def predict(data):
+        def send(client):
+            response = client.post(
+                "/predict",
+                data={"file": (io.BytesIO(data), "leaf.jpg")},
+                content_type="multipart/form-data",
+            )
+            return response.status_code
+        return send
+
+    def login(client):
+        return client.post(
+            "/auth/login", json={"email": BENCHMARK_EMAIL, "password": BENCHMARK_PASSWORD}
+        ).status_code
+
+    def profile(client):
+        return client.get("/auth/profile", headers={"Authorization": f"Bearer {token}"}).status_code
+
+    return (
+        [(f"predict_{name}", predict(images[name][1])) for name in image_names if name in images]
+        + [("auth_login", login), ("auth_profile", profile)]
+    )
+
+
+def run(images, image_names, requests=100, concurrency=4, model_ms=0.0):
+    """
+    Đo /predict (với từng ảnh trong image_names), /auth/login và /auth/profile.
+    Returns: {tên kịch bản: thống kê độ trễ và throughput}
+    """
+    app = environment.create_app(model_ms)
+    token = _ensure_user(app.test_client())
+
+    results = {}
+    for name, send in scenarios(images, image_names, token):
+        # Một vòng khởi động (tạo client, import lười, warmup model giả)
+        run_load(app, send, requests=concurrency, concurrency=concurrency)
+        results[name] = run_load(app, send, requests=requests, concurrency=concurrency)
+        print(
+            f"  {name:<24} p50 {results[name]['p50_ms']:9.2f}ms  p99 {results[name]['p99_ms']:9.2f}ms  "
+            f"{results[name]['requests_per_second']:8.1f} req/s  {results[name]['status_counts']}"
+        )
+    return results
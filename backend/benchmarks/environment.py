@@ -0,0 +1,68 @@
+import os
+import time
+
+import numpy as np
+
+# ============ Môi trường chạy benchmark ============
+#
+# Module này phải được import trước các module của ứng dụng (main, routes,
+# models...) vì cấu hình của chúng được đọc từ biến môi trường lúc import.
+
+os.environ.setdefault("TF_CPP_MIN_LOG_LEVEL", "3")
+os.environ.setdefault("JWT_SECRET_KEY", "benchmark-only-jwt-secret-key-0123456789")
+os.environ.setdefault("MONGODB_URI", "mongodb://localhost/coffee_benchmark")
+# Model giả được gắn vào registry, không tải model thật
+os.environ.setdefault("MODEL_LOADING", "lazy")
+# Cùng một ảnh được gửi nhiều lần, cache sẽ làm sai số đo
+os.environ.setdefault("PREDICTION_CACHE_SIZE", "0")
+# Index được tạo trên mongomock sau khi thay kết nối (xem create_app)
+os.environ.setdefault("MONGO_INDEX_BOOTSTRAP", "0")
+
+# Đầu ra cố định của model giả: ảnh là lá cà phê, bệnh thứ 4 (phoma)
+COFFEE_OUTPUT = np.array([0.05], dtype="float32")
+DISEASE_OUTPUT = np.array([0.02, 0.03, 0.05, 0.85, 0.05], dtype="float32")
+
+
+class StubModel:
+    """
+    Model giả có cùng giao diện predict() với Keras/TFLite, trả về đầu ra cố
+    định sau một khoảng thời gian giả lập (cố định mỗi batch + theo số dòng).
+    """
+
+    def __init__(self, output, seconds_per_batch=0.0, seconds_per_row=0.0):
+        self.output = output
+        self.seconds_per_batch = seconds_per_batch
+        self.seconds_per_row = seconds_per_row
+
+    def predict(self, batch, verbose=0):
+        delay = self.seconds_per_batch + self.seconds_per_row * len(batch)
+        if delay > 0:
+            time.sleep(delay)
+        return np.tile(self.output, (len(batch), 1))
+
+
+def stub_models(model_ms=0.0):
+    """Model giả cho registry; model_ms là thời gian giả lập cho mỗi batch (ms)."""
+    return {
+        "coffee": StubModel(COFFEE_OUTPUT, model_ms / 1000.0),
+        "disease": StubModel(DISEASE_OUTPUT, model_ms / 1000.0),
+    }
+
+
+def create_app(model_ms=0.0):
+    """
+    Ứng dụng Flask dùng cho benchmark: MongoDB được thay bằng mongomock (dữ liệu
+    trong bộ nhớ) và registry dùng model giả.
+    """
+    import mongoengine
+    import mongomock
+
+    from main import app
+    from models import model_registry
+    from database import bootstrap_indexes
+
+    mongoengine.disconnect()
+    mongoengine.connect(host=os.environ["MONGODB_URI"], mongo_client_class=mongomock.MongoClient)
+    bootstrap_indexes()
+    model_registry.use_models(stub_models(model_ms))
+    return app
@@ -0,0 +1,82 @@
+import io
+import os
+
+import cv2
+import numpy as np
+from PIL import Image
+
+# ============ Ảnh dùng cho benchmark ============
+
+# Độ phân giải (width, height) của ảnh tổng hợp: ảnh nhỏ, ảnh điện thoại cũ, ảnh 12MP
+RESOLUTIONS = {
+    "vga": (640, 480),
+    "2mp": (1600, 1200),
+    "12mp": (4000, 3000),
+}
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+
+def synthetic_leaf(width, height, seed=0):
+    """
+    Ảnh lá tổng hợp (nền đất, lá xanh hình elip có gân, đốm bệnh và nhiễu),
+    sinh lại giống hệt với cùng seed.
+    """
+    rng = np.random.default_rng(seed)
+    image = np.empty((height, width, 3), dtype=np.uint8)
+    image[:] = (96, 78, 60)
+
+    center = (width // 2, height // 2)
+    axes = (int(width * 0.35), int(height * 0.22))
+    cv2.ellipse(image, center, axes, 20, 0, 360, (52, 128, 44), -1)
+
+    # Gân chính và gân phụ
+    angle = np.deg2rad(20)
+    direction = np.array([np.cos(angle), np.sin(angle)])
+    normal = np.array([-direction[1], direction[0]])
+    start = np.array(center) - direction * axes[0] * 0.9
+    end = np.array(center) + direction * axes[0] * 0.9
+    thickness = max(1, width // 400)
+    cv2.line(image, tuple(start.astype(int)), tuple(end.astype(int)), (150, 190, 110), thickness)
+    for t in np.linspace(-0.7, 0.7, 9):
+        base = np.array(center) + direction * axes[0] * t
+        for side in (-1, 1):
+            tip = base + (direction * 0.35 + normal * side) * axes[1] * 0.8
+            cv2.line(image, tuple(base.astype(int)), tuple(tip.astype(int)), (120, 170, 90), thickness)
+
+    # Đốm bệnh
+    for _ in range(12):
+        offset = rng.uniform(-0.5, 0.5, size=2) * axes
+        spot = (int(center[0] + offset[0]), int(center[1] + offset[1]))
+        radius = int(rng.uniform(0.01, 0.03) * width)
+        cv2.circle(image, spot, radius, (150, 110, 40), -1)
+
+    noise = rng.normal(0, 6, image.shape)
+    return Image.fromarray(np.clip(image + noise, 0, 255).astype(np.uint8))
+
+
+def encode_jpeg(image, quality=90):
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+def load_images(samples_dir=None, resolutions=RESOLUTIONS):
+    """
+    Tập ảnh benchmark: {tên: (ảnh PIL, bytes JPEG)}.
+    Gồm ảnh tổng hợp ở từng độ phân giải và ảnh mẫu trong samples_dir (nếu có).
+    """
+    images = {}
+    for name, (width, height) in resolutions.items():
+        image = synthetic_leaf(width, height)
+        images[f"synthetic_{name}"] = (image, encode_jpeg(image))
+
+    if samples_dir:
+        for filename in sorted(os.listdir(samples_dir)):
+            if not filename.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            with open(os.path.join(samples_dir, filename), "rb") as f:
+                data = f.read()
+            image = Image.open(io.BytesIO(data)).convert("RGB")
+            images[f"sample_{os.path.splitext(filename)[0]}"] = (image, data)
+    return images
@@ -0,0 +1,78 @@
+from benchmarks import environment  # noqa: F401 (cấu hình môi trường trước khi import ứng dụng)
+
+import numpy as np
+
+from image_context import ImageContext, decode_image
+from routes.predict import (
+    DECODE_MAX_SIDE,
+    ENHANCE_MAX_SIDE,
+    ENHANCE_MODE,
+    IMG_SIZE,
+    MAX_IMAGE_PIXELS,
+    detect_environmental_artifacts,
+    detect_image_quality,
+    enhance_image_quality,
+    extract_leaf_features,
+    is_coffee_leaf_advanced,
+    predict_image,
+    predict_upload,
+    preprocess_image_advanced,
+    resnet50_preprocess_input,
+)
+from benchmarks.timing import measure
+
+# ============ Micro-benchmark từng hàm của routes/predict.py ============
+
+
+def _decode(data):
+    ctx = decode_image(data, max_side=DECODE_MAX_SIDE, max_pixels=MAX_IMAGE_PIXELS)
+    # Giải mã thật sự diễn ra khi đọc pixel lần đầu
+    ctx.rgb
+    return ctx
+
+
+def _function_benchmarks(image, data):
+    """
+    (tên, setup, fn) cho từng hàm. Mỗi lần gọi dùng một ImageContext mới để
+    các kết quả đã cache trong request không làm sai số đo.
+    """
+    def fresh_context():
+        ctx = ImageContext(image)
+        ctx.rgb
+        return ctx
+
+    features = extract_leaf_features(fresh_context())
+    enhance_max_side = ENHANCE_MAX_SIDE if ENHANCE_MODE == "fast" else 0
+    model_input = np.random.default_rng(0).uniform(0, 255, (1,) + IMG_SIZE + (3,)).astype("float32")
+
+    return [
+        ("decode_image", lambda: data, _decode),
+        ("detect_image_quality", fresh_context, detect_image_quality),
+        ("enhance_image_quality", fresh_context, lambda ctx: enhance_image_quality(ctx, enhance_max_side)),
+        ("preprocess_coffee", fresh_context, lambda ctx: preprocess_image_advanced(ctx, is_coffee_model=True)),
+        ("preprocess_disease", fresh_context, lambda ctx: preprocess_image_advanced(ctx, is_coffee_model=False)),
+        ("resnet50_preprocess_input", None, lambda _: resnet50_preprocess_input(model_input)),
+        ("extract_leaf_features", fresh_context, extract_leaf_features),
+        ("detect_environmental_artifacts", fresh_context, detect_environmental_artifacts),
+        ("is_coffee_leaf_advanced", fresh_context, lambda ctx: is_coffee_leaf_advanced(ctx, features)),
+        ("predict_image", fresh_context, predict_image),
+        ("predict_upload", lambda: data, predict_upload),
+    ]
+
+
+def run(images, iterations=10, warmup=1, model_ms=0.0):
+    """
+    Đo từng hàm trên từng ảnh.
+    Returns: {tên ảnh: {"size": [w, h], "functions": {tên hàm: thống kê}}}
+    """
+    # predict_image / predict_upload cần model (giả) trong registry
+    environment.create_app(model_ms)
+
+    results = {}
+    for image_name, (image, data) in images.items():
+        functions = {}
+        for name, setup, fn in _function_benchmarks(image, data):
+            functions[name] = measure(fn, setup, iterations=iterations, warmup=warmup)
+            print(f"  {image_name:<24} {name:<32} p50 {functions[name]['p50_ms']:9.2f}ms")
+        results[image_name] = {"size": list(image.size), "functions": functions}
+    return results
@@ -0,0 +1,35 @@
+import time
+
+import numpy as np
+
+
+def summarize(latencies):
+    """Thống kê độ trễ (danh sách giây) theo ms."""
+    values = np.asarray(latencies, dtype="float64") * 1000.0
+    if values.size == 0:
+        return {"n": 0}
+    return {
+        "n": int(values.size),
+        "mean_ms": float(values.mean()),
+        "min_ms": float(values.min()),
+        "p50_ms": float(np.percentile(values, 50)),
+        "p95_ms": float(np.percentile(values, 95)),
+        "p99_ms": float(np.percentile(values, 99)),
+        "max_ms": float(values.max()),
+    }
+
+
+def measure(fn, setup=None, iterations=10, warmup=1):
+    """
+    Gọi fn(setup()) nhiều lần và trả về thống kê độ trễ.
+    Thời gian của setup (vd. tạo ImageContext mới) không được tính.
+    """
+    latencies = []
+    for i in range(warmup + iterations):
+        arg = setup() if setup else None
+        started = time.perf_counter()
+        fn(arg)
+        elapsed = time.perf_counter() - started
+        if i >= warmup:
+            latencies.append(elapsed)
+    return summarize(latencies)
@@ -0,0 +1,168 @@
+import os
+import threading
+import time
+
+import cv2
+
+from image_context import ImageContext
+from metrics import registry, stage_timer
+
+# ============ Loại sớm ảnh rác (cascade) ============
+#
+# Ảnh đen, một màu, rất mờ hoặc không có màu thực vật có thể bị loại trước khi
+# chạy Gabor, Hough, contour và hai model. Các bước kiểm tra rẻ nhất được chạy
+# trước; bước nào loại ảnh thì trả kết quả ngay và bỏ qua phần còn lại.
+#
+# Cascade TẮT mặc định: pipeline đầy đủ không loại ảnh nào trước model
+# (is_coffee_leaf_advanced luôn >= 0.5 nên nhánh leaf_score < 0.3 không bao giờ
+# xảy ra), vì vậy mỗi bước ở đây là một lý do từ chối MỚI chứ không phải lối
+# tắt tới cùng kết quả. Vd. bước "thumbnail" loại ảnh lá chụp đen trắng hoặc
+# lệch cân bằng trắng vì "không có màu thực vật". Chỉ bật (CASCADE_STAGES=
+# thumbnail,quality) sau khi đã kiểm tra tỉ lệ loại trên ảnh thật, vd. bằng
+# tools.bulk_score.
+
+# Thứ tự các bước kiểm tra, phân tách bằng dấu phẩy (rỗng = tắt cascade)
+CASCADE_STAGES = [
+    name.strip() for name in os.environ.get("CASCADE_STAGES", "").split(",")
+    if name.strip()
+]
+# Cạnh dài (px) của ảnh thu nhỏ dùng cho bước "thumbnail"
+CASCADE_THUMBNAIL_SIDE = int(os.environ.get("CASCADE_THUMBNAIL_SIDE", "64"))
+# Tỉ lệ pixel có màu thực vật (xanh, vàng, nâu đủ bão hòa) tối thiểu
+CASCADE_MIN_PLANT_RATIO = float(os.environ.get("CASCADE_MIN_PLANT_RATIO", "0.02"))
+# Độ sáng trung bình (kênh V, 0-255) tối thiểu
+CASCADE_MIN_BRIGHTNESS = float(os.environ.get("CASCADE_MIN_BRIGHTNESS", "20"))
+# Độ lệch chuẩn mức xám tối thiểu (ảnh gần như một màu)
+CASCADE_MIN_CONTRAST = float(os.environ.get("CASCADE_MIN_CONTRAST", "3"))
+# Phương sai Laplacian tối thiểu (ảnh quá mờ); detect_image_quality coi < 100 là mờ
+CASCADE_MIN_SHARPNESS = float(os.environ.get("CASCADE_MIN_SHARPNESS", "5"))
+
+CASCADE_DECISIONS = registry.counter(
+    "coffee_cascade_decisions_total",
+    "Số ảnh qua / bị loại ở từng bước của cascade",
+    ["stage", "result"],
+)
+
+
+class Rejection:
+    """Kết luận của một bước kiểm tra: ảnh bị loại, không cần chạy tiếp."""
+
+    def __init__(self, label, message, confidence):
+        self.label = label
+        self.message = message
+        self.confidence = confidence
+        self.stage = None
+
+    def to_response(self):
+        return {
+            "predicted_label": self.label,
+            "confidence": f"{self.confidence * 100:.2f}%",
+            "is_leaf": False,
+            "quality_warning": self.message,
+            "rejected_by": self.stage,
+        }
+
+
+def check_thumbnail(image):
+    """
+    Kiểm tra trên ảnh thu nhỏ (mặc định 64px): ảnh đen, ảnh một màu, ảnh
+    không có màu thực vật.
+    """
+    thumb = ImageContext.of(image).downscaled(CASCADE_THUMBNAIL_SIDE)
+    hsv = thumb.hsv
+
+    brightness = float(hsv[:, :, 2].mean())
+    if brightness < CASCADE_MIN_BRIGHTNESS:
+        return Rejection("Không phải lá cây", "Ảnh quá tối, không nhìn thấy vật thể",
+                         1 - brightness / 255)
+
+    contrast = float(thumb.gray.std())
+    if contrast < CASCADE_MIN_CONTRAST:
+        return Rejection("Không phải lá cây", "Ảnh gần như chỉ có một màu",
+                         1 - contrast / 255)
+
+    # Màu của lá (xanh, vàng, nâu): hue 10-90 và đủ bão hòa
+    plant_mask = cv2.inRange(hsv, (10, 40, 30), (90, 255, 255))
+    plant_ratio = cv2.countNonZero(plant_mask) / plant_mask.size
+    if plant_ratio < CASCADE_MIN_PLANT_RATIO:
+        return Rejection("Không phải lá cây", "Vật thể không có màu sắc của lá cây",
+                         1 - plant_ratio)
+    return None
+
+
+def check_sharpness(image):
+    """Loại ảnh mờ tới mức không nhận ra chi tiết (độ nét dùng chung với detect_image_quality)."""
+    sharpness = ImageContext.of(image).laplacian_var
+    if sharpness < CASCADE_MIN_SHARPNESS:
+        return Rejection("Ảnh quá mờ", "Ảnh quá mờ, vui lòng chụp lại rõ nét hơn",
+                         1 - sharpness / CASCADE_MIN_SHARPNESS)
+    return None
+
+
+# Tên bước -> hàm kiểm tra, sắp theo chi phí tăng dần
+CASCADE_CHECKS = {
+    "thumbnail": check_thumbnail,
+    "quality": check_sharpness,
+}
+
+
+class Cascade:
+    """
+    Chạy lần lượt các bước kiểm tra (tên, hàm) và dừng ở bước đầu tiên loại
+    ảnh. Ghi lại tỉ lệ loại và thời gian của từng bước.
+    """
+
+    def __init__(self, stages):
+        self.stages = list(stages)
+        self._lock = threading.Lock()
+        self._stats = {name: {"checked": 0, "rejected": 0, "seconds": 0.0} for name, _ in self.stages}
+
+    def run(self, ctx):
+        """Returns: Rejection nếu ảnh bị loại, None nếu ảnh qua tất cả các bước."""
+        for name, check in self.stages:
+            started = time.perf_counter()
+            with stage_timer(f"cascade_{name}"):
+                rejection = check(ctx)
+            elapsed = time.perf_counter() - started
+
+            CASCADE_DECISIONS.inc(stage=name, result="reject" if rejection else "pass")
+            with self._lock:
+                stats = self._stats[name]
+                stats["checked"] += 1
+                stats["seconds"] += elapsed
+                if rejection:
+                    stats["rejected"] += 1
+
+            if rejection:
+                rejection.stage = name
+                return rejection
+        return None
+
+    def stats(self):
+        with self._lock:
+            return {
+                name: {
+                    "checked": s["checked"],
+                    "rejected": s["rejected"],
+                    "reject_rate": s["rejected"] / s["checked"] if s["checked"] else 0.0,
+                    "avg_ms": s["seconds"] * 1000.0 / s["checked"] if s["checked"] else 0.0,
+                }
+                for name, s in self._stats.items()
+            }
+
+
+def build_cascade(stages):
+    """
+    Cascade gồm các bước có tên trong stages (theo thứ tự).
+    Raises: ValueError nếu có tên bước không tồn tại (vd. gõ sai CASCADE_STAGES).
+    """
+    unknown = [name for name in stages if name not in CASCADE_CHECKS]
+    if unknown:
+        raise ValueError(
+            f"CASCADE_STAGES có bước không tồn tại: {', '.join(unknown)} "
+            f"(các bước hợp lệ: {', '.join(CASCADE_CHECKS)})"
+        )
+    return Cascade((name, CASCADE_CHECKS[name]) for name in stages)
+
+
+cascade = build_cascade(CASCADE_STAGES)
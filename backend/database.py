@@ -0,0 +1,177 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+from pymongo import ReadPreference, monitoring
+
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# ============ Kết nối MongoDB: pool, index và đo truy vấn ============
+
+# --- Pool kết nối và timeout (mỗi process/worker có pool riêng) ---
+MONGO_MAX_POOL_SIZE = int(os.environ.get("MONGO_MAX_POOL_SIZE", "50"))
+MONGO_MIN_POOL_SIZE = int(os.environ.get("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_MAX_IDLE_TIME_MS = int(os.environ.get("MONGO_MAX_IDLE_TIME_MS", "300000"))
+# Thời gian tối đa chờ một kết nối rảnh trong pool
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.environ.get("MONGO_WAIT_QUEUE_TIMEOUT_MS", "5000"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.environ.get("MONGO_CONNECT_TIMEOUT_MS", "5000"))
+MONGO_SOCKET_TIMEOUT_MS = int(os.environ.get("MONGO_SOCKET_TIMEOUT_MS", "10000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.environ.get("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+# primary | primaryPreferred | secondary | secondaryPreferred | nearest
+MONGO_READ_PREFERENCE = os.environ.get("MONGO_READ_PREFERENCE", "primary")
+
+# Truy vấn chậm hơn ngưỡng này (ms) được ghi log và giữ lại để xem ở /status
+MONGO_SLOW_QUERY_MS = float(os.environ.get("MONGO_SLOW_QUERY_MS", "100"))
+# Tạo / kiểm tra index khi khởi động (serve.py tự làm trong từng worker)
+MONGO_INDEX_BOOTSTRAP = os.environ.get("MONGO_INDEX_BOOTSTRAP", "1") == "1"
+
+_READ_PREFERENCES = {
+    "primary": ReadPreference.PRIMARY,
+    "primaryPreferred": ReadPreference.PRIMARY_PREFERRED,
+    "secondary": ReadPreference.SECONDARY,
+    "secondaryPreferred": ReadPreference.SECONDARY_PREFERRED,
+    "nearest": ReadPreference.NEAREST,
+}
+
+MONGO_COMMAND_SECONDS = registry.histogram(
+    "coffee_mongo_command_seconds",
+    "Thời gian thực thi lệnh MongoDB",
+    ["command", "collection"],
+)
+MONGO_COMMAND_FAILURES = registry.counter(
+    "coffee_mongo_command_failures_total",
+    "Số lệnh MongoDB bị lỗi",
+    ["command", "collection"],
+)
+MONGO_SLOW_COMMANDS = registry.counter(
+    "coffee_mongo_slow_commands_total",
+    "Số lệnh MongoDB chậm hơn MONGO_SLOW_QUERY_MS",
+    ["command", "collection"],
+)
+
+# Các lệnh nội bộ của driver không cần đo
+_IGNORED_COMMANDS = {"hello", "ismaster", "isMaster", "ping", "saslStart", "saslContinue", "endSessions"}
+
+
+class CommandMetrics(monitoring.CommandListener):
+    """
+    Ghi lại độ trễ của từng lệnh MongoDB theo tên lệnh và collection, cùng
+    các truy vấn chậm gần nhất.
+    """
+
+    def __init__(self, slow_ms=MONGO_SLOW_QUERY_MS, keep_slow=50):
+        self.slow_ms = slow_ms
+        self._collections = {}
+        self._lock = threading.Lock()
+        self._slow = deque(maxlen=keep_slow)
+
+    def _key(self, event):
+        return (event.connection_id, event.request_id)
+
+    def started(self, event):
+        if event.command_name in _IGNORED_COMMANDS:
+            return
+        collection = event.command.get(event.command_name)
+        with self._lock:
+            self._collections[self._key(event)] = collection if isinstance(collection, str) else ""
+
+    def _finish(self, event):
+        with self._lock:
+            return self._collections.pop(self._key(event), None)
+
+    def succeeded(self, event):
+        collection = self._finish(event)
+        if collection is None:
+            return
+        seconds = event.duration_micros / 1e6
+        MONGO_COMMAND_SECONDS.observe(seconds, command=event.command_name, collection=collection)
+        if seconds * 1000.0 >= self.slow_ms:
+            MONGO_SLOW_COMMANDS.inc(command=event.command_name, collection=collection)
+            logger.warning("Slow MongoDB %s on '%s': %.1fms", event.command_name, collection, seconds * 1000.0)
+            with self._lock:
+                self._slow.append({
+                    "command": event.command_name,
+                    "collection": collection,
+                    "ms": seconds * 1000.0,
+                    "at": time.time(),
+                })
+
+    def failed(self, event):
+        collection = self._finish(event)
+        if collection is None:
+            return
+        MONGO_COMMAND_SECONDS.observe(event.duration_micros / 1e6, command=event.command_name, collection=collection)
+        MONGO_COMMAND_FAILURES.inc(command=event.command_name, collection=collection)
+
+    def slow_commands(self):
+        with self._lock:
+            return list(self._slow)
+
+
+command_metrics = CommandMetrics()
+
+
+def mongo_settings(host):
+    """MONGODB_SETTINGS cho Flask-MongoEngine với pool, timeout và bộ đo lệnh."""
+    return {
+        "host": host,
+        # Chỉ kết nối khi có lệnh đầu tiên (an toàn khi gunicorn fork worker)
+        "connect": False,
+        "maxPoolSize": MONGO_MAX_POOL_SIZE,
+        "minPoolSize": MONGO_MIN_POOL_SIZE,
+        "maxIdleTimeMS": MONGO_MAX_IDLE_TIME_MS,
+        "waitQueueTimeoutMS": MONGO_WAIT_QUEUE_TIMEOUT_MS,
+        "connectTimeoutMS": MONGO_CONNECT_TIMEOUT_MS,
+        "socketTimeoutMS": MONGO_SOCKET_TIMEOUT_MS,
+        "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        "read_preference": _READ_PREFERENCES[MONGO_READ_PREFERENCE],
+        "event_listeners": [command_metrics],
+    }
+
+
+# --- Index cần cho các truy vấn ---
+
+def _required_indexes():
+    """
+    (Document, khóa index, unique) mà các truy vấn của ứng dụng dựa vào.
+    """
+    from models import User, Scan
+
+    return [
+        (User, [("email", 1)], True),
+        # /history: lịch sử của một người dùng theo _id giảm dần
+        (Scan, [("user", 1), ("_id", -1)], False),
+    ]
+
+
+def bootstrap_indexes():
+    """
+    Tạo các index khai báo trên Document (nếu chưa có) rồi kiểm tra đủ các
+    index mà truy vấn cần. Returns: danh sách index còn thiếu (rỗng = đủ).
+    Lỗi kết nối chỉ được ghi log để server vẫn khởi động được.
+    """
+    missing = []
+    try:
+        for document, keys, unique in _required_indexes():
+            document.ensure_indexes()
+            indexes = document._get_collection().index_information()
+            found = any(
+                [tuple(k) for k in info["key"]] == [tuple(k) for k in keys]
+                and bool(info.get("unique")) == unique
+                for info in indexes.values()
+            )
+            if not found:
+                missing.append(f"{document._get_collection_name()}: {keys} unique={unique}")
+    except Exception as e:
+        logger.error("Không kiểm tra được index MongoDB: %s", e)
+        return None
+
+    for index in missing:
+        logger.error("Thiếu index MongoDB: %s", index)
+    if not missing:
+        logger.info("Đã kiểm tra index MongoDB")
+    return missing
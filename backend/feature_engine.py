@@ -0,0 +1,195 @@
+import os
+
+import cv2
+import numpy as np
+
+from image_context import ImageContext
+from metrics import stage_timer
+
+# ============ Đặc trưng thủ công của ảnh lá ============
+#
+# Màu sắc, kết cấu, gân lá, hình dạng và các yếu tố môi trường dùng cho bộ lọc
+# nhận diện lá trước khi chạy model. Bộ lọc Gabor được dựng một lần lúc import,
+# các tỉ lệ màu đọc từ histogram HSV, và cạnh Canny dùng chung một lần Sobel.
+
+# Cạnh dài tối đa (px) của ảnh dùng cho các đặc trưng thủ công (màu, kết cấu,
+# gân lá, môi trường). 0 = phân tích trên ảnh gốc. Ví dụ 512 giúp chi phí không
+# còn tăng theo số megapixel của ảnh chụp.
+ANALYSIS_MAX_SIDE = int(os.environ.get("ANALYSIS_MAX_SIDE", "0"))
+
+# Thứ tự các đặc trưng trong vector lưu cùng lịch sử quét (Scan.features)
+FEATURE_NAMES = (
+    'green_ratio',
+    'brown_ratio',
+    'avg_saturation',
+    'avg_texture',
+    'vein_count',
+    'solidity',
+    'circularity',
+    'aspect_ratio',
+    'shadow_ratio',
+    'highlight_ratio',
+    'edge_density',
+)
+
+# --- Bộ lọc Gabor 4 hướng, dựng sẵn ---
+GABOR_KSIZE = 21
+GABOR_BANK = np.stack([
+    cv2.getGaborKernel((GABOR_KSIZE, GABOR_KSIZE), 5, theta, 10, 0.5, 0)
+    for theta in np.arange(0, np.pi, np.pi/4)
+])
+# Tích chập tuyến tính nên trung bình 4 đáp ứng = đáp ứng của kernel trung bình
+GABOR_MEAN_KERNEL = GABOR_BANK.mean(axis=0)
+_GABOR_TAPS = np.indices(GABOR_MEAN_KERNEL.shape)
+
+
+def _scaled(value, scale, minimum=1):
+    """Quy đổi một ngưỡng tính theo pixel của ảnh gốc sang độ phân giải phân tích."""
+    return max(minimum, int(round(value * scale)))
+
+
+def gabor_texture(gray):
+    """
+    Trung bình đáp ứng của bộ lọc Gabor trên toàn ảnh (bằng trung bình của 4
+    lần filter2D với viền BORDER_REFLECT_101).
+
+    Chỉ cần giá trị trung bình nên không phải tích chập cả ảnh: mỗi hệ số của
+    kernel nhân với tổng của một cửa sổ ảnh đã dịch, tổng này đọc từ ảnh tích
+    phân. Chi phí là một lần cv2.integral cộng 21x21 phép tra bảng.
+    """
+    height, width = gray.shape
+    pad = GABOR_KSIZE // 2
+    padded = cv2.copyMakeBorder(gray, pad, pad, pad, pad, cv2.BORDER_REFLECT_101)
+    integral = cv2.integral(padded, sdepth=cv2.CV_64F)
+
+    rows, cols = _GABOR_TAPS
+    window_sums = (
+        integral[rows + height, cols + width] - integral[rows, cols + width]
+        - integral[rows + height, cols] + integral[rows, cols]
+    )
+    return float((GABOR_MEAN_KERNEL * window_sums).sum() / (height * width))
+
+
+def hsv_histograms(ctx):
+    """
+    Histogram của 3 kênh H (180 bin), S và V (256 bin), tính một lần cho mỗi
+    ảnh và dùng chung cho mọi tỉ lệ màu.
+    """
+    def compute():
+        hsv = ctx.hsv
+        return tuple(
+            cv2.calcHist([hsv], [channel], None, [bins], [0, bins]).ravel().astype(np.float64)
+            for channel, bins in ((0, 180), (1, 256), (2, 256))
+        )
+
+    return ctx.cached("hsv_histograms", compute)
+
+
+@stage_timer("extract_leaf_features")
+def extract_leaf_features(image, analysis_max_side=ANALYSIS_MAX_SIDE):
+    """
+    Trích xuất đặc trưng của lá cây một cách chi tiết hơn
+    Các ngưỡng tính theo pixel được quy đổi theo độ phân giải phân tích.
+    """
+    ctx = ImageContext.of(image).downscaled(analysis_max_side)
+    scale = ctx.scale
+    num_pixels = ctx.num_pixels
+
+    # 1. Phân tích màu sắc trong HSV (histogram dùng chung với detect_environmental_artifacts)
+    hue_hist, sat_hist, _ = hsv_histograms(ctx)
+
+    # Dải màu xanh lá cây trong HSV (35-85 độ)
+    green_ratio = hue_hist[35:86].sum() / num_pixels
+
+    # Dải màu nâu/vàng (15-35 độ) - lá khô hoặc bệnh
+    brown_ratio = hue_hist[15:36].sum() / num_pixels
+
+    # 2. Phân tích độ bão hòa
+    avg_saturation = float(np.dot(sat_hist, np.arange(256)) / num_pixels)
+
+    # 3. Phân tích kết cấu (texture) bằng bộ lọc Gabor
+    # (giá trị trung bình của đáp ứng gần như không đổi theo độ phân giải nên
+    # giữ nguyên kernel)
+    avg_texture = gabor_texture(ctx.gray)
+
+    # 4. Phát hiện gân lá
+    edges = ctx.edges(50, 150)
+
+    # Hough transform để tìm đường thẳng (gân lá)
+    # Ngưỡng phiếu, độ dài tối thiểu và khoảng hở được co theo tỉ lệ ảnh để vẫn
+    # tìm cùng các gân có kích thước thực như trên ảnh gốc, nên vein_count so
+    # sánh được với các ngưỡng trong is_coffee_leaf_advanced
+    lines = cv2.HoughLinesP(
+        edges, 1, np.pi/180, _scaled(50, scale, minimum=10),
+        minLineLength=_scaled(30, scale), maxLineGap=_scaled(10, scale)
+    )
+    vein_count = len(lines) if lines is not None else 0
+
+    # 5. Phân tích hình dạng tổng thể
+    # Tìm contour lớn nhất
+    contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    if contours:
+        largest_contour = max(contours, key=cv2.contourArea)
+
+        # Tính các đặc trưng hình học
+        area = cv2.contourArea(largest_contour)
+        perimeter = cv2.arcLength(largest_contour, True)
+
+        # Solidity: tỷ lệ diện tích contour / diện tích convex hull
+        hull = cv2.convexHull(largest_contour)
+        hull_area = cv2.contourArea(hull)
+        solidity = area / hull_area if hull_area > 0 else 0
+
+        # Circularity: độ tròn của hình dạng
+        circularity = 4 * np.pi * area / (perimeter ** 2) if perimeter > 0 else 0
+
+        # Aspect ratio
+        x, y, w, h = cv2.boundingRect(largest_contour)
+        aspect_ratio = float(w) / h if h > 0 else 0
+    else:
+        solidity = 0
+        circularity = 0
+        aspect_ratio = 0
+
+    return {
+        'green_ratio': green_ratio,
+        'brown_ratio': brown_ratio,
+        'avg_saturation': avg_saturation,
+        'avg_texture': avg_texture,
+        'vein_count': vein_count,
+        'solidity': solidity,
+        'circularity': circularity,
+        'aspect_ratio': aspect_ratio
+    }
+
+
+def environmental_ratios(image, analysis_max_side=ANALYSIS_MAX_SIDE):
+    """Tỉ lệ vùng tối, vùng chói và mật độ cạnh của ảnh."""
+    ctx = ImageContext.of(image).downscaled(analysis_max_side)
+    num_pixels = ctx.num_pixels
+    _, _, value_hist = hsv_histograms(ctx)
+
+    return {
+        'shadow_ratio': value_hist[0:51].sum() / num_pixels,
+        'highlight_ratio': value_hist[230:256].sum() / num_pixels,
+        'edge_density': cv2.countNonZero(ctx.edges(100, 200)) / num_pixels,
+    }
+
+
+@stage_timer("detect_environmental_artifacts")
+def detect_environmental_artifacts(image, analysis_max_side=ANALYSIS_MAX_SIDE):
+    """
+    Phát hiện các yếu tố môi trường có thể gây nhiễu
+    """
+    ratios = environmental_ratios(image, analysis_max_side)
+
+    return {
+        # 1. Bóng đổ
+        'has_shadow': ratios['shadow_ratio'] > 0.2,
+        # 2. Phản chiếu ánh sáng
+        'has_highlight': ratios['highlight_ratio'] > 0.1,
+        # 3. Nền phức tạp
+        'complex_background': ratios['edge_density'] > 0.3
+    }
+
@@ -0,0 +1,200 @@
+import email.utils
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+import requests
+from google.auth import jwt
+
+logger = logging.getLogger(__name__)
+
+# ============ Xác thực Google ID token với khóa được cache ============
+#
+# id_token.verify_oauth2_token tải lại chứng chỉ của Google ở mỗi lần gọi (một
+# round-trip ra ngoài trên đường đăng nhập). Ở đây chứng chỉ được giữ trong
+# bộ nhớ của process theo Cache-Control của Google, làm mới trong nền trước
+# khi hết hạn, tải qua một requests.Session dùng chung, và token được xác thực
+# cục bộ bằng google.auth.jwt.
+
+# Nguồn chứng chỉ (định dạng {kid: PEM}); có thể trỏ tới server giả lập khi test
+GOOGLE_CERTS_URL = os.environ.get("GOOGLE_CERTS_URL", "https://www.googleapis.com/oauth2/v1/certs")
+# File chứng chỉ cục bộ (cùng định dạng JSON), dùng thay cho URL khi chạy offline
+GOOGLE_CERTS_FILE = os.environ.get("GOOGLE_CERTS_FILE", "")
+# Thời gian cache mặc định khi phản hồi không có Cache-Control (giây)
+GOOGLE_CERTS_DEFAULT_TTL = float(os.environ.get("GOOGLE_CERTS_DEFAULT_TTL", "3600"))
+# Làm mới trong nền khi chứng chỉ còn hạn ít hơn khoảng này (giây)
+GOOGLE_CERTS_REFRESH_AHEAD = float(os.environ.get("GOOGLE_CERTS_REFRESH_AHEAD", "300"))
+# Khoảng cách tối thiểu giữa hai lần tải lại do gặp kid lạ (giây)
+GOOGLE_CERTS_MIN_REFRESH_INTERVAL = float(os.environ.get("GOOGLE_CERTS_MIN_REFRESH_INTERVAL", "30"))
+GOOGLE_CERTS_TIMEOUT = float(os.environ.get("GOOGLE_CERTS_TIMEOUT", "5"))
+# Độ lệch đồng hồ cho phép khi kiểm tra iat/exp (giây)
+GOOGLE_CLOCK_SKEW = int(os.environ.get("GOOGLE_CLOCK_SKEW", "0"))
+
+GOOGLE_ISSUERS = ("accounts.google.com", "https://accounts.google.com")
+
+_MAX_AGE = re.compile(r"max-age=(\d+)")
+
+
+def _cache_seconds(response):
+    """Thời gian được phép cache phản hồi theo Cache-Control (trừ Age), hoặc Expires."""
+    cache_control = response.headers.get("Cache-Control", "")
+    if "no-store" in cache_control or "no-cache" in cache_control:
+        return 0.0
+    match = _MAX_AGE.search(cache_control)
+    if match:
+        age = float(response.headers.get("Age", "0") or 0)
+        return max(0.0, float(match.group(1)) - age)
+    expires = response.headers.get("Expires")
+    if expires:
+        try:
+            return max(0.0, email.utils.parsedate_to_datetime(expires).timestamp() - time.time())
+        except (TypeError, ValueError):
+            pass
+    return GOOGLE_CERTS_DEFAULT_TTL
+
+
+class GoogleTokenVerifier:
+    """
+    Xác thực Google ID token cục bộ. Chứng chỉ được dùng chung cho mọi thread
+    của process và chỉ tải lại khi hết hạn (hoặc khi Google đổi khóa).
+    """
+
+    def __init__(self, certs_url=GOOGLE_CERTS_URL, certs_file=GOOGLE_CERTS_FILE,
+                 refresh_ahead=GOOGLE_CERTS_REFRESH_AHEAD, clock_skew=GOOGLE_CLOCK_SKEW):
+        self.certs_url = certs_url
+        self.certs_file = certs_file
+        self.refresh_ahead = refresh_ahead
+        self.clock_skew = clock_skew
+        self.session = requests.Session()
+
+        self._certs = {}
+        self._expires_at = 0.0
+        self._fetched_at = 0.0
+        # Lần thử tải gần nhất (kể cả lỗi), để giới hạn tải lại khi gặp kid lạ
+        self._attempted_at = 0.0
+        self._lock = threading.Lock()
+        # Chỉ một lần tải chứng chỉ tại một thời điểm (các thread khác chờ và dùng kết quả)
+        self._refresh_lock = threading.Lock()
+        self._refreshing = False
+
+        self._fetches = 0
+        self._fetch_errors = 0
+
+    def _load(self):
+        """Đọc chứng chỉ từ file hoặc URL. Returns: (certs, số giây được cache)."""
+        if self.certs_file:
+            with open(self.certs_file, "r", encoding="utf-8") as f:
+                return json.load(f), GOOGLE_CERTS_DEFAULT_TTL
+        response = self.session.get(self.certs_url, timeout=GOOGLE_CERTS_TIMEOUT)
+        response.raise_for_status()
+        return response.json(), _cache_seconds(response)
+
+    def refresh(self):
+        """Tải lại chứng chỉ ngay (đồng bộ)."""
+        with self._lock:
+            self._attempted_at = time.monotonic()
+        try:
+            certs, ttl = self._load()
+        except Exception:
+            with self._lock:
+                self._fetch_errors += 1
+                self._refreshing = False
+            raise
+        now = time.monotonic()
+        with self._lock:
+            self._certs = certs
+            self._fetched_at = now
+            self._expires_at = now + ttl
+            self._fetches += 1
+            self._refreshing = False
+        return certs
+
+    def _refresh_in_background(self):
+        def run():
+            try:
+                with self._refresh_lock:
+                    self.refresh()
+            except Exception as e:
+                # Chứng chỉ cũ vẫn còn hạn, lần sau sẽ thử lại
+                logger.warning("Không làm mới được chứng chỉ Google: %s", e)
+
+        threading.Thread(target=run, name="google-certs-refresh", daemon=True).start()
+
+    def certs(self):
+        """Chứng chỉ hiện tại; chỉ chặn request khi chưa có hoặc đã hết hạn."""
+        now = time.monotonic()
+        with self._lock:
+            certs = self._certs
+            remaining = self._expires_at - now
+            start_background = (
+                certs and 0 < remaining < self.refresh_ahead and not self._refreshing
+            )
+            if start_background:
+                self._refreshing = True
+        if certs and remaining > 0:
+            if start_background:
+                self._refresh_in_background()
+            return certs
+        with self._refresh_lock:
+            with self._lock:
+                # Thread khác có thể vừa tải xong trong lúc chờ khóa
+                if self._certs and self._expires_at > time.monotonic():
+                    return self._certs
+                certs = self._certs
+            try:
+                return self.refresh()
+            except Exception as e:
+                if not certs:
+                    raise
+                # Google xoay khóa theo ngày, dùng tạm khóa cũ khi không tải được
+                logger.warning("Không tải được chứng chỉ Google, dùng bản cũ: %s", e)
+                return certs
+
+    def _certs_for(self, token):
+        certs = self.certs()
+        kid = jwt.decode_header(token).get("kid")
+        if kid and kid not in certs:
+            # Google đã xoay khóa: tải lại ngay (một lần cho mọi thread đang chờ),
+            # nhưng không quá thường xuyên
+            with self._refresh_lock:
+                with self._lock:
+                    certs = self._certs
+                    recently = time.monotonic() - self._attempted_at < GOOGLE_CERTS_MIN_REFRESH_INTERVAL
+                if kid not in certs and not recently:
+                    try:
+                        certs = self.refresh()
+                    except Exception as e:
+                        # Giữ khóa cũ: token có kid lạ sẽ bị từ chối (ValueError -> 401)
+                        logger.warning("Không tải lại được chứng chỉ Google: %s", e)
+        return certs
+
+    def verify(self, token, audience):
+        """
+        Tương đương id_token.verify_oauth2_token nhưng không tải chứng chỉ mỗi lần.
+        Raises: ValueError khi token không hợp lệ.
+        """
+        id_info = jwt.decode(
+            token,
+            certs=self._certs_for(token),
+            audience=audience,
+            clock_skew_in_seconds=self.clock_skew,
+        )
+        if id_info.get("iss") not in GOOGLE_ISSUERS:
+            raise ValueError(f"Wrong issuer. 'iss' should be one of {GOOGLE_ISSUERS} but got '{id_info.get('iss')}'")
+        return id_info
+
+    def stats(self):
+        with self._lock:
+            return {
+                "source": self.certs_file or self.certs_url,
+                "keys": len(self._certs),
+                "expires_in_seconds": max(0.0, self._expires_at - time.monotonic()) if self._certs else 0.0,
+                "fetches": self._fetches,
+                "fetch_errors": self._fetch_errors,
+            }
+
+
+google_verifier = GoogleTokenVerifier()
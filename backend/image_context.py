@@ -0,0 +1,180 @@
+import io
+from functools import cached_property
+
+import cv2
+import numpy as np
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+# ============ Ngữ cảnh ảnh dùng chung cho một request ============
+#
+# Một request /predict cần ảnh ở nhiều dạng (RGB, gray, HSV, LAB, cạnh Canny,
+# ảnh đã resize 224x224...). ImageContext tính mỗi dạng đúng một lần, chỉ khi
+# được dùng tới, và chia sẻ cho tất cả các bước xử lý.
+
+
+class ImageContext:
+    """
+    Bộ đệm các biểu diễn của một ảnh RGB trong phạm vi một request
+    """
+
+    def __init__(self, image):
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        self.image = image
+        # Tỉ lệ kích thước so với ảnh gốc của request (1.0 = ảnh gốc)
+        self.scale = 1.0
+        self._edges = {}
+        self._values = {}
+
+    @classmethod
+    def of(cls, image):
+        """Trả về chính ngữ cảnh nếu đã có, hoặc bọc ảnh PIL thành ngữ cảnh mới."""
+        return image if isinstance(image, cls) else cls(image)
+
+    @property
+    def size(self):
+        """Kích thước (width, height) của ảnh gốc."""
+        return self.image.size
+
+    @property
+    def num_pixels(self):
+        width, height = self.image.size
+        return width * height
+
+    @cached_property
+    def rgb(self):
+        return np.asarray(self.image)
+
+    @cached_property
+    def gray(self):
+        return cv2.cvtColor(self.rgb, cv2.COLOR_RGB2GRAY)
+
+    @cached_property
+    def hsv(self):
+        return cv2.cvtColor(self.rgb, cv2.COLOR_RGB2HSV)
+
+    @cached_property
+    def lab(self):
+        return cv2.cvtColor(self.rgb, cv2.COLOR_RGB2LAB)
+
+    @cached_property
+    def laplacian_var(self):
+        """Phương sai Laplacian của ảnh gray (độ nét)."""
+        return float(cv2.Laplacian(self.gray, cv2.CV_64F).var())
+
+    @cached_property
+    def sobel(self):
+        """Gradient Sobel (dx, dy) của ảnh gray, đúng như Canny tự tính bên trong."""
+        dx = cv2.Sobel(self.gray, cv2.CV_16S, 1, 0, ksize=3, borderType=cv2.BORDER_REPLICATE)
+        dy = cv2.Sobel(self.gray, cv2.CV_16S, 0, 1, ksize=3, borderType=cv2.BORDER_REPLICATE)
+        return dx, dy
+
+    def edges(self, threshold1, threshold2):
+        """
+        Ảnh cạnh Canny trên ảnh gray, được lưu lại theo từng cặp ngưỡng.
+        Gradient Sobel được tính một lần và dùng chung cho mọi cặp ngưỡng.
+        """
+        key = (threshold1, threshold2)
+        if key not in self._edges:
+            dx, dy = self.sobel
+            self._edges[key] = cv2.Canny(dx, dy, threshold1, threshold2)
+        return self._edges[key]
+
+    def downscaled(self, max_side):
+        """
+        Ngữ cảnh của ảnh thu nhỏ sao cho cạnh dài không vượt quá max_side.
+        Trả về chính ngữ cảnh này nếu max_side = 0 hoặc ảnh đã đủ nhỏ.
+        """
+        width, height = self.size
+        if not max_side or max(width, height) <= max_side:
+            return self
+
+        def compute():
+            ratio = max_side / max(width, height)
+            new_size = (max(1, round(width * ratio)), max(1, round(height * ratio)))
+            small = cv2.resize(self.rgb, new_size, interpolation=cv2.INTER_AREA)
+            child = ImageContext(Image.fromarray(small))
+            child.scale = self.scale * ratio
+            return child
+
+        return self.cached(("downscaled", max_side), compute)
+
+    def cached(self, key, compute):
+        """
+        Lưu kết quả của một bước xử lý (chất lượng ảnh, ảnh resize...) để các
+        bước sau dùng lại thay vì tính lại.
+        """
+        if key not in self._values:
+            self._values[key] = compute()
+        return self._values[key]
+
+    def peek(self, key, default=None):
+        """Kết quả đã lưu bằng cached(), không tính nếu chưa có."""
+        return self._values.get(key, default)
+
+
+
+# ============ Đọc và giải mã ảnh tải lên ============
+
+class ImageRejected(ValueError):
+    """Ảnh tải lên không hợp lệ hoặc vượt quá giới hạn cho phép."""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def read_upload(stream, max_bytes=0):
+    """Đọc nội dung file tải lên, dừng ngay khi vượt quá max_bytes (0 = không giới hạn)."""
+    if not max_bytes:
+        return stream.read()
+    data = stream.read(max_bytes + 1)
+    if len(data) > max_bytes:
+        raise ImageRejected(f"File ảnh vượt quá giới hạn {max_bytes} byte", 413)
+    return data
+
+
+def image_pixels(data):
+    """Số pixel của ảnh đọc từ header (chưa giải mã), 0 nếu không đọc được."""
+    try:
+        width, height = Image.open(io.BytesIO(data)).size
+    except Exception:
+        return 0
+    return width * height
+
+
+def decode_image(data, max_side=0, max_pixels=0):
+    """
+    Giải mã ảnh tải lên thành ImageContext.
+    - Từ chối ảnh có số pixel lớn hơn max_pixels (đọc từ header, chưa giải mã)
+    - Với JPEG, dùng chế độ draft để giải mã trực tiếp ở tỉ lệ 1/2, 1/4, 1/8
+      nhỏ nhất mà cạnh dài vẫn không dưới max_side (0 = giữ độ phân giải gốc)
+    - Xoay ảnh theo EXIF orientation
+    """
+    try:
+        image = Image.open(io.BytesIO(data))
+    except Image.DecompressionBombError as e:
+        raise ImageRejected("Ảnh có độ phân giải quá lớn", 413) from e
+    except (UnidentifiedImageError, OSError) as e:
+        raise ImageRejected("Không đọc được file ảnh") from e
+
+    width, height = image.size
+    if max_pixels and width * height > max_pixels:
+        raise ImageRejected(
+            f"Ảnh có độ phân giải quá lớn ({width}x{height}), tối đa {max_pixels} pixel", 413
+        )
+
+    if max_side and max(width, height) > max_side:
+        ratio = max_side / max(width, height)
+        image.draft("RGB", (int(np.ceil(width * ratio)), int(np.ceil(height * ratio))))
+
+    try:
+        ImageOps.exif_transpose(image, in_place=True)
+        ctx = ImageContext(image)
+    except (OSError, SyntaxError) as e:
+        raise ImageRejected("File ảnh bị lỗi hoặc không đầy đủ") from e
+    # Ảnh gốc của request là ảnh trong file: ghi lại tỉ lệ mà draft đã giảm để
+    # các ngưỡng tính theo pixel (Hough, bilateral) không phụ thuộc DECODE_MAX_SIDE.
+    # Xoay EXIF chỉ đổi chỗ width/height nên cạnh dài không đổi.
+    ctx.scale = max(ctx.size) / max(width, height)
+    return ctx
@@ -0,0 +1,235 @@
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+import numpy as np
+
+from models import model_registry, MODEL_MODE
+from metrics import MODEL_BATCH_SIZE, MODEL_BATCH_SECONDS
+
+# ============ Gom batch (micro-batching) cho suy luận ============
+#
+# Keras predict() tốn một chi phí cố định khá lớn cho mỗi lần gọi, nên thay vì
+# chạy model với từng tensor 1x224x224x3 của từng request, các request đồng thời
+# được gom lại thành một batch và model chỉ chạy một lần cho cả batch.
+
+# Số ảnh tối đa trong một batch
+BATCH_MAX_SIZE = int(os.environ.get("BATCH_MAX_SIZE", "8"))
+# Thời gian chờ tối đa (ms) để gom thêm request sau request đầu tiên
+BATCH_MAX_WAIT_MS = float(os.environ.get("BATCH_MAX_WAIT_MS", "10"))
+# Số request tối đa được xếp hàng chờ suy luận
+BATCH_MAX_QUEUE = int(os.environ.get("BATCH_MAX_QUEUE", "256"))
+# Thời gian tối đa (giây) một request chờ kết quả suy luận
+INFERENCE_TIMEOUT_S = float(os.environ.get("INFERENCE_TIMEOUT_S", "30"))
+
+# Số batch gần nhất được giữ lại để tính phân vị độ trễ
+_LATENCY_WINDOW = 1000
+
+
+class QueueFullError(RuntimeError):
+    """Hàng đợi suy luận đã đầy, request cần được từ chối."""
+
+
+class _PendingRequest:
+    __slots__ = ("inputs", "future", "enqueued_at")
+
+    def __init__(self, inputs):
+        self.inputs = inputs
+        self.future = Future()
+        self.enqueued_at = time.perf_counter()
+
+
+def _percentile(values, q):
+    if not values:
+        return 0.0
+    return float(np.percentile(np.asarray(values), q))
+
+
+class BatchScheduler:
+    """
+    Gom các tensor đã tiền xử lý từ nhiều request thành batch và chạy model
+    một lần cho mỗi batch trên một thread riêng.
+    """
+
+    def __init__(self, name, lease_model, max_batch_size=BATCH_MAX_SIZE,
+                 max_wait_ms=BATCH_MAX_WAIT_MS, max_queue=BATCH_MAX_QUEUE):
+        self.name = name
+        # Hàm trả về context manager mượn phiên bản model đang phục vụ (model
+        # được tải nền và có thể được thay khi đang chạy nên lấy lúc chạy batch)
+        self.lease_model = lease_model
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+        # Thống kê để tinh chỉnh throughput / p99
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._requests = 0
+        self._rows = 0
+        self._rejected = 0
+        self._batch_sizes = {}
+        self._batch_latencies_ms = deque(maxlen=_LATENCY_WINDOW)
+        self._queue_waits_ms = deque(maxlen=_LATENCY_WINDOW)
+
+    def _ensure_started(self):
+        # Thread được khởi động khi có request đầu tiên (không chạy lúc import)
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name=f"batcher-{self.name}", daemon=True
+                )
+                self._thread.start()
+
+    def submit(self, inputs):
+        """
+        Đưa một tensor (N, ...) vào hàng đợi.
+        Returns: Future trả về kết quả dự đoán cho đúng N dòng đó.
+        """
+        self._ensure_started()
+        pending = _PendingRequest(np.asarray(inputs))
+        try:
+            self._queue.put_nowait(pending)
+        except queue.Full:
+            with self._stats_lock:
+                self._rejected += 1
+            raise QueueFullError(f"Hàng đợi suy luận '{self.name}' đã đầy")
+        return pending.future
+
+    def predict(self, inputs, timeout=INFERENCE_TIMEOUT_S, versions=None):
+        """
+        Tương đương model.predict(inputs) nhưng được gom batch.
+        versions: dict nhận phiên bản model đã chạy batch này (theo tên model).
+        """
+        future = self.submit(inputs)
+        try:
+            preds = future.result(timeout=timeout)
+        except FutureTimeoutError:
+            # Không ai chờ kết quả nữa: bỏ khỏi hàng đợi nếu chưa chạy
+            future.cancel()
+            raise
+        if versions is not None:
+            versions[self.name] = future.model_version
+        return preds
+
+    def _collect_batch(self):
+        items = []
+        rows = 0
+        deadline = None
+
+        while rows < self.max_batch_size:
+            if deadline is None:
+                item = self._queue.get()
+                deadline = time.perf_counter() + self.max_wait
+            else:
+                remaining = deadline - time.perf_counter()
+                try:
+                    if remaining > 0:
+                        item = self._queue.get(timeout=remaining)
+                    else:
+                        item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            # Bỏ qua request đã bị hủy khi còn trong hàng đợi (vd. dự đoán chạy trước
+            # không còn cần nữa)
+            if not item.future.set_running_or_notify_cancel():
+                continue
+            items.append(item)
+            rows += len(item.inputs)
+
+        return items, rows
+
+    def _run(self):
+        while True:
+            items, rows = self._collect_batch()
+            if items:
+                self._run_batch(items, rows)
+
+    def _run_batch(self, items, rows):
+        started = time.perf_counter()
+        try:
+            # Cả batch chạy trên cùng một phiên bản, phiên bản cũ chỉ được giải
+            # phóng sau khi batch này xong
+            with self.lease_model() as loaded:
+                if loaded is None:
+                    raise RuntimeError(f"Model '{self.name}' chưa sẵn sàng")
+                batch = np.concatenate([item.inputs for item in items], axis=0)
+                preds = loaded.model.predict(batch, verbose=0)
+                version = loaded.version
+        except Exception as e:
+            for item in items:
+                item.future.set_exception(e)
+            return
+
+        latency_ms = (time.perf_counter() - started) * 1000.0
+        MODEL_BATCH_SIZE.observe(rows, model=self.name)
+        MODEL_BATCH_SECONDS.observe(latency_ms / 1000.0, model=self.name)
+
+        # Trả kết quả về cho từng request theo đúng vị trí trong batch
+        # (model nhiều đầu ra: danh sách kết quả, mỗi đầu ra một phần tử)
+        offset = 0
+        for item in items:
+            n = len(item.inputs)
+            item.future.model_version = version
+            if isinstance(preds, (list, tuple)):
+                item.future.set_result([output[offset:offset + n] for output in preds])
+            else:
+                item.future.set_result(preds[offset:offset + n])
+            offset += n
+
+        with self._stats_lock:
+            self._batches += 1
+            self._requests += len(items)
+            self._rows += rows
+            self._batch_sizes[rows] = self._batch_sizes.get(rows, 0) + 1
+            self._batch_latencies_ms.append(latency_ms)
+            for item in items:
+                self._queue_waits_ms.append((started - item.enqueued_at) * 1000.0)
+
+    def stats(self):
+        """Thống kê kích thước batch, độ sâu hàng đợi và độ trễ mỗi batch."""
+        with self._stats_lock:
+            latencies = list(self._batch_latencies_ms)
+            waits = list(self._queue_waits_ms)
+            return {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000.0,
+                "queue_depth": self._queue.qsize(),
+                "batches": self._batches,
+                "requests": self._requests,
+                "rejected": self._rejected,
+                "avg_batch_size": self._rows / self._batches if self._batches else 0.0,
+                "batch_size_counts": dict(sorted(self._batch_sizes.items())),
+                "batch_latency_ms": {
+                    "p50": _percentile(latencies, 50),
+                    "p95": _percentile(latencies, 95),
+                    "p99": _percentile(latencies, 99),
+                },
+                "queue_wait_ms": {
+                    "p50": _percentile(waits, 50),
+                    "p95": _percentile(waits, 95),
+                    "p99": _percentile(waits, 99),
+                },
+            }
+
+
+# --- Bộ lập lịch cho từng model ---
+coffee_batcher = BatchScheduler("coffee", lambda: model_registry.lease("coffee"))
+disease_batcher = BatchScheduler("disease", lambda: model_registry.lease("disease"))
+fused_batcher = BatchScheduler("fused", lambda: model_registry.lease("fused"))
+
+
+def batching_stats():
+    """Thống kê của các bộ lập lịch đang dùng, cho /status."""
+    if MODEL_MODE == "fused":
+        return {"fused": fused_batcher.stats()}
+    return {
+        "coffee": coffee_batcher.stats(),
+        "disease": disease_batcher.stats(),
+    }
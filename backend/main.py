@@ -1,4 +1,5 @@
 import os
+import logging
 from flask import Flask
 from flask_cors import CORS
 from flask_mongoengine import MongoEngine
@@ -8,13 +9,23 @@ from dotenv import load_dotenv
 # Tải các biến môi trường từ file .env
 load_dotenv()
 
+# Cấu hình logging (LOG_LEVEL=DEBUG để xem log chi tiết của /predict)
+logging.basicConfig(
+    level=os.environ.get("LOG_LEVEL", "INFO").upper(),
+    format="%(asctime)s [%(levelname)s] %(name)s: %(message)s"
+)
+
 # Import models để MongoEngine nhận biết
-from models import User
+from models import User, Scan, model_registry, MODEL_LOADING
+from database import mongo_settings, bootstrap_indexes, MONGO_INDEX_BOOTSTRAP
 
 # Import blueprints
 from routes.home import home_bp
 from routes.auth import auth_bp # Kích hoạt lại blueprint mới
 from routes.predict import predict_bp
+from routes.metrics import metrics_bp
+from routes.history import history_bp
+from routes.admin import admin_bp
 
 app = Flask(__name__)
 
@@ -25,10 +36,8 @@ CORS(app, resources={r"/*": {"origins": "*"}})
 # --- Cấu hình ứng dụng ---
 # Tải khóa bí mật JWT từ biến môi trường
 app.config["JWT_SECRET_KEY"] = os.environ.get("JWT_SECRET_KEY")
-# Tải chuỗi kết nối MongoDB từ biến môi trường
-app.config["MONGODB_SETTINGS"] = {
-    "host": os.environ.get("MONGODB_URI")
-}
+# Tải chuỗi kết nối MongoDB từ biến môi trường (kèm cấu hình pool, timeout)
+app.config["MONGODB_SETTINGS"] = mongo_settings(os.environ.get("MONGODB_URI"))
 
 # --- Khởi tạo các extensions ---
 # Khởi tạo JWT Manager
@@ -41,6 +50,18 @@ db = MongoEngine(app)
 app.register_blueprint(home_bp)
 app.register_blueprint(auth_bp) # Đăng ký blueprint xác thực mới
 app.register_blueprint(predict_bp)
+app.register_blueprint(metrics_bp)
+app.register_blueprint(history_bp)
+app.register_blueprint(admin_bp)
+
+# --- Tạo / kiểm tra index MongoDB ---
+if MONGO_INDEX_BOOTSTRAP:
+    bootstrap_indexes()
+
+# --- Tải model ML trong nền ---
+# Server nhận request ngay, /predict trả 503 cho tới khi model sẵn sàng
+if MODEL_LOADING == "background":
+    model_registry.start_loading()
 
 
 if __name__ == "__main__":
@@ -48,6 +69,6 @@ if __name__ == "__main__":
     print("COFFEE CARE API SERVER - DATABASE & AUTH ENABLED")
     print("="*50)
     print("Backend đã được cấu hình cho MongoDB và JWT.")
-    print("Routes đã kích hoạt: /home, /auth, /predict")
+    print("Routes đã kích hoạt: /home, /auth, /predict, /metrics")
     print("="*50)
     app.run(host="0.0.0.0", port=5000, debug=True)
\ No newline at end of file
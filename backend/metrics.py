@@ -0,0 +1,205 @@
+import bisect
+import threading
+import time
+from contextlib import ContextDecorator
+
+# ============ Metrics dạng Prometheus ============
+#
+# Bộ đếm và histogram nhỏ gọn, xuất theo định dạng text của Prometheus tại
+# /metrics. Mỗi process (worker gunicorn) giữ số liệu riêng của mình.
+
+# Bucket mặc định cho thời gian xử lý (giây)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += bucket_count
+                    labels = _format_labels(self.labelnames, key, ("le", _format_value(bound)))
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = _format_labels(self.labelnames, key)
+                lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+                lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Gauge:
+    """
+    Metric đọc giá trị lúc xuất từ một hàm (vd. độ sâu hàng đợi, hoặc bộ đếm
+    sẵn có của module khác với metric_type="counter").
+    """
+
+    def __init__(self, name, documentation, labelnames, read, metric_type="gauge"):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        # read() trả về {tuple giá trị label: giá trị}
+        self.read = read
+        self.metric_type = metric_type
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+        for key, value in sorted(self.read().items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge(self, name, documentation, labelnames, read, metric_type="gauge"):
+        return self.register(Gauge(name, documentation, labelnames, read, metric_type))
+
+    def render(self):
+        """Toàn bộ metrics theo định dạng text của Prometheus."""
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+# --- Metrics của pipeline /predict ---
+PREDICT_STAGE_SECONDS = registry.histogram(
+    "coffee_predict_stage_seconds",
+    "Thời gian xử lý từng bước của pipeline /predict",
+    ["stage"],
+)
+PREDICT_REQUESTS = registry.counter(
+    "coffee_predict_requests_total",
+    "Số ảnh đã dự đoán theo kết quả",
+    ["outcome", "cached"],
+)
+MODEL_BATCH_SIZE = registry.histogram(
+    "coffee_model_batch_size",
+    "Số ảnh trong mỗi batch suy luận",
+    ["model"],
+    buckets=(1, 2, 4, 8, 16, 32, 64),
+)
+MODEL_BATCH_SECONDS = registry.histogram(
+    "coffee_model_batch_seconds",
+    "Thời gian chạy model cho mỗi batch",
+    ["model"],
+)
+
+
+# Hook của profiler (profiling.py) cho từng bước, None khi không profile
+_stage_hook = None
+
+
+def set_stage_hook(hook):
+    """Đặt (hoặc gỡ với None) đối tượng có stage_enter(stage) / stage_exit()."""
+    global _stage_hook
+    _stage_hook = hook
+
+
+class stage_timer(ContextDecorator):
+    """
+    Đo thời gian một bước của pipeline, dùng làm context manager hoặc decorator:
+
+        with stage_timer("decode"): ...
+
+        @stage_timer("extract_leaf_features")
+        def extract_leaf_features(...): ...
+    """
+
+    def __init__(self, stage, histogram=PREDICT_STAGE_SECONDS):
+        self.stage = stage
+        self.histogram = histogram
+
+    def _recreate_cm(self):
+        # Mỗi lần gọi hàm được decorate dùng một đối tượng riêng (an toàn đa luồng)
+        return type(self)(self.stage, self.histogram)
+
+    def __enter__(self):
+        self._hook = _stage_hook
+        if self._hook is not None:
+            self._hook.stage_enter(self.stage)
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self._started, stage=self.stage)
+        if self._hook is not None:
+            self._hook.stage_exit()
+        return False
@@ -1,8 +1,18 @@
-import tensorflow as tf
-from mongoengine import Document, StringField, DateTimeField, EmailField
-from werkzeug.security import generate_password_hash, check_password_hash
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from mongoengine import (
+    Document, StringField, DateTimeField, EmailField, ReferenceField, FloatField,
+    BooleanField, DictField, ListField, BinaryField,
+)
 import datetime
 
+from password_hashing import password_hasher
+
+logger = logging.getLogger(__name__)
+
 # --- Database Models (MongoDB) ---
 
 class User(Document):
@@ -13,25 +23,55 @@ class User(Document):
 
     def hash_password(self):
         """Mã hóa mật khẩu của người dùng và cập nhật trường mật khẩu."""
-        self.password = generate_password_hash(self.password)
+        # KDF chạy trên pool băm mật khẩu riêng, không chạy trên thread của request
+        self.password = password_hasher.hash(self.password)
 
     def check_password(self, password_to_check):
         """Kiểm tra xem mật khẩu được cung cấp có khớp với hash đã lưu không."""
         # Nếu người dùng không có mật khẩu (đăng nhập qua social), trả về False
         if not self.password:
             return False
-        return check_password_hash(self.password, password_to_check)
+        return password_hasher.verify(self.password, password_to_check)
+
+    def needs_rehash(self):
+        """Hash đã lưu dùng tham số KDF cũ và nên được băm lại khi đăng nhập."""
+        return bool(self.password) and password_hasher.needs_rehash(self.password)
+
+class Scan(Document):
+    """
+    Một lần chẩn đoán của người dùng (lịch sử quét). Được ghi theo lô bởi
+    scan_history.scan_writer, không ghi trực tiếp trên thread của request.
+    """
+    user = ReferenceField(User, required=True)
+    label = StringField(required=True)
+    confidence = FloatField()
+    isLeaf = BooleanField(default=False)
+    # Bước của cascade đã loại ảnh (nếu có)
+    rejectedBy = StringField()
+    qualityScore = FloatField()
+    # has_shadow / has_highlight / complex_background
+    environmental = DictField()
+    # Đặc trưng thủ công theo thứ tự feature_engine.FEATURE_NAMES (rỗng nếu
+    # pipeline dừng trước bước đặc trưng môi trường)
+    features = ListField(FloatField())
+    # Ảnh thu nhỏ JPEG
+    thumbnail = BinaryField()
+    createdAt = DateTimeField(default=datetime.datetime.utcnow)
+
+    meta = {
+        # Lịch sử của một người dùng, mới nhất trước (_id tăng theo thời gian tạo)
+        "indexes": [{"fields": ["user", "-id"]}],
+    }
 
 # --- Machine Learning Models ---
+#
+# TensorFlow và các model không được tải lúc import nữa: ModelRegistry tải
+# chúng trong một thread nền (hoặc khi có request đầu tiên), chạy một lần suy
+# luận warmup rồi mới báo sẵn sàng. Các process chỉ phục vụ /auth không phải
+# trả chi phí import TensorFlow.
 
 # 1) Model 1: Phân biệt coffee vs not_coffee
 MODEL_COFFEE_PATH = "coffee_vs_notcoffee.keras"
-try:
-    model_coffee = tf.keras.models.load_model(MODEL_COFFEE_PATH)
-    print("Model 1 (coffee vs not_coffee) đã được tải thành công.")
-except Exception as e:
-    print(f"Lỗi khi tải model_coffee: {e}")
-    model_coffee = None
 
 # 2) Model 2: Phân loại bệnh lá cà phê
 MODEL_DISEASE_PATH = "coffee_resnet50_model_final.h5"
@@ -43,9 +83,406 @@ LABELS_DISEASE = [
     "Bệnh gỉ sắt"
 ]
 
-try:
-    model_disease = tf.keras.models.load_model(MODEL_DISEASE_PATH)
-    print("Model 2 (bệnh lá cà phê) đã được tải thành công.")
-except Exception as e:
-    print(f"Lỗi khi tải model_disease: {e}")
-    model_disease = None
\ No newline at end of file
+# 3) Model hợp nhất (dựng bằng tools/build_fused_model.py): backbone ResNet50
+# của model bệnh với thêm một head coffee, đầu vào RGB 0..255, đầu ra
+# [prob_not_coffee, xác suất bệnh]
+MODEL_FUSED_PATH = "coffee_fused.keras"
+
+MODEL_INPUT_SHAPE = (224, 224, 3)
+
+# "separate": hai model coffee và bệnh, mỗi model một lần chạy
+# "fused": một lần chạy model hợp nhất cho cả hai (chỉ hỗ trợ file Keras)
+MODEL_MODE = os.environ.get("MODEL_MODE", "separate")
+
+# "background": bắt đầu tải ngay khi khởi động server
+# "lazy": chỉ tải khi có request đầu tiên cần tới model
+MODEL_LOADING = os.environ.get("MODEL_LOADING", "background")
+
+# Backend suy luận:
+# "keras": chạy model Keras gốc
+# "tflite": chạy file .tflite (cùng tên, đổi đuôi) đã export bằng tools/export_models.py
+MODEL_BACKEND = os.environ.get("MODEL_BACKEND", "keras")
+# Số thread của TFLite interpreter (0 = để TFLite tự chọn)
+TFLITE_NUM_THREADS = int(os.environ.get("TFLITE_NUM_THREADS", "0"))
+# Số thread intra-op / inter-op của TensorFlow (0 = mặc định của TF). Khi chạy
+# nhiều worker (serve.py), mỗi worker chỉ nên dùng phần CPU của mình.
+TF_INTRA_OP_THREADS = int(os.environ.get("TF_INTRA_OP_THREADS", "0"))
+TF_INTER_OP_THREADS = int(os.environ.get("TF_INTER_OP_THREADS", "0"))
+
+def configure_tf_threads():
+    """Đặt số thread của TensorFlow, phải gọi trước khi TF chạy op đầu tiên."""
+    if not TF_INTRA_OP_THREADS and not TF_INTER_OP_THREADS:
+        return
+    import tensorflow as tf
+    try:
+        if TF_INTRA_OP_THREADS:
+            tf.config.threading.set_intra_op_parallelism_threads(TF_INTRA_OP_THREADS)
+        if TF_INTER_OP_THREADS:
+            tf.config.threading.set_inter_op_parallelism_threads(TF_INTER_OP_THREADS)
+    except RuntimeError as e:
+        # TensorFlow đã khởi tạo runtime, không đổi được số thread nữa
+        logger.warning("Could not set TensorFlow thread counts: %s", e)
+
+def tflite_path(path):
+    """Đường dẫn file .tflite tương ứng với một file model Keras."""
+    return os.path.splitext(path)[0] + ".tflite"
+
+def backend_model_path(path, backend=MODEL_BACKEND):
+    """Đường dẫn file model sẽ được tải với backend đang chọn."""
+    return tflite_path(path) if backend == "tflite" else path
+
+class TFLiteModel:
+    """
+    Bọc TFLite interpreter với giao diện predict(batch) giống Keras model
+    Hỗ trợ cả model float và model lượng tử hóa int8 (tự quantize/dequantize).
+    """
+
+    def __init__(self, path, num_threads=TFLITE_NUM_THREADS):
+        # Ưu tiên LiteRT (gói ai_edge_litert, không cần TensorFlow), nếu không
+        # có thì dùng interpreter đi kèm TensorFlow
+        try:
+            from ai_edge_litert.interpreter import Interpreter
+        except ImportError:
+            import tensorflow as tf
+            Interpreter = tf.lite.Interpreter
+
+        self.path = path
+        self.interpreter = Interpreter(model_path=path, num_threads=num_threads or None)
+        self.interpreter.allocate_tensors()
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+        self._batch_size = int(self._input["shape"][0])
+
+    def _resize(self, batch_size):
+        if batch_size != self._batch_size:
+            shape = [batch_size] + list(self._input["shape"][1:])
+            self.interpreter.resize_tensor_input(self._input["index"], shape)
+            self.interpreter.allocate_tensors()
+            self._input = self.interpreter.get_input_details()[0]
+            self._output = self.interpreter.get_output_details()[0]
+            self._batch_size = batch_size
+
+    def predict(self, batch, verbose=0):
+        import numpy as np
+
+        self._resize(len(batch))
+        inputs = np.asarray(batch, dtype="float32")
+        scale, zero_point = self._input["quantization"]
+        if self._input["dtype"] != np.float32:
+            inputs = np.round(inputs / scale + zero_point)
+            info = np.iinfo(self._input["dtype"])
+            inputs = np.clip(inputs, info.min, info.max)
+        self.interpreter.set_tensor(self._input["index"], inputs.astype(self._input["dtype"]))
+        self.interpreter.invoke()
+
+        outputs = self.interpreter.get_tensor(self._output["index"])
+        scale, zero_point = self._output["quantization"]
+        if self._output["dtype"] != np.float32:
+            outputs = (outputs.astype("float32") - zero_point) * scale
+        return outputs
+
+def load_model(path):
+    """Tải model Keras (.keras/.h5) hoặc TFLite (.tflite) theo đuôi file."""
+    if path.endswith(".tflite"):
+        return TFLiteModel(path)
+    import tensorflow as tf
+    return tf.keras.models.load_model(path)
+
+# Kích thước batch của lần warmup thứ hai (batch đầu là 1 ảnh), nên bằng
+# BATCH_MAX_SIZE để lần chạy batch đầy đủ đầu tiên không phải dựng lại graph
+MODEL_WARMUP_BATCH = int(os.environ.get("MODEL_WARMUP_BATCH", os.environ.get("BATCH_MAX_SIZE", "8")))
+# Chu kỳ (giây) kiểm tra file model trên đĩa và tự tải lại khi file đổi
+# (0 = tắt). Với nhiều worker (serve.py) đây là cách cập nhật model cho mọi
+# worker mà không cần khởi động lại.
+MODEL_WATCH_INTERVAL_S = float(os.environ.get("MODEL_WATCH_INTERVAL_S", "0"))
+
+# --- Phiên bản model ---
+
+def _file_version(path):
+    """Phiên bản của file model, đổi mỗi khi file được ghi đè."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return "missing"
+    return f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+
+class LoadedModel:
+    """
+    Một phiên bản model đã tải. Đếm số batch đang dùng để phiên bản cũ chỉ
+    được giải phóng khi không còn batch nào chạy trên nó.
+    """
+
+    def __init__(self, name, model, path, version, load_seconds=0.0):
+        self.name = name
+        self.model = model
+        self.path = path
+        self.version = version
+        self.load_seconds = load_seconds
+        self.loaded_at = time.time()
+        self.in_use = 0
+        self.retired = False
+
+class ModelRegistry:
+    """
+    Tải các model ML ngoài luồng import và cho biết khi nào chúng sẵn sàng.
+    Model có thể được tải lại khi đang phục vụ: phiên bản mới được tải và
+    warmup trong nền, thay thế phiên bản cũ trong một bước, và phiên bản cũ
+    được giải phóng khi các batch đang chạy trên nó kết thúc.
+    """
+
+    def __init__(self, paths):
+        self.paths = dict(paths)
+        self._models = {}
+        self._draining = []
+        self._errors = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._done = threading.Event()
+        self._reload_lock = threading.Lock()
+        self._reloads = []
+        self._watcher = None
+        self._listeners = []
+
+    def start_loading(self):
+        """Bắt đầu tải model trong thread nền (gọi nhiều lần không sao)."""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._load_all, name="model-loader", daemon=True)
+                self._thread.start()
+
+    def _load_version(self, name, path):
+        """Tải model từ file và warmup, chưa đưa vào phục vụ."""
+        import numpy as np
+
+        started = time.perf_counter()
+        version = _file_version(path)
+        model = load_model(path)
+        # Warmup để request đầu tiên không phải chịu chi phí dựng graph
+        for batch_size in sorted({1, max(1, MODEL_WARMUP_BATCH)}):
+            model.predict(np.zeros((batch_size,) + MODEL_INPUT_SHAPE, dtype="float32"), verbose=0)
+        return LoadedModel(name, model, path, version, time.perf_counter() - started)
+
+    def _load_all(self):
+        if MODEL_BACKEND == "keras":
+            configure_tf_threads()
+
+        try:
+            for name, path in self.paths.items():
+                try:
+                    self._activate(self._load_version(name, path))
+                    logger.info("Model '%s' loaded from %s", name, path)
+                except Exception as e:
+                    logger.exception("Loading model '%s' from %s failed", name, path)
+                    self._errors[name] = str(e)
+        finally:
+            self._done.set()
+        self._start_watcher()
+
+    def on_activate(self, callback):
+        """
+        Đăng ký callback(loaded, previous) được gọi mỗi khi một phiên bản model
+        được đưa vào phục vụ (previous = phiên bản bị thay, None ở lần tải đầu).
+        """
+        self._listeners.append(callback)
+
+    def _activate(self, loaded):
+        """Đưa phiên bản mới vào phục vụ (batch tiếp theo dùng nó ngay)."""
+        with self._lock:
+            old = self._models.get(loaded.name)
+            self._models[loaded.name] = loaded
+            self.paths[loaded.name] = loaded.path
+            self._errors.pop(loaded.name, None)
+            if old is not None:
+                old.retired = True
+                if old.in_use:
+                    self._draining.append(old)
+                else:
+                    self._release(old)
+        for callback in self._listeners:
+            try:
+                callback(loaded, old)
+            except Exception:
+                logger.exception("Model activation callback failed for '%s'", loaded.name)
+
+    def _release(self, loaded):
+        # Gọi khi đang giữ self._lock
+        loaded.model = None
+        if loaded in self._draining:
+            self._draining.remove(loaded)
+        logger.info("Released model '%s' version %s", loaded.name, loaded.version)
+
+    @contextmanager
+    def lease(self, name):
+        """
+        Mượn phiên bản đang phục vụ của model trong lúc chạy một batch.
+        Yields: LoadedModel, hoặc None nếu model chưa tải.
+        """
+        with self._lock:
+            loaded = self._models.get(name)
+            if loaded is not None:
+                loaded.in_use += 1
+        try:
+            yield loaded
+        finally:
+            if loaded is not None:
+                with self._lock:
+                    loaded.in_use -= 1
+                    if loaded.retired and not loaded.in_use:
+                        self._release(loaded)
+
+    def reload(self, names=None, paths=None, wait=False):
+        """
+        Tải lại các model (mặc định: tất cả) từ file hiện tại hoặc từ `paths`
+        ({tên: đường dẫn mới}) trong thread nền. Model đang phục vụ không bị
+        ảnh hưởng nếu tải lỗi.
+        Returns: False nếu đang có một lần tải lại khác; True (hoặc kết quả
+        từng model khi wait=True) nếu đã bắt đầu.
+        """
+        paths = dict(paths or {})
+        names = list(names or paths or self.paths)
+        unknown = [name for name in names if name not in self.paths]
+        if unknown:
+            raise KeyError(f"Model không tồn tại: {', '.join(unknown)}")
+        if not self._reload_lock.acquire(blocking=False):
+            return False
+
+        results = {}
+
+        def run():
+            try:
+                for name in names:
+                    path = paths.get(name, self.paths[name])
+                    try:
+                        loaded = self._load_version(name, path)
+                        self._activate(loaded)
+                        results[name] = {"version": loaded.version, "load_seconds": loaded.load_seconds}
+                        logger.info("Model '%s' reloaded from %s (version %s)", name, path, loaded.version)
+                    except Exception as e:
+                        results[name] = {"error": str(e)}
+                        logger.error("Reloading model '%s' from %s failed: %s", name, path, e)
+                with self._lock:
+                    self._reloads.append({"at": time.time(), "results": dict(results)})
+                    del self._reloads[:-10]
+            finally:
+                self._reload_lock.release()
+
+        thread = threading.Thread(target=run, name="model-reloader", daemon=True)
+        thread.start()
+        if wait:
+            thread.join()
+            return results
+        return True
+
+    def _start_watcher(self):
+        if MODEL_WATCH_INTERVAL_S <= 0 or self._watcher is not None:
+            return
+        self._watcher = threading.Thread(target=self._watch, name="model-watcher", daemon=True)
+        self._watcher.start()
+
+    def _watch(self):
+        # Phiên bản file đã thử tải nhưng lỗi (không thử lại cho tới khi file đổi tiếp)
+        failed = {}
+        while True:
+            time.sleep(MODEL_WATCH_INTERVAL_S)
+            active = self.versions()
+            changed = [
+                name for name, path in self.paths.items()
+                if _file_version(path) not in ("missing", active.get(name), failed.get(name))
+            ]
+            if not changed:
+                continue
+            results = self.reload(changed, wait=True)
+            if results:
+                for name, result in results.items():
+                    if "error" in result:
+                        failed[name] = _file_version(self.paths[name])
+
+    @property
+    def loading(self):
+        """True khi quá trình tải chưa xong (hoặc chưa bắt đầu)."""
+        return not self._done.is_set()
+
+    def is_ready(self):
+        """Sẵn sàng phục vụ khi đã tải xong và không model nào bị lỗi."""
+        return self._done.is_set() and not self._errors
+
+    def wait_until_loaded(self, timeout=None):
+        self.start_loading()
+        return self._done.wait(timeout)
+
+    def use_models(self, models, version="stub"):
+        """Dùng các model có sẵn (vd. model giả trong benchmark) thay vì tải từ file."""
+        with self._lock:
+            self._models = {
+                name: LoadedModel(name, model, self.paths.get(name, ""), version)
+                for name, model in models.items()
+            }
+            self._errors = {}
+            if self._thread is None:
+                self._thread = threading.current_thread()
+        self._done.set()
+
+    def get(self, name):
+        """Model đang phục vụ, hoặc None nếu chưa tải xong / tải lỗi."""
+        loaded = self._models.get(name)
+        return loaded.model if loaded is not None else None
+
+    def versions(self):
+        """Phiên bản đang phục vụ của từng model đã tải."""
+        with self._lock:
+            return {name: loaded.version for name, loaded in self._models.items()}
+
+    def status(self):
+        if self._thread is None:
+            state = "not_started"
+        elif self.loading:
+            state = "loading"
+        else:
+            state = "ready" if not self._errors else "failed"
+        with self._lock:
+            models = {
+                name: {
+                    "loaded": name in self._models,
+                    "path": path,
+                    "version": self._models[name].version if name in self._models else None,
+                    "loaded_at": self._models[name].loaded_at if name in self._models else None,
+                    "load_seconds": self._models[name].load_seconds if name in self._models else None,
+                    "in_use": self._models[name].in_use if name in self._models else 0,
+                    "error": self._errors.get(name)
+                }
+                for name, path in self.paths.items()
+            }
+            draining = [
+                {"name": loaded.name, "version": loaded.version, "in_use": loaded.in_use}
+                for loaded in self._draining
+            ]
+            reloads = list(self._reloads)
+        return {
+            "state": state,
+            "backend": MODEL_BACKEND,
+            "models": models,
+            "draining": draining,
+            "reloading": self._reload_lock.locked(),
+            "recent_reloads": reloads,
+            "watch_interval_seconds": MODEL_WATCH_INTERVAL_S,
+        }
+
+if MODEL_MODE == "fused":
+    # TFLite interpreter chỉ trả một đầu ra nên model hợp nhất luôn dùng file Keras
+    model_registry = ModelRegistry({"fused": MODEL_FUSED_PATH})
+else:
+    model_registry = ModelRegistry({
+        "coffee": backend_model_path(MODEL_COFFEE_PATH),
+        "disease": backend_model_path(MODEL_DISEASE_PATH)
+    })
+
+def model_versions():
+    """
+    Phiên bản của các model đang phục vụ (dùng để vô hiệu hóa cache dự đoán).
+    Model chưa tải thì dùng phiên bản của file trên đĩa.
+    """
+    active = model_registry.versions()
+    return {
+        name: active.get(name) or _file_version(path)
+        for name, path in model_registry.paths.items()
+    }
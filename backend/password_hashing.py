@@ -0,0 +1,133 @@
+import inspect
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+from metrics import registry
+
+# ============ Pool riêng cho việc băm mật khẩu ============
+#
+# KDF của mật khẩu cố ý chậm (hàng trăm ms CPU mỗi lần). Nếu chạy trên thread
+# xử lý request, một đợt đăng ký dồn dập sẽ chiếm CPU của /predict trên cùng
+# worker. Ở đây việc băm chạy trên một pool có số thread cố định và hàng đợi
+# giới hạn, nên chi phí của nó bị chặn trên và đo được. hashlib nhả GIL khi
+# chạy pbkdf2/scrypt nên các thread này không chặn các thread khác.
+
+# Phương thức và tham số KDF theo cú pháp của werkzeug, vd. "pbkdf2:sha256:600000"
+# hoặc "scrypt:32768:8:1". Tham số được ghi trong chính chuỗi hash, hash cũ
+# được băm lại theo cấu hình mới khi người dùng đăng nhập. Rỗng (mặc định) =
+# mặc định của werkzeug đang cài (pbkdf2 trên 2.x, scrypt trên 3.x): nâng cấp
+# werkzeug không làm mọi hash bị băm lại về một KDF cũ hơn.
+PASSWORD_HASH_METHOD = os.environ.get("PASSWORD_HASH_METHOD", "")
+# Số thread băm mật khẩu tối đa chạy cùng lúc
+PASSWORD_HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS", "2"))
+# Số yêu cầu băm tối đa đang chờ + đang chạy; vượt quá thì từ chối ngay
+PASSWORD_HASH_MAX_QUEUE = int(os.environ.get("PASSWORD_HASH_MAX_QUEUE", "64"))
+# Thời gian tối đa một request chờ kết quả băm (giây)
+PASSWORD_HASH_TIMEOUT_S = float(os.environ.get("PASSWORD_HASH_TIMEOUT_S", "10"))
+
+PASSWORD_HASH_SECONDS = registry.histogram(
+    "coffee_password_hash_seconds",
+    "Thời gian chạy KDF của mật khẩu",
+    ["operation"],
+)
+PASSWORD_HASH_QUEUE_SECONDS = registry.histogram(
+    "coffee_password_hash_queue_seconds",
+    "Thời gian chờ trong hàng đợi băm mật khẩu",
+    ["operation"],
+)
+PASSWORD_HASH_FAILURES = registry.counter(
+    "coffee_password_hash_failures_total",
+    "Số yêu cầu băm mật khẩu bị từ chối (hàng đợi đầy) hoặc quá thời gian",
+    ["operation", "reason"],
+)
+
+
+def werkzeug_default_method():
+    """Phương thức mặc định của generate_password_hash trong werkzeug đang cài."""
+    return inspect.signature(generate_password_hash).parameters["method"].default
+
+
+class PasswordHashingBusy(RuntimeError):
+    """Pool băm mật khẩu đang quá tải (hàng đợi đầy hoặc quá thời gian chờ)."""
+
+
+class PasswordHasher:
+    """
+    Băm và kiểm tra mật khẩu trên pool riêng có giới hạn.
+    """
+
+    def __init__(self, method=PASSWORD_HASH_METHOD, workers=PASSWORD_HASH_WORKERS,
+                 max_queue=PASSWORD_HASH_MAX_QUEUE, timeout=PASSWORD_HASH_TIMEOUT_S):
+        self.method = method or werkzeug_default_method()
+        # Tiền tố đầy đủ mà werkzeug ghi vào hash (vd. "pbkdf2" -> "pbkdf2:sha256:600000")
+        self._prefix = None
+        self.workers = max(1, workers)
+        self.max_queue = max(self.workers, max_queue)
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(self.max_queue)
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="password-hash")
+        self._lock = threading.Lock()
+        self._pending = 0
+
+    def _run(self, operation, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            PASSWORD_HASH_FAILURES.inc(operation=operation, reason="queue_full")
+            raise PasswordHashingBusy("Hàng đợi băm mật khẩu đã đầy")
+
+        enqueued_at = time.perf_counter()
+
+        def task():
+            started = time.perf_counter()
+            PASSWORD_HASH_QUEUE_SECONDS.observe(started - enqueued_at, operation=operation)
+            try:
+                return fn(*args)
+            finally:
+                PASSWORD_HASH_SECONDS.observe(time.perf_counter() - started, operation=operation)
+
+        def release(_):
+            with self._lock:
+                self._pending -= 1
+            self._slots.release()
+
+        with self._lock:
+            self._pending += 1
+        future = self._executor.submit(task)
+        future.add_done_callback(release)
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            # Không hủy được KDF đang chạy, chỉ không chờ nữa (slot được trả khi xong)
+            future.cancel()
+            PASSWORD_HASH_FAILURES.inc(operation=operation, reason="timeout")
+            raise PasswordHashingBusy("Băm mật khẩu quá thời gian chờ")
+
+    def hash(self, password):
+        """Hash của mật khẩu theo cấu hình hiện tại (phương thức nằm trong hash)."""
+        return self._run("hash", generate_password_hash, password, self.method)
+
+    def verify(self, pwhash, password):
+        return self._run("verify", check_password_hash, pwhash, password)
+
+    def hash_prefix(self):
+        """
+        Phương thức và tham số đầy đủ mà werkzeug ghi vào hash theo cấu hình hiện
+        tại; lấy từ một lần băm thật (trên pool) vì tham số mặc định đổi theo phiên bản.
+        """
+        if self._prefix is None:
+            self._prefix = self._run("hash", generate_password_hash, "", self.method).split("$", 1)[0]
+        return self._prefix
+
+    def needs_rehash(self, pwhash):
+        """True nếu hash được tạo với phương thức / tham số khác cấu hình hiện tại."""
+        return pwhash.split("$", 1)[0] != self.hash_prefix()
+
+    def queue_depth(self):
+        with self._lock:
+            return self._pending
+
+
+password_hasher = PasswordHasher()
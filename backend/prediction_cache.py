@@ -0,0 +1,257 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# ============ Cache kết quả dự đoán theo nội dung ảnh ============
+#
+# Nông dân thường tải lại đúng bức ảnh cũ sau khi bị timeout. Kết quả JSON của
+# /predict được lưu theo hash nội dung file + phiên bản model, nên ảnh trùng
+# được trả lời ngay mà không phải chạy lại đặc trưng và hai model.
+
+# Số kết quả tối đa giữ trong bộ nhớ (0 = tắt cache)
+PREDICTION_CACHE_SIZE = int(os.environ.get("PREDICTION_CACHE_SIZE", "1024"))
+# Thời gian sống của một kết quả (giây)
+PREDICTION_CACHE_TTL = float(os.environ.get("PREDICTION_CACHE_TTL", "3600"))
+# Backend phụ dùng chung giữa các process: "memory" (không có), "disk" hoặc "redis"
+PREDICTION_CACHE_BACKEND = os.environ.get("PREDICTION_CACHE_BACKEND", "memory")
+# Thư mục (disk) hoặc URL (redis://...) của backend phụ
+PREDICTION_CACHE_URL = os.environ.get("PREDICTION_CACHE_URL", "")
+# Số file tối đa của backend disk, vượt quá thì xóa file cũ nhất (0 = không giới hạn)
+PREDICTION_CACHE_DISK_MAX_ENTRIES = int(os.environ.get("PREDICTION_CACHE_DISK_MAX_ENTRIES", "50000"))
+# Chu kỳ (giây) dọn file hết hạn / vượt giới hạn của backend disk
+PREDICTION_CACHE_DISK_PRUNE_S = float(os.environ.get("PREDICTION_CACHE_DISK_PRUNE_S", "300"))
+
+
+class DiskCacheBackend:
+    """
+    Lưu mỗi kết quả thành một file JSON, hết hạn theo thời gian sửa file.
+    Khóa chứa phiên bản model nên file của phiên bản cũ không bao giờ được đọc
+    lại; thư mục được dọn định kỳ (file hết hạn, rồi file cũ nhất khi vượt
+    max_entries) để không lớn mãi.
+    """
+
+    def __init__(self, directory, max_entries=PREDICTION_CACHE_DISK_MAX_ENTRIES,
+                 prune_interval=PREDICTION_CACHE_DISK_PRUNE_S):
+        self.directory = directory or os.path.join("cache", "predictions")
+        self.max_entries = max_entries
+        self.prune_interval = prune_interval
+        self._prune_lock = threading.Lock()
+        self._last_prune = time.monotonic()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key, ttl):
+        path = self._path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > ttl:
+                os.remove(path)
+                return None
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def set(self, key, value, ttl):
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(value, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        self._maybe_prune(ttl)
+
+    def _maybe_prune(self, ttl):
+        # Chỉ một thread dọn mỗi chu kỳ, các thread khác không phải chờ
+        if time.monotonic() - self._last_prune < self.prune_interval:
+            return
+        if not self._prune_lock.acquire(blocking=False):
+            return
+        try:
+            self._last_prune = time.monotonic()
+            self.prune(ttl)
+        finally:
+            self._prune_lock.release()
+
+    def prune(self, ttl):
+        """
+        Xóa file hết hạn, rồi file cũ nhất nếu còn nhiều hơn max_entries.
+        Returns: số file đã xóa.
+        """
+        now = time.time()
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if not entry.name.endswith(".json"):
+                    continue
+                try:
+                    entries.append((entry.stat().st_mtime, entry.path))
+                except FileNotFoundError:
+                    continue
+
+        expired = [path for mtime, path in entries if now - mtime > ttl]
+        live = sorted((e for e in entries if now - e[0] <= ttl), reverse=True)
+        excess = [path for _, path in live[self.max_entries:]] if self.max_entries > 0 else []
+
+        removed = 0
+        for path in expired + excess:
+            # Process khác có thể đã xóa file này
+            try:
+                os.remove(path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+        if removed:
+            logger.info("Pruned %d prediction cache files from %s", removed, self.directory)
+        return removed
+
+
+class RedisCacheBackend:
+    """Backend tương thích Redis (cần cài thêm gói `redis`)."""
+
+    def __init__(self, url, prefix="coffee:predict:"):
+        import redis
+        self.client = redis.Redis.from_url(url or "redis://localhost:6379/0")
+        self.prefix = prefix
+
+    def get(self, key, ttl):
+        raw = self.client.get(self.prefix + key)
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, key, value, ttl):
+        self.client.set(self.prefix + key, json.dumps(value, ensure_ascii=False), ex=max(1, int(ttl)))
+
+
+def _create_backend(name, url):
+    if name == "disk":
+        return DiskCacheBackend(url)
+    if name == "redis":
+        return RedisCacheBackend(url)
+    return None
+
+
+class PredictionCache:
+    """
+    LRU trong bộ nhớ có TTL, có thể kèm một backend phụ (disk/redis).
+    """
+
+    def __init__(self, max_entries=PREDICTION_CACHE_SIZE, ttl=PREDICTION_CACHE_TTL, backend=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.backend = backend
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        self._hits = 0
+        self._backend_hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._invalidations = 0
+        self._backend_errors = 0
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def make_key(self, data, versions, config=""):
+        """
+        Khóa cache = sha256(nội dung file) + phiên bản các model + cấu hình pipeline.
+        """
+        version_tag = json.dumps(versions, sort_keys=True)
+        digest = hashlib.sha256(data)
+        digest.update(version_tag.encode("utf-8"))
+        digest.update(config.encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self._hits += 1
+                    return value
+                del self._entries[key]
+
+        value = self._backend_call("get", key, self.ttl)
+        with self._lock:
+            if value is None:
+                self._misses += 1
+                return None
+            self._backend_hits += 1
+            self._store(key, value, now)
+        return value
+
+    def put(self, key, value):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._store(key, value, time.monotonic())
+        self._backend_call("set", key, value, self.ttl)
+
+    def _store(self, key, value, now):
+        self._entries[key] = (now + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._evictions += 1
+
+    def _backend_call(self, method, *args):
+        # Lỗi của backend phụ không được làm hỏng request dự đoán
+        if self.backend is None:
+            return None
+        try:
+            return getattr(self.backend, method)(*args)
+        except Exception as e:
+            with self._lock:
+                self._backend_errors += 1
+            logger.warning("Prediction cache backend error: %s", e)
+            return None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def invalidate(self):
+        """
+        Xóa kết quả trong bộ nhớ khi một phiên bản model mới được đưa vào phục
+        vụ: khóa chứa phiên bản nên các kết quả cũ không còn được đọc lại.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._backend_hits + self._misses
+            return {
+                "enabled": self.enabled,
+                "backend": type(self.backend).__name__ if self.backend else "memory",
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+                "hits": self._hits,
+                "backend_hits": self._backend_hits,
+                "misses": self._misses,
+                "hit_ratio": (self._hits + self._backend_hits) / lookups if lookups else 0.0,
+                "evictions": self._evictions,
+                "invalidations": self._invalidations,
+                "backend_errors": self._backend_errors,
+            }
+
+
+prediction_cache = PredictionCache(
+    backend=_create_backend(PREDICTION_CACHE_BACKEND, PREDICTION_CACHE_URL)
+    if PREDICTION_CACHE_SIZE > 0 else None
+)
@@ -0,0 +1,370 @@
+import collections
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import tracemalloc
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# ============ Profile theo yêu cầu cho worker đang chạy ============
+#
+# Bật qua /admin/profile trong một khoảng thời gian, không cần khởi động lại:
+#
+# - Bộ nhớ: với các request được lấy mẫu, mỗi bước stage_timer (decode,
+#   extract_leaf_features, enhance_image_quality, model_disease, ...) ghi lại
+#   đỉnh cấp phát theo tracemalloc (tính cả mảng numpy) và mức tăng RSS. Khi
+#   dừng, snapshot tracemalloc cho biết bộ nhớ cấp phát trong cửa sổ mà vẫn còn
+#   giữ, theo từng chỗ cấp phát.
+# - CPU: một luồng lấy mẫu stack của mọi luồng Python mỗi interval_ms.
+#
+# Cả hai đều xuất được dạng "folded stacks" (flamegraph.pl, speedscope,
+# inferno). Khi không profile, chi phí chỉ là một lần kiểm tra biến trong
+# stage_timer. Mỗi process (worker) profile riêng, như /admin/models/reload.
+#
+# Lưu ý: tracemalloc làm chậm pipeline đáng kể trong lúc bật, và đỉnh cấp phát
+# là của cả process nên chỉ có một request được lấy mẫu tại một thời điểm
+# (request khác chạy song song vẫn có thể làm số liệu cao hơn thực tế).
+
+# Cửa sổ profile dài nhất (giây)
+PROFILE_MAX_SECONDS = float(os.environ.get("PROFILE_MAX_SECONDS", "300"))
+# Chu kỳ lấy mẫu stack CPU mặc định (mili giây)
+PROFILE_SAMPLE_INTERVAL_MS = float(os.environ.get("PROFILE_SAMPLE_INTERVAL_MS", "10"))
+# Số frame tracemalloc giữ cho mỗi lần cấp phát
+PROFILE_TRACEMALLOC_FRAMES = int(os.environ.get("PROFILE_TRACEMALLOC_FRAMES", "25"))
+# Số chỗ cấp phát lớn nhất trả về trong kết quả
+PROFILE_TOP_ALLOCATIONS = int(os.environ.get("PROFILE_TOP_ALLOCATIONS", "30"))
+# Số request được lấy mẫu gần nhất giữ lại chi tiết từng bước
+PROFILE_KEEP_REQUESTS = int(os.environ.get("PROFILE_KEEP_REQUESTS", "100"))
+
+# Hàm đang chờ (khóa, hàng đợi, socket): stack dừng ở đây là luồng rảnh
+IDLE_FUNCTIONS = frozenset({"wait", "select", "poll", "accept", "readinto", "_wait_for_tstate_lock"})
+
+try:
+    _PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+except (AttributeError, ValueError, OSError):
+    _PAGE_SIZE = 4096
+
+
+def _rss_bytes():
+    """RSS hiện tại của process (Linux), None nếu không đọc được."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class ProfilingBusy(RuntimeError):
+    """Đang có một phiên profile khác trong process này."""
+
+
+class _StageFrame:
+    __slots__ = ("stage", "current", "peak", "rss")
+
+    def __init__(self, stage, current, rss):
+        self.stage = stage
+        self.current = current
+        self.peak = 0
+        self.rss = rss
+
+
+class Profiler:
+    """Một phiên profile tại một thời điểm cho mỗi process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        # Chỉ một request được lấy mẫu bộ nhớ cùng lúc (tracemalloc.reset_peak là toàn cục)
+        self._sampling = threading.Lock()
+        self._session = None
+        self._stop_event = None
+        self._timer = None
+        self._sampler = None
+        self._owns_tracemalloc = False
+        self._reset_results()
+
+    def _reset_results(self):
+        self._stages = {}
+        self._requests = collections.deque(maxlen=PROFILE_KEEP_REQUESTS)
+        self._requests_seen = 0
+        self._requests_sampled = 0
+        self._cpu_stacks = collections.Counter()
+        self._cpu_samples = 0
+        self._memory_stacks = []
+        self._top_allocations = []
+
+    @property
+    def active(self):
+        session = self._session
+        return session is not None and session.get("finished_at") is None
+
+    # ============ Bật / tắt ============
+
+    def start(self, seconds, cpu=True, memory=True, sample_rate=1.0,
+              interval_ms=PROFILE_SAMPLE_INTERVAL_MS, idle=False):
+        """
+        Bắt đầu một phiên profile trong `seconds` giây (tự dừng khi hết).
+        Raises: ProfilingBusy nếu đang có phiên khác, ValueError nếu tham số sai.
+        """
+        seconds = float(seconds)
+        sample_rate = float(sample_rate)
+        interval_ms = float(interval_ms)
+        if not 0 < seconds <= PROFILE_MAX_SECONDS:
+            raise ValueError(f"seconds phải trong khoảng (0, {PROFILE_MAX_SECONDS:g}]")
+        if not 0 < sample_rate <= 1:
+            raise ValueError("sample_rate phải trong khoảng (0, 1]")
+        if interval_ms < 1:
+            raise ValueError("interval_ms phải >= 1")
+        if not (cpu or memory):
+            raise ValueError("Cần bật ít nhất một trong cpu, memory")
+
+        with self._lock:
+            if self.active:
+                raise ProfilingBusy("Đang có một phiên profile khác")
+            self._reset_results()
+            self._session = {
+                "pid": os.getpid(),
+                "started_at": time.time(),
+                "seconds": seconds,
+                "cpu": bool(cpu),
+                "memory": bool(memory),
+                "sample_rate": sample_rate,
+                "interval_ms": interval_ms,
+                "idle": bool(idle),
+                "finished_at": None,
+            }
+            if memory:
+                self._owns_tracemalloc = not tracemalloc.is_tracing()
+                if self._owns_tracemalloc:
+                    tracemalloc.start(PROFILE_TRACEMALLOC_FRAMES)
+                metrics.set_stage_hook(self)
+
+            self._stop_event = threading.Event()
+            if cpu:
+                self._sampler = threading.Thread(
+                    target=self._sample_cpu,
+                    args=(self._stop_event, interval_ms / 1000.0, bool(idle)),
+                    name="profiler-cpu",
+                    daemon=True,
+                )
+                self._sampler.start()
+            self._timer = threading.Timer(seconds, self.stop)
+            self._timer.daemon = True
+            self._timer.start()
+            logger.info("Profiling started for %.0fs (cpu=%s, memory=%s)", seconds, cpu, memory)
+            return self._status_locked()
+
+    def stop(self):
+        """Dừng phiên hiện tại (nếu có) và tổng hợp kết quả."""
+        with self._lock:
+            if not self.active or self._stop_event.is_set():
+                return self._status_locked()
+            metrics.set_stage_hook(None)
+            self._stop_event.set()
+            self._timer.cancel()
+            sampler, self._sampler = self._sampler, None
+
+        # Luồng lấy mẫu tự gộp kết quả rồi thoát (cần self._lock nên join ngoài khóa)
+        if sampler is not None:
+            sampler.join()
+
+        # Tổng hợp snapshot có thể mất vài giây, không giữ khóa trong lúc đó
+        memory_stacks, top_allocations = [], []
+        if self._session["memory"] and tracemalloc.is_tracing():
+            snapshot = tracemalloc.take_snapshot()
+            if self._owns_tracemalloc:
+                tracemalloc.stop()
+            memory_stacks, top_allocations = _summarize_snapshot(snapshot)
+
+        with self._lock:
+            self._memory_stacks = memory_stacks
+            self._top_allocations = top_allocations
+            self._session["finished_at"] = time.time()
+            logger.info("Profiling finished: %d CPU samples, %d requests sampled",
+                        self._cpu_samples, self._requests_sampled)
+            return self._status_locked()
+
+    # ============ Bộ nhớ theo bước (gọi từ stage_timer) ============
+
+    def stage_enter(self, stage):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        if not stack:
+            # Bước ngoài cùng là một request: quyết định lấy mẫu
+            self._requests_seen += 1
+            session = self._session
+            sampled = (
+                session is not None and tracemalloc.is_tracing()
+                and random.random() < session["sample_rate"]
+                and self._sampling.acquire(blocking=False)
+            )
+            if sampled:
+                self._local.steps = []
+        else:
+            sampled = stack[-1] is not None
+        if not sampled:
+            stack.append(None)
+            return
+
+        current, peak = tracemalloc.get_traced_memory()
+        if stack:
+            stack[-1].peak = max(stack[-1].peak, peak)
+        stack.append(_StageFrame(stage, current, _rss_bytes()))
+        tracemalloc.reset_peak()
+
+    def stage_exit(self):
+        stack = self._local.stack
+        frame = stack.pop()
+        if frame is None:
+            return
+        _, peak = tracemalloc.get_traced_memory()
+        peak = max(peak, frame.peak)
+        if stack:
+            stack[-1].peak = max(stack[-1].peak, peak)
+        rss = _rss_bytes()
+        step = {
+            "stage": frame.stage,
+            "peak_bytes": max(0, peak - frame.current),
+            "rss_delta_bytes": rss - frame.rss if rss is not None and frame.rss is not None else None,
+        }
+        self._local.steps.append(step)
+        if not stack:
+            self._record_request(self._local.steps)
+            self._local.steps = None
+            self._sampling.release()
+
+    def _record_request(self, steps):
+        with self._lock:
+            self._requests_sampled += 1
+            self._requests.append({"at": time.time(), "stages": steps})
+            for step in steps:
+                stats = self._stages.get(step["stage"])
+                if stats is None:
+                    stats = self._stages[step["stage"]] = {
+                        "count": 0, "peak_bytes_max": 0, "peak_bytes_total": 0, "rss_delta_bytes_max": 0,
+                    }
+                stats["count"] += 1
+                stats["peak_bytes_max"] = max(stats["peak_bytes_max"], step["peak_bytes"])
+                stats["peak_bytes_total"] += step["peak_bytes"]
+                if step["rss_delta_bytes"] is not None:
+                    stats["rss_delta_bytes_max"] = max(stats["rss_delta_bytes_max"], step["rss_delta_bytes"])
+
+    # ============ CPU ============
+
+    def _sample_cpu(self, stop_event, interval, include_idle):
+        me = threading.get_ident()
+        labels = {}
+        stacks = collections.Counter()
+        samples = 0
+        while not stop_event.wait(interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == me or (not include_idle and frame.f_code.co_name in IDLE_FUNCTIONS):
+                    continue
+                stacks[_fold(frame, labels)] += 1
+            samples += 1
+        with self._lock:
+            self._cpu_stacks.update(stacks)
+            self._cpu_samples += samples
+
+    # ============ Kết quả ============
+
+    def folded(self, kind):
+        """
+        Kết quả dạng folded stacks ("frame;frame;frame giá_trị" mỗi dòng), hoặc
+        None nếu chưa có phiên nào kết thúc. kind: "cpu" (số mẫu) hoặc "memory"
+        (số byte còn giữ khi dừng).
+        """
+        with self._lock:
+            if self._session is None or self.active:
+                return None
+            if kind == "cpu":
+                items = self._cpu_stacks.most_common()
+            elif kind == "memory":
+                items = sorted(self._memory_stacks, key=lambda item: -item[1])
+            else:
+                raise ValueError(kind)
+            return "".join(f"{stack} {value}\n" for stack, value in items)
+
+    def _status_locked(self):
+        session = self._session
+        if session is None:
+            return {"active": False, "session": None}
+        status = {"active": self.active, "session": dict(session)}
+        if status["active"]:
+            status["remaining_seconds"] = round(max(0.0, session["started_at"] + session["seconds"] - time.time()), 1)
+        return status
+
+    def status(self):
+        with self._lock:
+            return self._status_locked()
+
+    def results(self):
+        """Trạng thái cùng bảng đỉnh bộ nhớ theo bước và các chỗ cấp phát lớn nhất."""
+        with self._lock:
+            result = self._status_locked()
+            stages = {
+                stage: {
+                    "count": stats["count"],
+                    "peak_bytes_max": stats["peak_bytes_max"],
+                    "peak_bytes_avg": stats["peak_bytes_total"] // stats["count"],
+                    "rss_delta_bytes_max": stats["rss_delta_bytes_max"],
+                }
+                for stage, stats in sorted(self._stages.items(), key=lambda item: -item[1]["peak_bytes_max"])
+            }
+            result.update({
+                "requests_seen": self._requests_seen,
+                "requests_sampled": self._requests_sampled,
+                "stages": stages,
+                "recent_requests": list(self._requests)[-10:],
+                "cpu_samples": self._cpu_samples,
+                "top_allocations": self._top_allocations,
+            })
+            return result
+
+
+def _summarize_snapshot(snapshot):
+    """(folded stacks theo số byte, các dòng cấp phát nhiều nhất) từ một snapshot tracemalloc."""
+    snapshot = snapshot.filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    ))
+    stacks = []
+    for stat in snapshot.statistics("traceback"):
+        # Frame xếp từ cũ nhất tới mới nhất, đúng thứ tự của folded stacks
+        folded = ";".join(f"{os.path.basename(f.filename)}:{f.lineno}" for f in stat.traceback)
+        stacks.append((folded, stat.size))
+    top = [
+        {
+            "location": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+            "size_bytes": stat.size,
+            "count": stat.count,
+        }
+        for stat in snapshot.statistics("lineno")[:PROFILE_TOP_ALLOCATIONS]
+    ]
+    return stacks, top
+
+
+def _fold(frame, labels):
+    """Stack của một luồng dạng "module:hàm;module:hàm" (gốc trước)."""
+    parts = []
+    while frame is not None:
+        code = frame.f_code
+        label = labels.get(code)
+        if label is None:
+            module = os.path.splitext(os.path.basename(code.co_filename))[0]
+            label = labels[code] = f"{module}:{getattr(code, 'co_qualname', code.co_name)}"
+        parts.append(label)
+        frame = frame.f_back
+    parts.reverse()
+    return ";".join(parts)
+
+
+profiler = Profiler()
@@ -0,0 +1,110 @@
+import hmac
+import os
+from functools import wraps
+
+from flask import Blueprint, Response, request, jsonify
+
+from models import model_registry
+from profiling import profiler, ProfilingBusy, PROFILE_SAMPLE_INTERVAL_MS
+
+admin_bp = Blueprint('admin_bp', __name__, url_prefix='/admin')
+
+# Token cho các endpoint quản trị, gửi trong header X-Admin-Token.
+# Không đặt thì các endpoint quản trị bị tắt (404).
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+
+def admin_required(fn):
+    """Chỉ cho phép request có header X-Admin-Token đúng với ADMIN_TOKEN."""
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        if not ADMIN_TOKEN:
+            return jsonify({"message": "Không tìm thấy"}), 404
+        token = request.headers.get("X-Admin-Token", "")
+        if not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+            return jsonify({"message": "Không có quyền truy cập"}), 403
+        return fn(*args, **kwargs)
+    return wrapper
+
+@admin_bp.route('/models', methods=['GET'])
+@admin_required
+def models_status():
+    """Phiên bản đang phục vụ, các phiên bản cũ đang chờ giải phóng và lịch sử tải lại."""
+    return jsonify(model_registry.status()), 200
+
+@admin_bp.route('/models/reload', methods=['POST'])
+@admin_required
+def reload_models():
+    """
+    Tải lại model trong process này mà không dừng phục vụ.
+    Body (tùy chọn): {"models": ["coffee"], "paths": {"coffee": "coffee_v2.keras"}, "wait": true}
+
+    Với nhiều worker (serve.py) request chỉ tới một worker; để cập nhật mọi
+    worker hãy ghi đè file model và bật MODEL_WATCH_INTERVAL_S.
+    """
+    body = request.get_json(silent=True) or {}
+    if model_registry.loading:
+        return jsonify({"message": "Model đang được tải lần đầu"}), 409
+    try:
+        result = model_registry.reload(body.get("models"), body.get("paths"), wait=bool(body.get("wait")))
+    except KeyError as e:
+        return jsonify({"message": str(e.args[0])}), 400
+    if result is False:
+        return jsonify({"message": "Đang có một lần tải lại khác"}), 409
+    if result is True:
+        return jsonify({"message": "Đã bắt đầu tải lại", "status": model_registry.status()}), 202
+    failed = any("error" in item for item in result.values())
+    return jsonify({"results": result, "versions": model_registry.versions()}), 500 if failed else 200
+
+@admin_bp.route('/profile', methods=['POST'])
+@admin_required
+def start_profile():
+    """
+    Bật profile CPU / bộ nhớ trong process này trong một khoảng thời gian.
+    Body (tùy chọn): {"seconds": 30, "cpu": true, "memory": true,
+                      "sample_rate": 1.0, "interval_ms": 10, "idle": false}
+    """
+    body = request.get_json(silent=True) or {}
+    try:
+        status = profiler.start(
+            body.get("seconds", 30),
+            cpu=bool(body.get("cpu", True)),
+            memory=bool(body.get("memory", True)),
+            sample_rate=body.get("sample_rate", 1.0),
+            interval_ms=body.get("interval_ms", PROFILE_SAMPLE_INTERVAL_MS),
+            idle=bool(body.get("idle", False)),
+        )
+    except ProfilingBusy as e:
+        return jsonify({"message": str(e), "status": profiler.status()}), 409
+    except (TypeError, ValueError) as e:
+        return jsonify({"message": str(e)}), 400
+    return jsonify(status), 202
+
+@admin_bp.route('/profile/stop', methods=['POST'])
+@admin_required
+def stop_profile():
+    """Dừng phiên profile trước khi hết thời gian."""
+    return jsonify(profiler.stop()), 200
+
+@admin_bp.route('/profile', methods=['GET'])
+@admin_required
+def profile_results():
+    """Trạng thái phiên profile, đỉnh bộ nhớ theo bước và các chỗ cấp phát lớn nhất."""
+    return jsonify(profiler.results()), 200
+
+@admin_bp.route('/profile/<kind>.folded', methods=['GET'])
+@admin_required
+def profile_folded(kind):
+    """
+    Tải kết quả dạng folded stacks cho flamegraph.pl / speedscope:
+    cpu.folded (số mẫu) hoặc memory.folded (số byte còn giữ khi dừng).
+    """
+    if kind not in ("cpu", "memory"):
+        return jsonify({"message": "Không tìm thấy"}), 404
+    if profiler.active:
+        return jsonify({"message": "Phiên profile chưa kết thúc", "status": profiler.status()}), 409
+    body = profiler.folded(kind)
+    if body is None:
+        return jsonify({"message": "Chưa có phiên profile nào"}), 404
+    return Response(body, mimetype="text/plain; charset=utf-8", headers={
+        "Content-Disposition": f'attachment; filename="{kind}-{os.getpid()}.folded"',
+    })
@@ -1,14 +1,48 @@
+import logging
+import os
 from flask import Blueprint, request, jsonify
 from models import User
-from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
+from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity, get_jwt
 from mongoengine.errors import NotUniqueError, ValidationError
+from password_hashing import password_hasher, PasswordHashingBusy
 
-# Imports for Google Sign-In
-from google.oauth2 import id_token
-from google.auth.transport import requests as google_requests
+# Xác thực Google Sign-In cục bộ với chứng chỉ được cache
+from google_verifier import google_verifier
+from user_cache import user_cache, profile_of, PROFILE_FIELDS
+
+logger = logging.getLogger(__name__)
 
 auth_bp = Blueprint('auth_bp', __name__, url_prefix='/auth')
 
+# Ghi thông tin công khai (email, tên, ngày tạo) vào claim của access token để
+# /auth/profile trả về ngay mà không truy vấn MongoDB. Token cũ không có claim
+# vẫn được phục vụ qua cache người dùng.
+JWT_PROFILE_CLAIMS = os.environ.get("JWT_PROFILE_CLAIMS", "0") == "1"
+PROFILE_CLAIM = "profile"
+
+def _create_token(user):
+    """Access token của người dùng, kèm claim thông tin công khai nếu bật JWT_PROFILE_CLAIMS."""
+    claims = {PROFILE_CLAIM: profile_of(user)} if JWT_PROFILE_CLAIMS else None
+    return create_access_token(identity=str(user.id), additional_claims=claims)
+
+def _rehash_password(user, password):
+    """
+    Nâng cấp hash được tạo với tham số KDF cũ (chỉ có thể làm lúc biết mật khẩu).
+    Chỉ là tối ưu: nếu pool băm mật khẩu bận hoặc ghi lỗi thì bỏ qua, lần đăng
+    nhập sau sẽ thử lại, người dùng vẫn được cấp token.
+    """
+    try:
+        if user.needs_rehash():
+            User.objects(id=user.id).update_one(set__password=password_hasher.hash(password))
+    except Exception as e:
+        logger.warning("Rehashing password for user %s failed: %s", user.id, e)
+
+def _busy_response():
+    """Pool băm mật khẩu đang quá tải: báo client thử lại sau."""
+    response = jsonify({"message": "Máy chủ đang bận, vui lòng thử lại sau"})
+    response.headers["Retry-After"] = "2"
+    return response, 503
+
 # Client ID của Web Application từ Google Cloud Console
 # NOTE: Nên lưu giá trị này trong biến môi trường thay vì hardcode
 GOOGLE_CLIENT_ID = "637075502351-l1t9dlugduoq5c83e3i1gvfc0ajnhn7s.apps.googleusercontent.com"
@@ -34,6 +68,8 @@ def register():
 
     except NotUniqueError:
         return jsonify({"message": "Email đã tồn tại"}), 409
+    except PasswordHashingBusy:
+        return _busy_response()
     except ValidationError as e:
         return jsonify({"message": "Lỗi xác thực", "errors": e.to_dict()}), 400
     except Exception as e:
@@ -53,15 +89,21 @@ def login():
         email = body.get('email')
         password = body.get('password')
 
-        user = User.objects(email=email).first()
+        # Chỉ tải các trường cần thiết (thông tin công khai chỉ cần khi ghi vào token)
+        fields = ("password",) + (PROFILE_FIELDS if JWT_PROFILE_CLAIMS else ())
+        user = User.objects(email=email).only(*fields).first()
 
         if not user or not user.check_password(password):
             return jsonify({"message": "Email hoặc mật khẩu không hợp lệ"}), 401
 
-        access_token = create_access_token(identity=str(user.id))
+        _rehash_password(user, password)
+
+        access_token = _create_token(user)
         
         return jsonify(access_token=access_token), 200
 
+    except PasswordHashingBusy:
+        return _busy_response()
     except Exception as e:
         return jsonify({"message": "Đã xảy ra lỗi", "error": str(e)}), 500
 
@@ -74,17 +116,15 @@ def google_auth():
         if not token:
             return jsonify({"message": "Yêu cầu ID token của Google"}), 400
 
-        # Xác thực id_token với Google
-        id_info = id_token.verify_oauth2_token(
-            token, google_requests.Request(), GOOGLE_CLIENT_ID
-        )
+        # Xác thực id_token (chứng chỉ của Google được cache trong process)
+        id_info = google_verifier.verify(token, GOOGLE_CLIENT_ID)
 
         # Lấy thông tin người dùng từ token đã xác thực
         email = id_info['email']
         full_name = id_info.get('name', '')
 
-        # Kiểm tra xem người dùng đã tồn tại trong DB chưa
-        user = User.objects(email=email).first()
+        # Kiểm tra xem người dùng đã tồn tại trong DB chưa (không tải hash mật khẩu)
+        user = User.objects(email=email).only(*PROFILE_FIELDS).first()
 
         if not user:
             # Nếu chưa tồn tại, tạo người dùng mới
@@ -96,7 +136,7 @@ def google_auth():
             user.save()
 
         # Tạo access token cho người dùng
-        access_token = create_access_token(identity=str(user.id))
+        access_token = _create_token(user)
         
         return jsonify(access_token=access_token), 200
 
@@ -113,21 +153,19 @@ def google_auth():
 @jwt_required()
 def profile():
     try:
+        # Token có sẵn thông tin công khai thì không cần truy vấn
+        claims_profile = get_jwt().get(PROFILE_CLAIM) if JWT_PROFILE_CLAIMS else None
+        if claims_profile:
+            return jsonify(claims_profile), 200
+        
         # Lấy định danh của người dùng hiện tại từ JWT
         current_user_id = get_jwt_identity()
         
-        # Tìm người dùng trong database
-        user = User.objects.get(id=current_user_id)
-        
-        # Trả về thông tin công khai của người dùng (không bao gồm mật khẩu)
-        return jsonify({
-            "id": str(user.id),
-            "email": user.email,
-            "fullName": user.fullName,
-            "createdAt": user.createdAt.isoformat()
-        }), 200
+        # Thông tin công khai của người dùng (cache hoặc database, không bao gồm mật khẩu)
+        profile = user_cache.get_profile(current_user_id)
+        if profile is None:
+            return jsonify({"message": "Không tìm thấy người dùng"}), 404
         
-    except User.DoesNotExist:
-        return jsonify({"message": "Không tìm thấy người dùng"}), 404
+        return jsonify(profile), 200
     except Exception as e:
         return jsonify({"message": "Đã xảy ra lỗi", "error": str(e)}), 500
@@ -0,0 +1,74 @@
+import base64
+import os
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from flask import Blueprint, request, jsonify
+from flask_jwt_extended import jwt_required, get_jwt_identity
+
+from models import Scan
+
+history_bp = Blueprint('history_bp', __name__)
+
+# Số lần quét mặc định / tối đa trên một trang
+HISTORY_PAGE_SIZE = int(os.environ.get("HISTORY_PAGE_SIZE", "20"))
+HISTORY_MAX_PAGE_SIZE = int(os.environ.get("HISTORY_MAX_PAGE_SIZE", "100"))
+
+# Các trường trả về trong danh sách (vector đặc trưng không cần cho màn hình lịch sử)
+LIST_FIELDS = ("label", "confidence", "isLeaf", "rejectedBy", "qualityScore", "environmental", "createdAt")
+
+
+def _scan_item(scan, include_thumbnail):
+    item = {
+        "id": str(scan.id),
+        "predicted_label": scan.label,
+        "confidence": scan.confidence,
+        "is_leaf": scan.isLeaf,
+        "rejected_by": scan.rejectedBy,
+        "quality_score": scan.qualityScore,
+        "environmental": scan.environmental,
+        "createdAt": scan.createdAt.isoformat() if scan.createdAt else None,
+    }
+    if include_thumbnail:
+        item["thumbnail"] = base64.b64encode(scan.thumbnail).decode("ascii") if scan.thumbnail else None
+    return item
+
+
+@history_bp.route('/history', methods=['GET'])
+@jwt_required()
+def history():
+    """
+    Lịch sử quét của người dùng, mới nhất trước.
+
+    Phân trang theo khóa (keyset): trang sau được lấy bằng ?before=<next_cursor>
+    của trang trước, tức là truy vấn _id < cursor trên index (user, -_id). Chi
+    phí mỗi trang không đổi dù người dùng có hàng nghìn lần quét, khác với
+    skip/limit phải duyệt qua mọi document bị bỏ qua.
+
+    Query: limit (mặc định HISTORY_PAGE_SIZE), before, thumbnails=0 để bỏ ảnh thu nhỏ.
+    """
+    try:
+        limit = int(request.args.get("limit", HISTORY_PAGE_SIZE))
+    except ValueError:
+        return jsonify({"message": "limit phải là số nguyên"}), 400
+    limit = max(1, min(limit, HISTORY_MAX_PAGE_SIZE))
+    include_thumbnail = request.args.get("thumbnails", "1") != "0"
+
+    query = {"user": ObjectId(get_jwt_identity())}
+    before = request.args.get("before")
+    if before:
+        try:
+            query["id__lt"] = ObjectId(before)
+        except (InvalidId, TypeError):
+            return jsonify({"message": "Cursor không hợp lệ"}), 400
+
+    fields = LIST_FIELDS + (("thumbnail",) if include_thumbnail else ())
+    # Lấy thêm một document để biết còn trang sau hay không
+    scans = list(Scan.objects(**query).only(*fields).order_by("-id").limit(limit + 1))
+    has_more = len(scans) > limit
+    scans = scans[:limit]
+
+    return jsonify({
+        "items": [_scan_item(scan, include_thumbnail) for scan in scans],
+        "next_cursor": str(scans[-1].id) if has_more else None,
+    }), 200
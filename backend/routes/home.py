@@ -1,5 +1,14 @@
 from flask import Blueprint, jsonify
-from models import model_coffee, model_disease, LABELS_DISEASE
+from models import model_registry, LABELS_DISEASE, model_versions, MODEL_MODE
+from inference import batching_stats
+from prediction_cache import prediction_cache
+from speculation import speculation_policy
+from cascade import cascade
+from user_cache import user_cache
+from database import command_metrics
+from scan_history import scan_writer
+from admission import admission
+from profiling import profiler
 
 home_bp = Blueprint('home_bp', __name__)
 
@@ -9,18 +18,36 @@ def home():
 
 @home_bp.route("/status", methods=["GET"])
 def status():
-    """Endpoint để kiểm tra trạng thái các model"""
+    """
+    Endpoint để kiểm tra trạng thái các model
+    Dùng làm readiness probe: trả về 503 cho tới khi các model tải xong.
+    """
+    ready = model_registry.is_ready()
+    fused = model_registry.get("fused") is not None
     return jsonify({
-        "status": "running",
+        "status": "running" if ready else "starting",
+        "ready": ready,
         "version": "2.0-enhanced",
         "models": {
-            "coffee_vs_not_coffee": model_coffee is not None,
-            "disease_classification": model_disease is not None
+            "mode": MODEL_MODE,
+            "coffee_vs_not_coffee": fused or model_registry.get("coffee") is not None,
+            "disease_classification": fused or model_registry.get("disease") is not None
         },
+        "model_versions": model_versions(),
+        "model_loading": model_registry.status(),
         "features": {
             "quality_detection": True,
             "environmental_analysis": True,
             "advanced_leaf_features": True
         },
-        "disease_classes": LABELS_DISEASE
-    })
+        "disease_classes": LABELS_DISEASE,
+        "batching": batching_stats(),
+        "prediction_cache": prediction_cache.stats(),
+        "speculation": speculation_policy.stats(),
+        "cascade": cascade.stats(),
+        "user_cache": user_cache.stats(),
+        "scan_history": scan_writer.stats(),
+        "admission": admission.stats(),
+        "profiling": profiler.status(),
+        "mongo_slow_commands": command_metrics.slow_commands()
+    }), 200 if ready else 503
@@ -0,0 +1,84 @@
+from flask import Blueprint, Response
+
+from metrics import registry
+from inference import batching_stats
+from prediction_cache import prediction_cache
+from password_hashing import password_hasher
+from user_cache import user_cache
+from scan_history import scan_writer
+from admission import admission
+
+metrics_bp = Blueprint('metrics_bp', __name__)
+
+# --- Gauge đọc từ thống kê sẵn có ---
+
+def _batch_queue_depth():
+    return {(name,): stats["queue_depth"] for name, stats in batching_stats().items()}
+
+def _prediction_cache_lookups():
+    stats = prediction_cache.stats()
+    return {
+        ("memory_hit",): stats["hits"],
+        ("backend_hit",): stats["backend_hits"],
+        ("miss",): stats["misses"]
+    }
+
+registry.gauge(
+    "coffee_model_queue_depth",
+    "Số request đang chờ trong hàng đợi gom batch",
+    ["model"],
+    _batch_queue_depth
+)
+registry.gauge(
+    "coffee_prediction_cache_lookups_total",
+    "Số lần tra cứu cache dự đoán theo kết quả",
+    ["result"],
+    _prediction_cache_lookups,
+    metric_type="counter"
+)
+registry.gauge(
+    "coffee_prediction_cache_entries",
+    "Số kết quả đang nằm trong cache bộ nhớ",
+    [],
+    lambda: {(): prediction_cache.stats()["size"]}
+)
+
+registry.gauge(
+    "coffee_password_hash_queue_depth",
+    "Số yêu cầu băm mật khẩu đang chờ hoặc đang chạy",
+    [],
+    lambda: {(): password_hasher.queue_depth()}
+)
+
+registry.gauge(
+    "coffee_user_cache_lookups_total",
+    "Số lần tra cứu cache người dùng theo kết quả",
+    ["result"],
+    lambda: {("hit",): user_cache.stats()["hits"], ("miss",): user_cache.stats()["misses"]},
+    metric_type="counter"
+)
+
+registry.gauge(
+    "coffee_scan_queue_depth",
+    "Số bản ghi lịch sử quét đang chờ ghi vào MongoDB",
+    [],
+    lambda: {(): scan_writer.queue_depth()}
+)
+
+registry.gauge(
+    "coffee_admission_inflight",
+    "Số request /predict đang chạy pipeline",
+    [],
+    lambda: {(): admission.inflight()}
+)
+registry.gauge(
+    "coffee_admission_queue_depth",
+    "Số request /predict đang chờ trong hàng đợi kiểm soát tải",
+    [],
+    lambda: {(): admission.queue_depth()}
+)
+
+@metrics_bp.route("/metrics", methods=["GET"])
+def metrics():
+    """Metrics theo định dạng text của Prometheus"""
+    return Response(registry.render(), mimetype="text/plain; version=0.0.4; charset=utf-8")
@@ -1,32 +1,83 @@
-import io
+import os
+import json
+import logging
+import random
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FutureTimeoutError
+from contextlib import nullcontext
 import numpy as np
-from PIL import Image, ImageEnhance
-from flask import Blueprint, request, jsonify
-import tensorflow as tf
+from PIL import Image
+from flask import Blueprint, Response, request, jsonify
+from flask_jwt_extended import verify_jwt_in_request, get_jwt_identity
 import cv2
-from skimage import exposure
-from scipy import ndimage
 
-from models import model_coffee, model_disease, LABELS_DISEASE
+from models import model_registry, LABELS_DISEASE, model_versions, MODEL_MODE
+from image_context import ImageContext, ImageRejected, read_upload, decode_image, image_pixels
+from feature_engine import ANALYSIS_MAX_SIDE, extract_leaf_features, detect_environmental_artifacts
+from inference import coffee_batcher, disease_batcher, fused_batcher, QueueFullError, BATCH_MAX_SIZE, INFERENCE_TIMEOUT_S
+from prediction_cache import prediction_cache
+from speculation import speculation_policy, SpeculativePrediction
+from cascade import cascade, CASCADE_STAGES
+from scan_history import scan_writer, SCAN_HISTORY
+from admission import admission, AdmissionRejected, request_deadline, remaining_seconds
+from metrics import stage_timer, PREDICT_REQUESTS
 
 predict_bp = Blueprint('predict_bp', __name__)
 
+logger = logging.getLogger(__name__)
+
+# Tỉ lệ request được ghi log debug chi tiết (đặc trưng, điểm số) khi LOG_LEVEL=DEBUG
+DEBUG_LOG_SAMPLE_RATE = float(os.environ.get("DEBUG_LOG_SAMPLE_RATE", "0.01"))
+
 # ============ Hàm tiền xử lý ảnh nâng cao ============
 
 IMG_SIZE = (224, 224)
 
-def enhance_image_quality(image):
+# Cạnh dài tối thiểu cần giữ khi giải mã ảnh JPEG ở chế độ draft. Mặc định bằng
+# độ phân giải phân tích (không nhỏ hơn đầu vào của model); 0 = giải mã ảnh gốc.
+DECODE_MAX_SIDE = int(os.environ.get("DECODE_MAX_SIDE", str(ANALYSIS_MAX_SIDE)))
+if DECODE_MAX_SIDE:
+    DECODE_MAX_SIDE = max(DECODE_MAX_SIDE, ANALYSIS_MAX_SIDE, *IMG_SIZE)
+
+# Giới hạn kích thước file và số pixel của ảnh tải lên
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", str(20 * 1024 * 1024)))
+MAX_IMAGE_PIXELS = int(os.environ.get("MAX_IMAGE_PIXELS", str(64_000_000)))
+
+# Cách tăng cường ảnh chất lượng thấp trước khi đưa vào model:
+# "full": CLAHE + bilateral filter trên ảnh đã giải mã (chậm với ảnh lớn),
+# "fast": làm trên ảnh thu nhỏ còn ENHANCE_MAX_SIDE, gần độ phân giải đầu vào model.
+# "fast" làm thay đổi đầu vào model nên chỉ bật sau khi
+# tools/compare_enhancement.py cho thấy dự đoán không bị ảnh hưởng
+ENHANCE_MODE = os.environ.get("ENHANCE_MODE", "full")
+ENHANCE_MAX_SIDE = int(os.environ.get("ENHANCE_MAX_SIDE", str(2 * max(IMG_SIZE))))
+
+# Các cấu hình làm thay đổi kết quả dự đoán, được đưa vào khóa cache
+PIPELINE_CONFIG = (
+    f"analysis={ANALYSIS_MAX_SIDE};decode={DECODE_MAX_SIDE};cascade={','.join(CASCADE_STAGES)};"
+    f"enhance={ENHANCE_MODE}:{ENHANCE_MAX_SIDE}"
+)
+
+def _invalidate_prediction_cache(loaded, previous):
+    # Model được thay phiên bản: kết quả cũ trong cache không còn dùng được
+    if previous is not None and previous.version != loaded.version:
+        prediction_cache.invalidate()
+
+model_registry.on_activate(_invalidate_prediction_cache)
+
+@stage_timer("enhance_image_quality")
+def enhance_image_quality(image, max_side=0):
     """
     Tăng cường chất lượng ảnh cho ảnh chụp ngoài môi trường
+    max_side > 0: làm trên ảnh thu nhỏ (cạnh dài tối đa max_side)
     """
-    # Chuyển sang numpy array để xử lý
-    img_array = np.array(image)
+    ctx = ImageContext.of(image).downscaled(max_side)
+    img_array = ctx.rgb
     
     # 1. Cân bằng histogram để cải thiện độ tương phản
     if len(img_array.shape) == 3:
-        # Chuyển sang LAB color space
-        lab = cv2.cvtColor(img_array, cv2.COLOR_RGB2LAB)
-        l, a, b = cv2.split(lab)
+        # Dùng lại ảnh LAB của request
+        l, a, b = cv2.split(ctx.lab)
         
         # Áp dụng CLAHE (Contrast Limited Adaptive Histogram Equalization)
         clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8,8))
@@ -36,22 +87,23 @@ def enhance_image_quality(image):
         lab = cv2.merge([l, a, b])
         img_array = cv2.cvtColor(lab, cv2.COLOR_LAB2RGB)
     
-    # 2. Giảm nhiễu
+    # 2. Giảm nhiễu, giữ cạnh (đường kính cố định ở độ phân giải đang làm việc)
     img_array = cv2.bilateralFilter(img_array, 9, 75, 75)
     
     # Chuyển lại thành PIL Image
     return Image.fromarray(img_array)
 
+@stage_timer("detect_image_quality")
 def detect_image_quality(image):
     """
     Đánh giá chất lượng ảnh
     Returns: quality_score (0-1), is_blurry, brightness_issue
     """
-    img_array = np.array(image)
-    gray = cv2.cvtColor(img_array, cv2.COLOR_RGB2GRAY)
+    ctx = ImageContext.of(image)
+    gray = ctx.gray
     
-    # 1. Kiểm tra độ nét (sử dụng Laplacian variance)
-    laplacian_var = cv2.Laplacian(gray, cv2.CV_64F).var()
+    # 1. Kiểm tra độ nét (sử dụng Laplacian variance, dùng chung với cascade)
+    laplacian_var = ctx.laplacian_var
     is_blurry = laplacian_var < 100
     
     # 2. Kiểm tra độ sáng
@@ -73,16 +125,18 @@ def detect_image_quality(image):
     
     return quality_score, is_blurry, brightness_issue
 
-def preprocess_image_advanced(image, target_size=IMG_SIZE, is_coffee_model=True):
+def _resize_for_model(ctx, target_size, enhance_mode=ENHANCE_MODE):
     """
-    Tiền xử lý ảnh nâng cao với tăng cường chất lượng
+    Kiểm tra chất lượng, tăng cường nếu cần rồi resize về kích thước đầu vào.
+    Kết quả dùng chung cho cả hai model nên chỉ tính một lần mỗi request.
     """
-    # Kiểm tra và cải thiện chất lượng ảnh nếu cần
-    quality_score, is_blurry, brightness_issue = detect_image_quality(image)
+    quality_score, is_blurry, brightness_issue = ctx.cached("quality", lambda: detect_image_quality(ctx))
     
+    image = ctx.image
     if quality_score < 0.7:
-        print(f"[INFO] Ảnh chất lượng thấp (score: {quality_score:.2f}), đang tăng cường...")
-        image = enhance_image_quality(image)
+        logger.debug("Ảnh chất lượng thấp (score: %.2f), đang tăng cường...", quality_score)
+        max_side = ENHANCE_MAX_SIDE if enhance_mode == "fast" else 0
+        image = ctx.cached(("enhanced", enhance_mode), lambda: enhance_image_quality(ctx, max_side))
     
     # Resize ảnh
     image = image.resize(target_size, Image.Resampling.LANCZOS)
@@ -96,101 +150,57 @@ def preprocess_image_advanced(image, target_size=IMG_SIZE, is_coffee_model=True)
     elif image_array.shape[-1] == 4:
         image_array = image_array[..., :3]
     
-    # Chuyển đổi kiểu dữ liệu
-    image_array = image_array.astype("float32")
-    
-    # Preprocessing cho từng model
-    if is_coffee_model:
-        image_array = image_array / 255.0
-        image_array = np.expand_dims(image_array, axis=0)
-    else:
-        image_array = np.expand_dims(image_array, axis=0)
-        image_array = tf.keras.applications.resnet50.preprocess_input(image_array)
-    
     return image_array, quality_score
 
-# ============ Bộ lọc nâng cao cho nhận diện lá ============
+# Giá trị trung bình theo kênh BGR của ImageNet (chế độ "caffe" của Keras)
+_RESNET50_MEAN_BGR = np.array([103.939, 116.779, 123.68], dtype="float32")
 
-def extract_leaf_features(image):
+def resnet50_preprocess_input(image_array):
     """
-    Trích xuất đặc trưng của lá cây một cách chi tiết hơn
+    Tương đương tf.keras.applications.resnet50.preprocess_input (RGB -> BGR,
+    trừ trung bình ImageNet) nhưng không cần import TensorFlow.
     """
-    img_array = np.array(image)
-    
-    # Chuyển sang các không gian màu khác nhau
-    hsv = cv2.cvtColor(img_array, cv2.COLOR_RGB2HSV)
-    lab = cv2.cvtColor(img_array, cv2.COLOR_RGB2LAB)
-    
-    # 1. Phân tích màu sắc trong HSV
-    h, s, v = cv2.split(hsv)
-    
-    # Dải màu xanh lá cây trong HSV (35-85 độ)
-    green_mask = cv2.inRange(h, 35, 85)
-    green_ratio = np.sum(green_mask > 0) / (img_array.shape[0] * img_array.shape[1])
-    
-    # Dải màu nâu/vàng (15-35 độ) - lá khô hoặc bệnh
-    brown_mask = cv2.inRange(h, 15, 35)
-    brown_ratio = np.sum(brown_mask > 0) / (img_array.shape[0] * img_array.shape[1])
-    
-    # 2. Phân tích độ bão hòa
-    avg_saturation = np.mean(s)
-    
-    # 3. Phân tích kết cấu (texture)
-    gray = cv2.cvtColor(img_array, cv2.COLOR_RGB2GRAY)
-    
-    # Gabor filters để phát hiện kết cấu lá
-    gabor_features = []
-    for theta in np.arange(0, np.pi, np.pi/4):
-        kernel = cv2.getGaborKernel((21, 21), 5, theta, 10, 0.5, 0)
-        filtered = cv2.filter2D(gray, cv2.CV_32F, kernel)
-        gabor_features.append(np.mean(filtered))
-    
-    avg_texture = np.mean(gabor_features)
-    
-    # 4. Phát hiện gân lá
-    edges = cv2.Canny(gray, 50, 150)
-    
-    # Hough transform để tìm đường thẳng (gân lá)
-    lines = cv2.HoughLinesP(edges, 1, np.pi/180, 50, minLineLength=30, maxLineGap=10)
-    vein_count = len(lines) if lines is not None else 0
-    
-    # 5. Phân tích hình dạng tổng thể
-    # Tìm contour lớn nhất
-    contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    
-    if contours:
-        largest_contour = max(contours, key=cv2.contourArea)
-        
-        # Tính các đặc trưng hình học
-        area = cv2.contourArea(largest_contour)
-        perimeter = cv2.arcLength(largest_contour, True)
-        
-        # Solidity: tỷ lệ diện tích contour / diện tích convex hull
-        hull = cv2.convexHull(largest_contour)
-        hull_area = cv2.contourArea(hull)
-        solidity = area / hull_area if hull_area > 0 else 0
+    return image_array[..., ::-1] - _RESNET50_MEAN_BGR
+
+def preprocess_image_advanced(image, target_size=IMG_SIZE, is_coffee_model=True, enhance_mode=ENHANCE_MODE):
+    """
+    Tiền xử lý ảnh nâng cao với tăng cường chất lượng
+    """
+    ctx = ImageContext.of(image)
+    with stage_timer("preprocess_coffee" if is_coffee_model else "preprocess_disease"):
+        base_array, quality_score = ctx.cached(
+            ("resized", tuple(target_size), enhance_mode),
+            lambda: _resize_for_model(ctx, target_size, enhance_mode)
+        )
         
-        # Circularity: độ tròn của hình dạng
-        circularity = 4 * np.pi * area / (perimeter ** 2) if perimeter > 0 else 0
+        # Chuyển đổi kiểu dữ liệu (tạo bản sao, ảnh resize dùng chung không bị sửa)
+        image_array = base_array.astype("float32")
         
-        # Aspect ratio
-        x, y, w, h = cv2.boundingRect(largest_contour)
-        aspect_ratio = float(w) / h if h > 0 else 0
-    else:
-        solidity = 0
-        circularity = 0
-        aspect_ratio = 0
-    
-    return {
-        'green_ratio': green_ratio,
-        'brown_ratio': brown_ratio,
-        'avg_saturation': avg_saturation,
-        'avg_texture': avg_texture,
-        'vein_count': vein_count,
-        'solidity': solidity,
-        'circularity': circularity,
-        'aspect_ratio': aspect_ratio
-    }
+        # Preprocessing cho từng model
+        if is_coffee_model:
+            image_array = image_array / 255.0
+            image_array = np.expand_dims(image_array, axis=0)
+        else:
+            image_array = np.expand_dims(image_array, axis=0)
+            image_array = resnet50_preprocess_input(image_array)
+    
+    return image_array, quality_score
+
+def preprocess_image_fused(image, target_size=IMG_SIZE, enhance_mode=ENHANCE_MODE):
+    """
+    Đầu vào của model hợp nhất: ảnh resize RGB 0..255 (chuẩn hóa nằm trong graph),
+    dùng chung ảnh resize và điểm chất lượng với preprocess_image_advanced.
+    """
+    ctx = ImageContext.of(image)
+    with stage_timer("preprocess_fused"):
+        base_array, quality_score = ctx.cached(
+            ("resized", tuple(target_size), enhance_mode),
+            lambda: _resize_for_model(ctx, target_size, enhance_mode)
+        )
+        image_array = np.expand_dims(base_array.astype("float32"), axis=0)
+    return image_array, quality_score
+
+# ============ Bộ lọc nâng cao cho nhận diện lá ============
 
 def is_coffee_leaf_advanced(image, features):
     """
@@ -227,145 +237,460 @@ def is_coffee_leaf_advanced(image, features):
     
     return score
 
-def detect_environmental_artifacts(image):
+def analyze_image(ctx, debug=False):
     """
-    Phát hiện các yếu tố môi trường có thể gây nhiễu
+    Phần chạy trên CPU trước các model: cascade, đặc trưng thủ công, điểm lá và
+    yếu tố môi trường.
+    Returns: (response, None) nếu ảnh đã bị loại ở bước này, hoặc
+    (None, analysis) với analysis = {"leaf_score", "environmental"}.
+    """
+    # Các bước kiểm tra rẻ (ảnh thu nhỏ, độ nét) loại sớm ảnh rác khi được bật
+    # bằng CASCADE_STAGES (mặc định tắt, xem cascade.py)
+    rejection = cascade.run(ctx)
+    if rejection is not None:
+        if debug:
+            logger.debug("Rejected by cascade stage '%s': %s", rejection.stage, rejection.message)
+        return rejection.to_response(), None
+    
+    # Trích xuất đặc trưng (lưu trong ngữ cảnh để ghi vào lịch sử quét)
+    features = ctx.cached("leaf_features", lambda: extract_leaf_features(ctx))
+    
+    # Tính điểm lá cà phê
+    leaf_score = is_coffee_leaf_advanced(ctx, features)
+    
+    if debug:
+        logger.debug("Leaf features: %s", features)
+        logger.debug("Leaf score: %.2f", leaf_score)
+    
+    # Quyết định dựa trên điểm số
+    if leaf_score < 0.3:
+        return {
+            "predicted_label": "Không phải lá cây",
+            "confidence": f"{(1 - leaf_score) * 100:.2f}%",
+            "is_leaf": False,
+            "quality_warning": "Vật thể không có đặc điểm của lá cây"
+        }, None
+    
+    # Yếu tố môi trường chỉ cần cho các bước sau
+    environmental = ctx.cached("environmental", lambda: detect_environmental_artifacts(ctx))
+    if debug:
+        logger.debug("Environmental: %s", environmental)
+    
+    return None, {"leaf_score": leaf_score, "environmental": environmental}
+
+def coffee_gate(analysis, prob_not_coffee, quality_score, debug=False):
     """
-    img_array = np.array(image)
-    hsv = cv2.cvtColor(img_array, cv2.COLOR_RGB2HSV)
+    Quyết định sau model coffee.
+    Returns: response "Không phải lá cà phê", hoặc None để chạy tiếp model bệnh.
+    """
+    leaf_score = analysis["leaf_score"]
+    environmental = analysis["environmental"]
+    
+    # Điều chỉnh ngưỡng dựa trên chất lượng ảnh và điểm lá
+    adjusted_threshold = 0.85
+    if quality_score < 0.7:
+        adjusted_threshold = 0.9  # Nghiêm ngặt hơn với ảnh chất lượng thấp
+    if environmental['complex_background']:
+        adjusted_threshold = 0.88  # Cẩn thận hơn với nền phức tạp
+    
+    # Kết hợp với leaf_score
+    combined_score = (1 - prob_not_coffee) * 0.7 + leaf_score * 0.3
+    
+    if debug:
+        logger.debug("Model prediction: %.2f", prob_not_coffee)
+        logger.debug("Combined score: %.2f", combined_score)
+        logger.debug("Quality score: %.2f", quality_score)
+    
+    # Quyết định cuối cùng
+    if prob_not_coffee > adjusted_threshold and leaf_score < 0.6:
+        confidence = prob_not_coffee * 100
+        message = "Không phải lá cà phê"
+        
+        # Thêm thông tin chi tiết nếu cần
+        if environmental['has_shadow']:
+            message += " (có bóng đổ)"
+        elif environmental['complex_background']:
+            message += " (nền phức tạp)"
+        
+        return {
+            "predicted_label": message,
+            "confidence": f"{confidence:.2f}%",
+            "is_leaf": True,
+            "quality_score": f"{quality_score:.2f}"
+        }
     
-    # 1. Phát hiện bóng đổ
-    shadow_mask = cv2.inRange(hsv[:,:,2], 0, 50)
-    shadow_ratio = np.sum(shadow_mask > 0) / (img_array.shape[0] * img_array.shape[1])
+    # Nếu chất lượng ảnh thấp nhưng vẫn có thể là lá cà phê
+    if quality_score < 0.5 and 0.7 < prob_not_coffee <= adjusted_threshold:
+        # Chuyển sang model bệnh nhưng với cảnh báo
+        pass  # Tiếp tục xuống phần model disease
+    return None
+
+def disease_response(preds_disease, quality_score, environmental):
+    """Response cuối cùng từ đầu ra của model bệnh (1 dòng)."""
+    class_id = int(np.argmax(preds_disease, axis=1)[0])
+    predicted_label = LABELS_DISEASE[class_id]
+    confidence = float(np.max(preds_disease) * 100.0)
+    
+    # Chuẩn bị response
+    response = {
+        "predicted_label": predicted_label,
+        "confidence": f"{confidence:.2f}%",
+        "is_leaf": True
+    }
     
-    # 2. Phát hiện phản chiếu ánh sáng
-    highlight_mask = cv2.inRange(hsv[:,:,2], 230, 255)
-    highlight_ratio = np.sum(highlight_mask > 0) / (img_array.shape[0] * img_array.shape[1])
+    # Thêm cảnh báo nếu cần
+    if quality_score < 0.7:
+        response["warning"] = "Chất lượng ảnh thấp, kết quả có thể không chính xác"
     
-    # 3. Phát hiện nền phức tạp
-    edges = cv2.Canny(cv2.cvtColor(img_array, cv2.COLOR_RGB2GRAY), 100, 200)
-    edge_density = np.sum(edges > 0) / (img_array.shape[0] * img_array.shape[1])
+    if environmental['complex_background']:
+        response["recommendation"] = "Nên chụp lại với nền đơn giản hơn"
     
-    return {
-        'has_shadow': shadow_ratio > 0.2,
-        'has_highlight': highlight_ratio > 0.1,
-        'complex_background': edge_density > 0.3
-    }
+    if environmental['has_shadow'] or environmental['has_highlight']:
+        response["lighting_issue"] = "Ánh sáng không đều, có thể ảnh hưởng kết quả"
+    
+    return response
+
+def _predict_fused(ctx, analysis, debug=False):
+    """
+    Phần model của predict_image với MODEL_MODE=fused: một lần chạy trả về cả
+    prob_not_coffee và xác suất bệnh, quyết định như chế độ hai model.
+    """
+    if model_registry.get("fused") is None:
+        return {"error": "Model hợp nhất không khả dụng"}, 500
+    
+    inputs, quality_score = preprocess_image_fused(ctx)
+    versions = {}
+    with stage_timer("model_fused"):
+        preds_coffee, preds_disease = fused_batcher.predict(
+            inputs, timeout=remaining_seconds(INFERENCE_TIMEOUT_S), versions=versions
+        )
+    
+    response = coffee_gate(analysis, float(preds_coffee[0][0]), quality_score, debug)
+    if response is None:
+        response = disease_response(preds_disease, quality_score, analysis["environmental"])
+    response["model_versions"] = versions
+    return response, 200
+
+def predict_image(ctx):
+    """
+    Chạy toàn bộ pipeline nhận diện trên một ảnh đã giải mã.
+    Các bước quyết định (analyze_image, coffee_gate, disease_response) được
+    dùng chung với công cụ chấm điểm hàng loạt tools/bulk_score.py.
+    Returns: (response dict, HTTP status)
+    """
+    # Chỉ ghi log chi tiết cho một phần nhỏ request
+    debug = logger.isEnabledFor(logging.DEBUG) and random.random() < DEBUG_LOG_SAMPLE_RATE
+    
+    response, analysis = analyze_image(ctx, debug)
+    if response is not None:
+        return response, 200
+    if MODEL_MODE == "fused":
+        return _predict_fused(ctx, analysis, debug)
+    leaf_score = analysis["leaf_score"]
+    
+    # Model bệnh được chạy trước, song song với model coffee (nếu chính sách cho phép)
+    speculative = None
+    # Phiên bản của các model đã chạy cho ảnh này (trả về trong response)
+    versions = {}
+    
+    # Nếu có model coffee
+    if model_registry.get("coffee") is not None:
+        # Tiền xử lý ảnh với enhancement
+        processed_coffee, quality_score = preprocess_image_advanced(ctx, is_coffee_model=True)
+        
+        if model_registry.get("disease") is not None and speculation_policy.should_speculate(leaf_score):
+            processed_disease, _ = preprocess_image_advanced(ctx, is_coffee_model=False)
+            speculative = SpeculativePrediction(disease_batcher.submit(processed_disease))
+        
+        # Dự đoán với model (được gom batch cùng các request đồng thời)
+        coffee_started = time.perf_counter()
+        with stage_timer("model_coffee"):
+            preds_coffee = coffee_batcher.predict(
+                processed_coffee, timeout=remaining_seconds(INFERENCE_TIMEOUT_S), versions=versions
+            )
+        coffee_seconds = time.perf_counter() - coffee_started
+        prob_not_coffee = float(preds_coffee[0][0])
+        
+        rejection = coffee_gate(analysis, prob_not_coffee, quality_score, debug)
+        speculation_policy.record_gate(leaf_score, passed=rejection is None)
+        if rejection is not None:
+            if speculative is not None:
+                speculation_policy.record_discarded(speculative)
+            rejection["model_versions"] = versions
+            return rejection, 200
+    
+    # Model disease classification
+    if model_registry.get("disease") is None:
+        return {"error": "Model phân loại bệnh không khả dụng"}, 500
+    
+    # Tiền xử lý cho model bệnh (dùng chung ảnh resize và điểm chất lượng)
+    processed_disease, quality_score = preprocess_image_advanced(ctx, is_coffee_model=False)
+    
+    # Dự đoán (hoặc đợi kết quả đã chạy trước)
+    with stage_timer("model_disease"):
+        if speculative is not None:
+            preds_disease = speculative.future.result(timeout=remaining_seconds(INFERENCE_TIMEOUT_S))
+            versions["disease"] = speculative.future.model_version
+            speculation_policy.record_used(
+                speculative, coffee_seconds, time.perf_counter() - speculative.started
+            )
+        else:
+            preds_disease = disease_batcher.predict(
+                processed_disease, timeout=remaining_seconds(INFERENCE_TIMEOUT_S), versions=versions
+            )
+    
+    response = disease_response(preds_disease, quality_score, analysis["environmental"])
+    response["model_versions"] = versions
+    return response, 200
+
+def predict_upload(data, user_id=None, admit=False, deadline=None):
+    """
+    Dự đoán cho nội dung một file ảnh, có dùng cache.
+    Dùng chung cho /predict và /predict/batch để hai endpoint trả về giống hệt nhau.
+    Có user_id thì lần quét được ghi vào lịch sử, kể cả khi kết quả lấy từ
+    cache (ảnh giống hệt của người dùng khác hoặc người dùng quét lại).
+    admit: chờ lượt của bộ kiểm soát tải (theo số pixel của ảnh và deadline)
+    trước khi chạy pipeline; kết quả có trong cache được trả ngay.
+    """
+    # Ảnh đã được dự đoán trước đó (tải lại sau khi timeout / thử lại)
+    cache_key = prediction_cache.make_key(data, model_versions(), PIPELINE_CONFIG)
+    cached = prediction_cache.get(cache_key)
+    if cached is not None:
+        PREDICT_REQUESTS.inc(outcome=_outcome(cached, 200), cached="true")
+        if user_id is not None:
+            scan_writer.record_cached(user_id, cached, data)
+        return cached, 200
+    
+    with admission.admit(image_pixels(data), deadline) if admit else nullcontext(), stage_timer("total"):
+        # Giải mã ảnh ở kích thước nhỏ nhất đủ cho các bước phía sau
+        # (ngữ cảnh ảnh RGB, các biểu diễn được tính một lần và dùng chung)
+        with stage_timer("decode"):
+            ctx = decode_image(data, max_side=DECODE_MAX_SIDE, max_pixels=MAX_IMAGE_PIXELS)
+            # Giải mã thật sự diễn ra khi đọc pixel lần đầu
+            ctx.rgb
+        
+        response, status_code = predict_image(ctx)
+    
+    PREDICT_REQUESTS.inc(outcome=_outcome(response, status_code), cached="false")
+    if status_code == 200:
+        prediction_cache.put(cache_key, response)
+        if user_id is not None:
+            scan_writer.record(user_id, response, ctx)
+    return response, status_code
+
+def _current_user_id():
+    """
+    Người dùng của request nếu có access token hợp lệ. /predict không bắt buộc
+    đăng nhập: không có token (hoặc token lỗi) thì chỉ không ghi lịch sử.
+    """
+    if not SCAN_HISTORY:
+        return None
+    try:
+        verify_jwt_in_request(optional=True)
+        return get_jwt_identity()
+    except Exception:
+        return None
+
+def _outcome(response, status_code):
+    """Nhãn kết quả cho metrics: not_leaf, not_coffee, nhãn bệnh hoặc error."""
+    if status_code != 200:
+        return "error"
+    if not response.get("is_leaf"):
+        return "not_leaf"
+    if response["predicted_label"].startswith("Không phải lá cà phê"):
+        return "not_coffee"
+    return response["predicted_label"]
+
+def _error_response(e):
+    """Chuyển lỗi của pipeline thành (response dict, HTTP status)."""
+    if isinstance(e, ImageRejected):
+        PREDICT_REQUESTS.inc(outcome="rejected", cached="false")
+        return {"error": str(e)}, e.status_code
+    if isinstance(e, FutureTimeoutError):
+        PREDICT_REQUESTS.inc(outcome="timeout", cached="false")
+        logger.warning("Inference timed out")
+        return {"error": "Hết thời gian xử lý, vui lòng thử lại sau"}, 504
+    if isinstance(e, AdmissionRejected):
+        PREDICT_REQUESTS.inc(outcome="shed", cached="false")
+        return {"error": str(e), "retry_after": e.retry_after}, e.status_code
+    if isinstance(e, QueueFullError):
+        PREDICT_REQUESTS.inc(outcome="overloaded", cached="false")
+        logger.warning("%s", e)
+        return {"error": "Máy chủ đang quá tải, vui lòng thử lại sau"}, 503
+    PREDICT_REQUESTS.inc(outcome="error", cached="false")
+    logger.exception("Prediction error: %s", e)
+    return {"error": str(e)}, 500
+
+def _not_ready_response():
+    model_registry.start_loading()
+    response = jsonify({"error": "Model đang được tải, vui lòng thử lại sau"})
+    response.headers["Retry-After"] = "5"
+    return response, 503
+
+def _shed_response(e):
+    """Request bị bộ kiểm soát tải từ chối: báo client thử lại sau Retry-After giây."""
+    PREDICT_REQUESTS.inc(outcome="shed", cached="false")
+    response = jsonify({"error": str(e)})
+    response.headers["Retry-After"] = str(e.retry_after)
+    return response, e.status_code
 
 @predict_bp.route("/predict", methods=["POST"])
 def predict():
+    # Hạn chót tính từ lúc request tới (trước khi đọc body upload)
+    deadline = request_deadline(request.headers, time.time())
+    
     if "file" not in request.files:
         return jsonify({"error": "Không có file được gửi lên"}), 400
     
+    # Model còn đang tải: trả lời nhanh để client / load balancer thử lại sau
+    if model_registry.loading:
+        return _not_ready_response()
+    
     file = request.files["file"]
     try:
-        # Đọc ảnh
-        image = Image.open(io.BytesIO(file.read()))
-        
-        # Chuyển sang RGB
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
-        
-        # Trích xuất đặc trưng
-        features = extract_leaf_features(image)
-        environmental = detect_environmental_artifacts(image)
-        
-        # Tính điểm lá cà phê
-        leaf_score = is_coffee_leaf_advanced(image, features)
-        
-        print(f"[DEBUG] Leaf features: {features}")
-        print(f"[DEBUG] Environmental: {environmental}")
-        print(f"[DEBUG] Leaf score: {leaf_score:.2f}")
-        
-        # Quyết định dựa trên điểm số
-        if leaf_score < 0.3:
-            return jsonify({
-                "predicted_label": "Không phải lá cây",
-                "confidence": f"{(1 - leaf_score) * 100:.2f}%",
-                "is_leaf": False,
-                "quality_warning": "Vật thể không có đặc điểm của lá cây"
-            })
-        
-        # Nếu có model coffee
-        if model_coffee is not None:
-            # Tiền xử lý ảnh với enhancement
-            processed_coffee, quality_score = preprocess_image_advanced(image, is_coffee_model=True)
-            
-            # Dự đoán với model
-            preds_coffee = model_coffee.predict(processed_coffee)
-            prob_not_coffee = float(preds_coffee[0][0])
-            
-            # Điều chỉnh ngưỡng dựa trên chất lượng ảnh và điểm lá
-            adjusted_threshold = 0.85
-            if quality_score < 0.7:
-                adjusted_threshold = 0.9  # Nghiêm ngặt hơn với ảnh chất lượng thấp
-            if environmental['complex_background']:
-                adjusted_threshold = 0.88  # Cẩn thận hơn với nền phức tạp
-            
-            # Kết hợp với leaf_score
-            combined_score = (1 - prob_not_coffee) * 0.7 + leaf_score * 0.3
-            
-            print(f"[DEBUG] Model prediction: {prob_not_coffee:.2f}")
-            print(f"[DEBUG] Combined score: {combined_score:.2f}")
-            print(f"[DEBUG] Quality score: {quality_score:.2f}")
-            
-            # Quyết định cuối cùng
-            if prob_not_coffee > adjusted_threshold and leaf_score < 0.6:
-                confidence = prob_not_coffee * 100
-                message = "Không phải lá cà phê"
-                
-                # Thêm thông tin chi tiết nếu cần
-                if environmental['has_shadow']:
-                    message += " (có bóng đổ)"
-                elif environmental['complex_background']:
-                    message += " (nền phức tạp)"
-                
-                return jsonify({
-                    "predicted_label": message,
-                    "confidence": f"{confidence:.2f}%",
-                    "is_leaf": True,
-                    "quality_score": f"{quality_score:.2f}"
-                })
-            
-            # Nếu chất lượng ảnh thấp nhưng vẫn có thể là lá cà phê
-            if quality_score < 0.5 and 0.7 < prob_not_coffee <= adjusted_threshold:
-                # Chuyển sang model bệnh nhưng với cảnh báo
-                pass  # Tiếp tục xuống phần model disease
-        
-        # Model disease classification
-        if model_disease is None:
-            return jsonify({"error": "Model phân loại bệnh không khả dụng"}), 500
-        
-        # Tiền xử lý cho model bệnh
-        processed_disease, _ = preprocess_image_advanced(image, is_coffee_model=False)
-        
-        # Dự đoán
-        preds_disease = model_disease.predict(processed_disease)
-        class_id = int(np.argmax(preds_disease, axis=1)[0])
-        predicted_label = LABELS_DISEASE[class_id]
-        confidence = float(np.max(preds_disease) * 100.0)
-        
-        # Chuẩn bị response
-        response = {
-            "predicted_label": predicted_label,
-            "confidence": f"{confidence:.2f}%",
-            "is_leaf": True
-        }
-        
-        # Thêm cảnh báo nếu cần
-        if quality_score < 0.7:
-            response["warning"] = "Chất lượng ảnh thấp, kết quả có thể không chính xác"
-        
-        if environmental['complex_background']:
-            response["recommendation"] = "Nên chụp lại với nền đơn giản hơn"
-        
-        if environmental['has_shadow'] or environmental['has_highlight']:
-            response["lighting_issue"] = "Ánh sáng không đều, có thể ảnh hưởng kết quả"
-        
-        return jsonify(response)
-
+        data = read_upload(file, MAX_UPLOAD_BYTES)
+        response, status_code = predict_upload(data, _current_user_id(), admit=True, deadline=deadline)
+    except AdmissionRejected as e:
+        return _shed_response(e)
     except Exception as e:
-        print(f"[ERROR] Prediction error: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        return jsonify({"error": str(e)}), 500
+        response, status_code = _error_response(e)
+    return jsonify(response), status_code
+
+# ============ Dự đoán hàng loạt cho khảo sát ngoài vườn ============
+
+# Số ảnh tối đa trong một request /predict/batch
+BATCH_MAX_FILES = int(os.environ.get("BATCH_MAX_FILES", "200"))
+# Tổng số byte ảnh (sau giải nén zip) của một request /predict/batch, 0 = không giới hạn
+BATCH_MAX_TOTAL_BYTES = int(os.environ.get("BATCH_MAX_TOTAL_BYTES", str(256 * 1024 * 1024)))
+# Số ảnh được xử lý song song (nên >= BATCH_MAX_SIZE để model chạy đủ batch)
+BATCH_PREDICT_WORKERS = int(os.environ.get("BATCH_PREDICT_WORKERS", str(max(BATCH_MAX_SIZE, 4))))
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp", ".heic")
+
+# Pool dùng chung cho mọi request batch để giới hạn tổng số thread
+_batch_executor = ThreadPoolExecutor(max_workers=BATCH_PREDICT_WORKERS, thread_name_prefix="predict-batch")
+
+def _batch_too_large():
+    return ImageRejected(f"Tổng dung lượng ảnh vượt quá giới hạn {BATCH_MAX_TOTAL_BYTES} byte", 413)
+
+def _read_zip_member(archive, info, budget=None):
+    """
+    Đọc một ảnh trong file zip, tối đa MAX_UPLOAD_BYTES byte sau giải nén.
+    Kích thước khai báo trong zip có thể bị làm giả nên số byte thật sự được
+    đếm khi đọc, và không đọc quá budget (số byte còn lại của cả request,
+    None = không giới hạn).
+    Returns: nội dung ảnh hoặc ImageRejected nếu ảnh vượt giới hạn.
+    Raises: ImageRejected (413) nếu cả request vượt BATCH_MAX_TOTAL_BYTES.
+    """
+    too_large = ImageRejected(f"File ảnh vượt quá giới hạn {MAX_UPLOAD_BYTES} byte", 413)
+    if MAX_UPLOAD_BYTES and info.file_size > MAX_UPLOAD_BYTES:
+        return too_large
+    limits = [n for n in (MAX_UPLOAD_BYTES or None, budget) if n is not None]
+    try:
+        with archive.open(info) as member:
+            data = member.read(min(limits) + 1) if limits else member.read()
+    except (zipfile.BadZipFile, zipfile.LargeZipFile, NotImplementedError, RuntimeError) as e:
+        # Sai CRC, nén không hỗ trợ hoặc có mật khẩu
+        return ImageRejected(f"Không đọc được {info.filename} trong file zip: {e}")
+    if MAX_UPLOAD_BYTES and len(data) > MAX_UPLOAD_BYTES:
+        return too_large
+    if budget is not None and len(data) > budget:
+        raise _batch_too_large()
+    return data
+
+def _read_batch_uploads(files):
+    """
+    Đọc các ảnh từ multipart (nhiều file) hoặc từ file .zip.
+    Mọi ảnh được giữ trong bộ nhớ cho tới khi batch xong nên tổng số byte (sau
+    giải nén) bị giới hạn bởi BATCH_MAX_TOTAL_BYTES: một file zip nhỏ chứa
+    nhiều ảnh nén rất tốt không thể chiếm hết bộ nhớ.
+    Returns: danh sách (tên file, nội dung)
+    Raises: ImageRejected (413) nếu quá số ảnh hoặc quá tổng dung lượng.
+    """
+    uploads = []
+    total = 0
+
+    def budget():
+        return BATCH_MAX_TOTAL_BYTES - total if BATCH_MAX_TOTAL_BYTES else None
+
+    for file in files:
+        name = file.filename or f"file_{len(uploads)}"
+        if name.lower().endswith(".zip") or file.mimetype in ("application/zip", "application/x-zip-compressed"):
+            try:
+                archive = zipfile.ZipFile(file.stream)
+            except zipfile.BadZipFile as e:
+                raise ImageRejected(f"File zip không hợp lệ: {name}") from e
+            with archive:
+                for info in archive.infolist():
+                    if info.is_dir() or not info.filename.lower().endswith(IMAGE_EXTENSIONS):
+                        continue
+                    data = _read_zip_member(archive, info, budget())
+                    if isinstance(data, bytes):
+                        total += len(data)
+                    uploads.append((info.filename, data))
+                    if len(uploads) > BATCH_MAX_FILES:
+                        break
+        else:
+            try:
+                data = read_upload(file, MAX_UPLOAD_BYTES)
+            except ImageRejected as e:
+                uploads.append((name, e))
+            else:
+                total += len(data)
+                if BATCH_MAX_TOTAL_BYTES and total > BATCH_MAX_TOTAL_BYTES:
+                    raise _batch_too_large()
+                uploads.append((name, data))
+
+        if len(uploads) > BATCH_MAX_FILES:
+            raise ImageRejected(f"Tối đa {BATCH_MAX_FILES} ảnh cho mỗi lần gửi", 413)
+    return uploads
+
+def _predict_batch_item(index, filename, data, user_id=None):
+    """
+    Dự đoán một ảnh của batch qua cùng bộ kiểm soát tải như /predict, để một
+    batch lớn không chiếm hết pipeline. Cả batch thường chạy lâu hơn
+    PREDICT_DEADLINE_S nên mỗi ảnh có hạn chót riêng tính từ lúc bắt đầu xử lý
+    ảnh đó; ảnh bị từ chối (429/504) có "retry_after" trong kết quả.
+    """
+    if isinstance(data, Exception):
+        response, status_code = _error_response(data)
+    else:
+        try:
+            deadline = request_deadline({}, time.time())
+            response, status_code = predict_upload(data, user_id, admit=True, deadline=deadline)
+        except Exception as e:
+            response, status_code = _error_response(e)
+    return {"index": index, "filename": filename, "status": status_code, "result": response}
+
+@predict_bp.route("/predict/batch", methods=["POST"])
+def predict_batch():
+    """
+    Nhận nhiều ảnh (multipart "files" hoặc một file .zip) và trả kết quả từng
+    ảnh dưới dạng NDJSON ngay khi ảnh đó xử lý xong. Các ảnh được xử lý song
+    song nên hai model chạy trên cả batch qua bộ lập lịch gom batch.
+    """
+    if model_registry.loading:
+        return _not_ready_response()
+    
+    files = request.files.getlist("files") + request.files.getlist("file")
+    if not files:
+        return jsonify({"error": "Không có file được gửi lên"}), 400
+    
+    try:
+        uploads = _read_batch_uploads(files)
+    except ImageRejected as e:
+        return jsonify({"error": str(e)}), e.status_code
+    if not uploads:
+        return jsonify({"error": "Không tìm thấy ảnh hợp lệ"}), 400
+    
+    user_id = _current_user_id()
+    futures = [
+        _batch_executor.submit(_predict_batch_item, index, filename, data, user_id)
+        for index, (filename, data) in enumerate(uploads)
+    ]
+    
+    def generate():
+        for future in as_completed(futures):
+            yield json.dumps(future.result(), ensure_ascii=False) + "\n"
+    
+    return Response(generate(), mimetype="application/x-ndjson")
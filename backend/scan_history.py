@@ -0,0 +1,292 @@
+import atexit
+import datetime
+import logging
+import os
+import queue
+import threading
+import time
+
+import cv2
+from bson import ObjectId
+from pymongo.errors import BulkWriteError
+
+from feature_engine import FEATURE_NAMES, environmental_ratios
+from image_context import decode_image
+from metrics import registry
+from models import Scan
+
+logger = logging.getLogger(__name__)
+
+# ============ Lịch sử quét: ghi trễ theo lô ============
+#
+# Mỗi lần /predict có người dùng đăng nhập tạo một document Scan. Thay vì
+# save() trên thread của request (thêm một lượt đi về MongoDB vào độ trễ),
+# document được đưa vào hàng đợi trong process và một thread nền ghi theo lô
+# (insert_many) khi đủ SCAN_FLUSH_SIZE hoặc sau SCAN_FLUSH_INTERVAL_S. Hàng
+# đợi có giới hạn: khi MongoDB chậm / mất kết nối, request không bị chặn mà
+# bản ghi bị bỏ và được đếm lại.
+#
+# Đánh đổi: một lần quét chỉ xuất hiện ở /history sau lần ghi kế tiếp (tối đa
+# SCAN_FLUSH_INTERVAL_S), và các bản ghi còn trong hàng đợi mất nếu process bị
+# kill -9 (khi tắt bình thường hàng đợi được ghi nốt).
+
+# Bật / tắt ghi lịch sử quét
+SCAN_HISTORY = os.environ.get("SCAN_HISTORY", "1") == "1"
+# Số document tối đa mỗi lần ghi
+SCAN_FLUSH_SIZE = int(os.environ.get("SCAN_FLUSH_SIZE", "100"))
+# Thời gian tối đa một document nằm chờ trước khi được ghi (giây)
+SCAN_FLUSH_INTERVAL_S = float(os.environ.get("SCAN_FLUSH_INTERVAL_S", "1.0"))
+# Số document tối đa trong hàng đợi; đầy thì bỏ bản ghi mới
+SCAN_QUEUE_MAX = int(os.environ.get("SCAN_QUEUE_MAX", "10000"))
+# Thời gian tối đa request chờ khi hàng đợi đầy (ms, 0 = bỏ ngay)
+SCAN_ENQUEUE_TIMEOUT_MS = float(os.environ.get("SCAN_ENQUEUE_TIMEOUT_MS", "0"))
+# Cạnh dài của ảnh thu nhỏ lưu kèm (px) và chất lượng JPEG
+SCAN_THUMBNAIL_SIDE = int(os.environ.get("SCAN_THUMBNAIL_SIDE", "128"))
+SCAN_THUMBNAIL_QUALITY = int(os.environ.get("SCAN_THUMBNAIL_QUALITY", "70"))
+
+SCAN_WRITES = registry.counter(
+    "coffee_scan_writes_total",
+    "Số bản ghi lịch sử quét theo kết quả (written, dropped, failed)",
+    ["result"],
+)
+SCAN_FLUSH_SECONDS = registry.histogram(
+    "coffee_scan_flush_seconds",
+    "Thời gian một lần ghi theo lô vào MongoDB",
+)
+SCAN_FLUSH_SIZE_HIST = registry.histogram(
+    "coffee_scan_flush_size",
+    "Số document trong một lần ghi theo lô",
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500),
+)
+
+
+# ============ Dựng document từ kết quả dự đoán ============
+
+def _thumbnail(ctx, side=SCAN_THUMBNAIL_SIDE, quality=SCAN_THUMBNAIL_QUALITY):
+    """
+    Ảnh thu nhỏ JPEG của ảnh request. Thu nhỏ hai bước (lấy mẫu về 4 lần kích
+    thước đích rồi INTER_AREA): với ảnh 12MP nhanh hơn ~300 lần so với
+    INTER_AREA trực tiếp mà vẫn đủ mịn cho ảnh thu nhỏ.
+    """
+    width, height = ctx.size
+    ratio = min(1.0, side / max(width, height))
+    size = (max(1, round(width * ratio)), max(1, round(height * ratio)))
+    image = ctx.rgb
+    if ratio < 0.25:
+        image = cv2.resize(image, (size[0] * 4, size[1] * 4), interpolation=cv2.INTER_NEAREST)
+    small = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+    ok, encoded = cv2.imencode(
+        ".jpg", cv2.cvtColor(small, cv2.COLOR_RGB2BGR), [cv2.IMWRITE_JPEG_QUALITY, quality]
+    )
+    return encoded.tobytes() if ok else None
+
+
+def _confidence(response):
+    try:
+        return float(str(response.get("confidence", "")).rstrip("%"))
+    except ValueError:
+        return None
+
+
+def _quality_score(ctx, response):
+    quality = ctx.peek("quality")
+    if quality is not None:
+        return float(quality[0])
+    # Kết quả lấy từ cache: chỉ còn điểm chất lượng ghi trong response (nếu có)
+    try:
+        return float(response["quality_score"])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def build_scan(user_id, response, ctx):
+    """
+    Document Scan của một lần dự đoán. Chỉ dùng các giá trị pipeline đã tính và
+    lưu trong ngữ cảnh ảnh (đặc trưng, chất lượng, yếu tố môi trường), không
+    chạy lại bước nào tốn kém.
+    """
+    features = []
+    leaf_features = ctx.peek("leaf_features")
+    environmental = ctx.peek("environmental")
+    if leaf_features is not None and environmental is not None:
+        # Histogram và cạnh Canny đã có sẵn nên các tỉ lệ này gần như miễn phí
+        values = dict(leaf_features, **environmental_ratios(ctx))
+        features = [float(values[name]) for name in FEATURE_NAMES]
+
+    return Scan(
+        # _id tạo ngay lúc dự đoán nên thứ tự trong /history là thứ tự quét
+        id=ObjectId(),
+        user=ObjectId(user_id),
+        label=response["predicted_label"],
+        confidence=_confidence(response),
+        isLeaf=bool(response.get("is_leaf")),
+        rejectedBy=response.get("rejected_by"),
+        qualityScore=_quality_score(ctx, response),
+        environmental={key: bool(value) for key, value in (environmental or {}).items()},
+        features=features,
+        thumbnail=_thumbnail(ctx),
+        createdAt=datetime.datetime.utcnow(),
+    )
+
+
+# ============ Hàng đợi ghi theo lô ============
+
+_STOP = object()
+
+
+class ScanWriter:
+    """
+    Hàng đợi có giới hạn + thread nền ghi các document Scan bằng insert_many.
+    Thread được tạo ở lần ghi đầu tiên trong mỗi process (an toàn khi fork).
+    """
+
+    def __init__(self, flush_size=SCAN_FLUSH_SIZE, flush_interval=SCAN_FLUSH_INTERVAL_S,
+                 max_queue=SCAN_QUEUE_MAX, enqueue_timeout_ms=SCAN_ENQUEUE_TIMEOUT_MS):
+        self.flush_size = max(1, flush_size)
+        self.flush_interval = flush_interval
+        self.enqueue_timeout = enqueue_timeout_ms / 1000.0
+        self._queue = queue.Queue(maxsize=max(1, max_queue))
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+        self._enqueued = 0
+        self._written = 0
+        self._dropped = 0
+        self._failed = 0
+        self._flushes = 0
+        self._last_error = None
+
+    def _ensure_thread(self):
+        pid = os.getpid()
+        if self._thread is not None and self._pid == pid:
+            return
+        with self._lock:
+            if self._thread is None or self._pid != pid:
+                self._pid = pid
+                self._thread = threading.Thread(target=self._run, name="scan-writer", daemon=True)
+                self._thread.start()
+
+    def record(self, user_id, response, ctx):
+        """Ghi lại một lần quét (không chặn request nếu hàng đợi còn chỗ)."""
+        try:
+            scan = build_scan(user_id, response, ctx)
+        except Exception as e:
+            logger.warning("Không tạo được bản ghi lịch sử quét: %s", e)
+            return False
+        return self.enqueue(scan)
+
+    def record_cached(self, user_id, response, data):
+        """
+        Ghi lại một lần quét có kết quả lấy từ cache (ảnh giống hệt của người
+        dùng khác, hoặc quét lại). Pipeline không chạy nên không có vector đặc
+        trưng; ảnh chỉ được giải mã ở kích thước nhỏ (JPEG draft) để làm ảnh thu nhỏ.
+        """
+        try:
+            ctx = decode_image(data, max_side=SCAN_THUMBNAIL_SIDE)
+        except Exception as e:
+            logger.warning("Không giải mã được ảnh cho lịch sử quét: %s", e)
+            return False
+        return self.record(user_id, response, ctx)
+
+    def enqueue(self, scan):
+        """
+        Đưa document vào hàng đợi. Returns: False nếu hàng đợi đầy (bản ghi bị bỏ).
+        """
+        self._ensure_thread()
+        try:
+            if self.enqueue_timeout > 0:
+                self._queue.put(scan, timeout=self.enqueue_timeout)
+            else:
+                self._queue.put_nowait(scan)
+        except queue.Full:
+            SCAN_WRITES.inc(result="dropped")
+            with self._lock:
+                self._dropped += 1
+            logger.debug("Hàng đợi lịch sử quét đầy, bỏ bản ghi")
+            return False
+        with self._lock:
+            self._enqueued += 1
+        return True
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.flush_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._write(batch)
+
+    def _write(self, batch):
+        started = time.perf_counter()
+        written = 0
+        try:
+            Scan.objects.insert(batch, load_bulk=False)
+            written = len(batch)
+        except BulkWriteError as e:
+            written = e.details.get("nInserted", 0)
+            self._last_error = str(e)
+            logger.error("Ghi lịch sử quét lỗi một phần (%d/%d): %s", written, len(batch), e)
+        except Exception as e:
+            self._last_error = str(e)
+            logger.error("Không ghi được %d bản ghi lịch sử quét: %s", len(batch), e)
+        SCAN_FLUSH_SECONDS.observe(time.perf_counter() - started)
+        SCAN_FLUSH_SIZE_HIST.observe(len(batch))
+
+        failed = len(batch) - written
+        if written:
+            SCAN_WRITES.inc(written, result="written")
+        if failed:
+            SCAN_WRITES.inc(failed, result="failed")
+        with self._lock:
+            self._flushes += 1
+            self._written += written
+            self._failed += failed
+
+    def close(self, timeout=5.0):
+        """Ghi nốt hàng đợi và dừng thread nền (gọi khi process tắt)."""
+        thread = self._thread
+        if thread is None or self._pid != os.getpid() or not thread.is_alive():
+            return
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            return
+        thread.join(timeout)
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": SCAN_HISTORY,
+                "queue_depth": self._queue.qsize(),
+                "max_queue": self._queue.maxsize,
+                "flush_size": self.flush_size,
+                "flush_interval_seconds": self.flush_interval,
+                "enqueued": self._enqueued,
+                "written": self._written,
+                "dropped": self._dropped,
+                "failed": self._failed,
+                "flushes": self._flushes,
+                "last_error": self._last_error,
+            }
+
+
+scan_writer = ScanWriter()
+atexit.register(scan_writer.close)
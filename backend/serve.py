@@ -0,0 +1,129 @@
+"""
+Entry point chạy production: gunicorn pre-fork với nhiều worker.
+
+    python serve.py
+
+- Process master import sẵn toàn bộ ứng dụng (Flask, OpenCV, các route) trước
+  khi fork, các worker dùng chung vùng nhớ chỉ đọc đó.
+- TensorFlow không an toàn khi fork sau khi đã khởi tạo, nên mỗi worker tự tải
+  model trong thread nền ngay sau khi fork. Với MODEL_BACKEND=tflite, file
+  .tflite được mmap nên trọng số nằm chung trong page cache giữa các worker.
+- Suy luận chạy trên thread của bộ lập lịch gom batch, không chạy trên thread
+  xử lý request của Flask.
+- CPU được chia đều cho các worker (TensorFlow intra/inter-op, TFLite, OpenCV)
+  để N worker không tranh nhau số core.
+"""
+import math
+import os
+
+from dotenv import load_dotenv
+from gunicorn.app.base import BaseApplication
+
+load_dotenv()
+
+# --- Cấu hình server ---
+BIND = os.environ.get("BIND", f"0.0.0.0:{os.environ.get('PORT', '5000')}")
+WEB_WORKERS = int(os.environ.get("WEB_WORKERS", "2"))
+WEB_THREADS = int(os.environ.get("WEB_THREADS", "8"))
+WEB_TIMEOUT = int(os.environ.get("WEB_TIMEOUT", "120"))
+
+# Thư mục cgroup của process (v2: cpu.max, v1: cpu.cfs_quota_us / cpu.cfs_period_us)
+CGROUP_ROOT = "/sys/fs/cgroup"
+
+
+def _read_text(path):
+    try:
+        with open(path, encoding="ascii") as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def cgroup_cpu_limit(root=CGROUP_ROOT):
+    """Số CPU theo quota của cgroup (làm tròn lên), None nếu không giới hạn."""
+    try:
+        # cgroup v2: "<quota> <period>" hoặc "max <period>"
+        cpu_max = _read_text(os.path.join(root, "cpu.max"))
+        if cpu_max is not None:
+            quota, period = cpu_max.split()[:2]
+            if quota == "max":
+                return None
+            return max(1, math.ceil(int(quota) / int(period)))
+        # cgroup v1: quota -1 = không giới hạn
+        quota = _read_text(os.path.join(root, "cpu", "cpu.cfs_quota_us"))
+        period = _read_text(os.path.join(root, "cpu", "cpu.cfs_period_us"))
+        if quota is None or period is None or int(quota) <= 0:
+            return None
+        return max(1, math.ceil(int(quota) / int(period)))
+    except (ValueError, ZeroDivisionError):
+        return None
+
+
+def available_cpus(root=CGROUP_ROOT):
+    """
+    Số CPU process thật sự được dùng: tập CPU được gán (taskset / cpuset của
+    container) và quota CPU của cgroup, thay vì số CPU của máy chủ.
+    """
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except (AttributeError, OSError):
+        cpus = os.cpu_count() or 1
+    limit = cgroup_cpu_limit(root)
+    return max(1, min(cpus, limit) if limit else cpus)
+
+
+# Số core dành cho mỗi worker
+CPU_PER_WORKER = max(1, available_cpus() // max(1, WEB_WORKERS))
+
+# Mặc định chia CPU cho từng worker, có thể ghi đè bằng biến môi trường.
+# Phải đặt trước khi import models (đọc các giá trị này lúc import).
+os.environ.setdefault("TF_INTRA_OP_THREADS", str(CPU_PER_WORKER))
+os.environ.setdefault("TF_INTER_OP_THREADS", "1")
+os.environ.setdefault("TFLITE_NUM_THREADS", str(CPU_PER_WORKER))
+# Master không được tải model trước khi fork, worker sẽ tải trong post_fork
+os.environ["MODEL_LOADING"] = "lazy"
+# Index được kiểm tra trong từng worker sau khi fork, không kết nối MongoDB ở master
+os.environ["MONGO_INDEX_BOOTSTRAP"] = "0"
+
+
+def post_fork(server, worker):
+    import cv2
+    from models import model_registry
+    from database import bootstrap_indexes
+
+    cv2.setNumThreads(CPU_PER_WORKER)
+    model_registry.start_loading()
+    bootstrap_indexes()
+    server.log.info(f"Worker {worker.pid}: đang tải model với {CPU_PER_WORKER} CPU")
+
+
+class CoffeeCareServer(BaseApplication):
+    def __init__(self, options):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        from main import app
+        return app
+
+
+if __name__ == "__main__":
+    print("\n" + "="*50)
+    print("COFFEE CARE API SERVER - PRODUCTION")
+    print("="*50)
+    print(f"Bind: {BIND}, workers: {WEB_WORKERS}, threads/worker: {WEB_THREADS}")
+    print(f"CPU mỗi worker: {CPU_PER_WORKER}")
+    print("="*50)
+    CoffeeCareServer({
+        "bind": BIND,
+        "workers": WEB_WORKERS,
+        "threads": WEB_THREADS,
+        "worker_class": "gthread",
+        "timeout": WEB_TIMEOUT,
+        "preload_app": True,
+        "post_fork": post_fork,
+    }).run()
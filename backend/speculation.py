@@ -0,0 +1,156 @@
+import os
+import threading
+import time
+from collections import deque
+
+from metrics import registry
+
+# ============ Chạy trước model bệnh (speculative inference) ============
+#
+# Phần lớn ảnh tải lên qua được cổng "có phải lá cà phê", nên thay vì đợi model
+# coffee xong rồi mới chạy model bệnh, hai tensor được tiền xử lý cùng lúc và
+# cả hai model chạy song song trên các thread gom batch. Nếu cổng từ chối, kết
+# quả của model bệnh bị bỏ đi (hoặc hủy nếu còn trong hàng đợi).
+
+# "off": tuần tự như cũ, "always": luôn chạy trước,
+# "adaptive": chạy trước theo leaf_score và tỉ lệ qua cổng quan sát được
+SPECULATIVE_MODE = os.environ.get("SPECULATIVE_MODE", "adaptive")
+# Tỉ lệ qua cổng tối thiểu (với ảnh có leaf_score thấp) để còn chạy trước
+SPECULATIVE_MIN_PASS_RATE = float(os.environ.get("SPECULATIVE_MIN_PASS_RATE", "0.8"))
+# Số quyết định gần nhất dùng để ước lượng tỉ lệ qua cổng
+SPECULATIVE_WINDOW = int(os.environ.get("SPECULATIVE_WINDOW", "200"))
+# Số quyết định tối thiểu trước khi tin vào tỉ lệ quan sát được
+SPECULATIVE_MIN_SAMPLES = int(os.environ.get("SPECULATIVE_MIN_SAMPLES", "20"))
+
+# Cổng coffee chỉ có thể từ chối khi leaf_score dưới ngưỡng này (xem predict_image)
+GATE_LEAF_SCORE = 0.6
+
+SPECULATIVE_DISEASE = registry.counter(
+    "coffee_speculative_disease_total",
+    "Số lần chạy trước model bệnh theo kết quả (used, wasted, cancelled)",
+    ["result"],
+)
+
+
+class SpeculativePrediction:
+    """Future của model bệnh đã gửi đi trước, kèm thời điểm bắt đầu và kết thúc."""
+
+    def __init__(self, future):
+        self.future = future
+        self.started = time.perf_counter()
+        self.finished = None
+        future.add_done_callback(self._done)
+
+    def _done(self, future):
+        self.finished = time.perf_counter()
+
+    @property
+    def seconds(self):
+        """Thời gian từ lúc gửi tới lúc có kết quả (0 nếu chưa xong hoặc bị hủy)."""
+        if self.future.cancelled() or not self.future.done():
+            return 0.0
+        # Callback có thể chạy sau khi result() đã trả về
+        finished = self.finished if self.finished is not None else time.perf_counter()
+        return finished - self.started
+
+
+class SpeculationPolicy:
+    """
+    Quyết định có chạy trước model bệnh hay không, và thống kê thời gian tiết
+    kiệm được / công việc bị bỏ phí.
+    """
+
+    def __init__(self, mode=SPECULATIVE_MODE, min_pass_rate=SPECULATIVE_MIN_PASS_RATE,
+                 window=SPECULATIVE_WINDOW, min_samples=SPECULATIVE_MIN_SAMPLES):
+        self.mode = mode
+        self.min_pass_rate = min_pass_rate
+        self.min_samples = min_samples
+        self._lock = threading.Lock()
+        # Kết quả cổng (True = qua) của các ảnh có leaf_score < GATE_LEAF_SCORE
+        self._gate_outcomes = deque(maxlen=window)
+
+        self._speculated = 0
+        self._used = 0
+        self._wasted = 0
+        self._cancelled = 0
+        self._saved_seconds = 0.0
+        self._wasted_seconds = 0.0
+
+    def pass_rate(self):
+        with self._lock:
+            if not self._gate_outcomes:
+                return None
+            return sum(self._gate_outcomes) / len(self._gate_outcomes)
+
+    def should_speculate(self, leaf_score):
+        if self.mode == "always":
+            return True
+        if self.mode != "adaptive":
+            return False
+        # Cổng không thể từ chối nên kết quả chạy trước chắc chắn được dùng
+        if leaf_score >= GATE_LEAF_SCORE:
+            return True
+        with self._lock:
+            samples = len(self._gate_outcomes)
+            passed = sum(self._gate_outcomes)
+        if samples < self.min_samples:
+            return True
+        return passed / samples >= self.min_pass_rate
+
+    def record_gate(self, leaf_score, passed):
+        """Ghi lại quyết định của cổng coffee cho ảnh mà cổng có thể từ chối."""
+        if leaf_score < GATE_LEAF_SCORE:
+            with self._lock:
+                self._gate_outcomes.append(bool(passed))
+
+    def record_used(self, speculative, coffee_seconds, total_seconds):
+        """
+        Kết quả chạy trước được dùng. Thời gian tiết kiệm = (coffee + disease
+        nếu chạy tuần tự) - thời gian thực tế từ lúc gửi tới lúc có cả hai.
+        """
+        saved = max(0.0, coffee_seconds + speculative.seconds - total_seconds)
+        SPECULATIVE_DISEASE.inc(result="used")
+        with self._lock:
+            self._speculated += 1
+            self._used += 1
+            self._saved_seconds += saved
+
+    def record_discarded(self, speculative):
+        """Cổng từ chối: hủy nếu model bệnh chưa chạy, ngược lại tính là phí."""
+        if speculative.future.cancel():
+            result = "cancelled"
+        else:
+            result = "wasted"
+        SPECULATIVE_DISEASE.inc(result=result)
+        with self._lock:
+            self._speculated += 1
+            if result == "cancelled":
+                self._cancelled += 1
+            else:
+                self._wasted += 1
+        if result == "wasted":
+            # Model bệnh có thể vẫn đang chạy, thời gian phí được cộng khi xong
+            speculative.future.add_done_callback(lambda _: self._add_wasted(speculative.seconds))
+
+    def _add_wasted(self, seconds):
+        with self._lock:
+            self._wasted_seconds += seconds
+
+    def stats(self):
+        pass_rate = self.pass_rate()
+        with self._lock:
+            return {
+                "mode": self.mode,
+                "gate_pass_rate": pass_rate,
+                "gate_samples": len(self._gate_outcomes),
+                "speculated": self._speculated,
+                "used": self._used,
+                "wasted": self._wasted,
+                "cancelled": self._cancelled,
+                "saved_ms_total": self._saved_seconds * 1000.0,
+                "saved_ms_avg": self._saved_seconds * 1000.0 / self._used if self._used else 0.0,
+                "wasted_ms_total": self._wasted_seconds * 1000.0,
+            }
+
+
+speculation_policy = SpeculationPolicy()
@@ -0,0 +1,9 @@
+import os
+import sys
+
+# Các module backend được import trực tiếp (giống khi chạy từ thư mục backend)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("TF_CPP_MIN_LOG_LEVEL", "3")
+# Test dùng model giả, không tải model thật trong nền khi import main
+os.environ.setdefault("MODEL_LOADING", "lazy")
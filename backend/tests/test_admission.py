@@ -0,0 +1,111 @@
+import threading
+import time
+
+import pytest
+
+from admission import AdmissionController, AdmissionRejected, remaining_seconds, request_deadline
+
+
+def _hold(controller, pixels=1e6):
+    """Giữ một chỗ chạy tới khi event được set."""
+    entered = threading.Event()
+    release = threading.Event()
+
+    def run():
+        with controller.admit(pixels):
+            entered.set()
+            release.wait(5)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    assert entered.wait(5)
+    return release, thread
+
+
+def _wait_for_queue(controller, depth):
+    for _ in range(500):
+        if controller.queue_depth() == depth:
+            return
+        time.sleep(0.01)
+    raise AssertionError(f"queue depth {controller.queue_depth()} != {depth}")
+
+
+def test_full_queue_is_shed_with_429():
+    controller = AdmissionController(max_inflight=1, max_queue=0)
+    release, thread = _hold(controller)
+    try:
+        with pytest.raises(AdmissionRejected) as excinfo:
+            with controller.admit(1e6):
+                pass
+    finally:
+        release.set()
+        thread.join()
+    assert excinfo.value.status_code == 429
+    assert excinfo.value.reason == "queue_full"
+    assert excinfo.value.retry_after >= 1
+    assert controller.stats()["shed"]["queue_full"] == 1
+
+
+def test_deadline_expiring_in_queue_is_shed_with_504():
+    controller = AdmissionController(max_inflight=1, max_queue=4)
+    release, thread = _hold(controller)
+    try:
+        with pytest.raises(AdmissionRejected) as excinfo:
+            with controller.admit(1e6, time.monotonic() + 0.05):
+                pass
+        # Request quá hạn được bỏ khỏi hàng đợi
+        assert controller.queue_depth() == 0
+    finally:
+        release.set()
+        thread.join()
+    assert excinfo.value.status_code == 504
+    assert excinfo.value.reason == "deadline"
+    assert controller.inflight() == 0
+
+
+def test_expired_deadline_is_shed_without_queueing():
+    controller = AdmissionController(max_inflight=1)
+    with pytest.raises(AdmissionRejected) as excinfo:
+        with controller.admit(1e6, time.monotonic() - 1):
+            pass
+    assert excinfo.value.status_code == 504
+    assert controller.stats()["queued"] == 0
+
+
+def test_small_images_are_admitted_before_large():
+    controller = AdmissionController(max_inflight=1, max_queue=4, seconds_per_megapixel=1.0)
+    release, thread = _hold(controller)
+    order = []
+
+    def run(name, pixels):
+        with controller.admit(pixels):
+            order.append(name)
+
+    waiters = []
+    for depth, (name, pixels) in enumerate([("large", 48e6), ("small", 1e6)], start=1):
+        waiter = threading.Thread(target=run, args=(name, pixels))
+        waiter.start()
+        waiters.append(waiter)
+        _wait_for_queue(controller, depth)
+    release.set()
+    for waiter in [thread] + waiters:
+        waiter.join(5)
+    assert order == ["small", "large"]
+
+
+def test_deadline_is_visible_when_admission_is_disabled():
+    controller = AdmissionController(max_inflight=0)
+    assert not controller.enabled
+    with controller.admit(1e6, time.monotonic() + 2):
+        assert 1 < remaining_seconds(30) <= 2
+    assert remaining_seconds(30) == 30
+
+
+def test_request_deadline_uses_shortest_limit(monkeypatch):
+    monkeypatch.setattr("admission.PREDICT_DEADLINE_S", 30.0)
+    now = time.time()
+    deadline = request_deadline({"X-Request-Timeout": "5"}, now)
+    assert 4 < deadline - time.monotonic() <= 5
+    # Proxy ghi X-Request-Start theo mili giây, request đã chờ 29 giây
+    headers = {"X-Request-Start": f"t={int((now - 29) * 1000)}"}
+    assert request_deadline(headers, now) - time.monotonic() <= 1.01
@@ -0,0 +1,76 @@
+import mongoengine
+import mongomock
+import pytest
+from flask import Flask
+from flask_jwt_extended import JWTManager
+from werkzeug.security import generate_password_hash
+
+from models import User
+from password_hashing import PasswordHashingBusy, password_hasher
+from routes.auth import auth_bp
+
+# Hash với tham số KDF cũ: đăng nhập thành công sẽ băm lại
+OLD_METHOD = "pbkdf2:sha256:1000"
+
+
+@pytest.fixture
+def client():
+    mongoengine.disconnect()
+    mongoengine.connect(host="mongodb://localhost/coffee_test", mongo_client_class=mongomock.MongoClient,
+                        uuidRepresentation="standard")
+    app = Flask(__name__)
+    app.config["JWT_SECRET_KEY"] = "test-only-jwt-secret-key-0123456789"
+    JWTManager(app)
+    app.register_blueprint(auth_bp)
+    yield app.test_client()
+    mongoengine.disconnect()
+
+
+@pytest.fixture
+def old_hash_user(client):
+    user = User(email="nong.dan@example.com", fullName="Nông Dân",
+                password=generate_password_hash("mat-khau", OLD_METHOD))
+    user.save()
+    assert user.needs_rehash()
+    return user
+
+
+def _login(client, password="mat-khau"):
+    return client.post("/auth/login", json={"email": "nong.dan@example.com", "password": password})
+
+
+def _stored_hash(user):
+    return User.objects(id=user.id).first().password
+
+
+def test_login_rehashes_old_password_hash(client, old_hash_user):
+    response = _login(client)
+    assert response.status_code == 200
+    assert "access_token" in response.get_json()
+    assert not _stored_hash(old_hash_user).startswith(OLD_METHOD)
+
+
+def test_busy_rehash_still_issues_token(client, old_hash_user, monkeypatch):
+    def busy(password):
+        raise PasswordHashingBusy("Hàng đợi băm mật khẩu đã đầy")
+
+    monkeypatch.setattr(password_hasher, "hash", busy)
+    response = _login(client)
+    assert response.status_code == 200
+    assert "access_token" in response.get_json()
+    # Hash cũ được giữ, lần đăng nhập sau sẽ thử băm lại
+    assert _stored_hash(old_hash_user).startswith(OLD_METHOD)
+
+
+def test_busy_verification_returns_503(client, old_hash_user, monkeypatch):
+    def busy(pwhash, password):
+        raise PasswordHashingBusy("Hàng đợi băm mật khẩu đã đầy")
+
+    monkeypatch.setattr(password_hasher, "verify", busy)
+    response = _login(client)
+    assert response.status_code == 503
+    assert response.headers["Retry-After"]
+
+
+def test_wrong_password_is_rejected(client, old_hash_user):
+    assert _login(client, "sai-mat-khau").status_code == 401
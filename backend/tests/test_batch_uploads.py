@@ -0,0 +1,105 @@
+import io
+import struct
+import zipfile
+
+import pytest
+from werkzeug.datastructures import FileStorage
+
+from image_context import ImageRejected
+from routes import predict
+
+
+def _zip(members, declared_sizes=None):
+    """File zip không nén; declared_sizes ghi đè kích thước khai báo của từng file."""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_STORED) as archive:
+        for name, data in members.items():
+            archive.writestr(name, data)
+    raw = bytearray(buffer.getvalue())
+    for name, size in (declared_sizes or {}).items():
+        encoded = name.encode()
+        # Header cục bộ (PK\3\4): kích thước giải nén ở offset 22
+        local = raw.find(b"PK\x03\x04")
+        while local != -1:
+            if raw[local + 30:local + 30 + len(encoded)] == encoded:
+                struct.pack_into("<I", raw, local + 22, size)
+            local = raw.find(b"PK\x03\x04", local + 4)
+        # Thư mục trung tâm (PK\1\2): kích thước giải nén ở offset 24
+        central = raw.find(b"PK\x01\x02")
+        while central != -1:
+            if raw[central + 46:central + 46 + len(encoded)] == encoded:
+                struct.pack_into("<I", raw, central + 24, size)
+            central = raw.find(b"PK\x01\x02", central + 4)
+    return bytes(raw)
+
+
+def _read(payload):
+    with zipfile.ZipFile(io.BytesIO(payload)) as archive:
+        return {info.filename: predict._read_zip_member(archive, info) for info in archive.infolist()}
+
+
+@pytest.fixture
+def upload_limit(monkeypatch):
+    monkeypatch.setattr(predict, "MAX_UPLOAD_BYTES", 1000)
+
+
+def test_zip_member_within_limit_is_read(upload_limit):
+    assert _read(_zip({"a.jpg": b"x" * 1000})) == {"a.jpg": b"x" * 1000}
+
+
+def test_zip_member_over_declared_limit_is_rejected(upload_limit):
+    result = _read(_zip({"a.jpg": b"x" * 1001}))["a.jpg"]
+    assert isinstance(result, ImageRejected)
+    assert result.status_code == 413
+
+
+def test_zip_member_with_forged_size_is_rejected(upload_limit):
+    # Khai báo 10 byte nhưng nội dung thật lớn hơn giới hạn
+    payload = _zip({"a.jpg": b"x" * 5000, "b.jpg": b"y" * 10}, declared_sizes={"a.jpg": 10})
+    results = _read(payload)
+    assert isinstance(results["a.jpg"], ImageRejected)
+    assert results["b.jpg"] == b"y" * 10
+
+
+def _upload(payload, name="photos.zip"):
+    return FileStorage(io.BytesIO(payload), filename=name, content_type="application/zip")
+
+
+def _bomb(members, size):
+    """File zip nhỏ (nén deflate) chứa nhiều ảnh toàn byte 0."""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for i in range(members):
+            archive.writestr(f"{i}.jpg", bytes(size))
+    return buffer.getvalue()
+
+
+def test_zip_of_compressible_members_is_capped_by_total_bytes(monkeypatch):
+    monkeypatch.setattr(predict, "MAX_UPLOAD_BYTES", 2 * 1024 * 1024)
+    monkeypatch.setattr(predict, "BATCH_MAX_TOTAL_BYTES", 16 * 1024 * 1024)
+    payload = _bomb(200, 2 * 1024 * 1024)
+    assert len(payload) < 1024 * 1024
+
+    with pytest.raises(ImageRejected) as excinfo:
+        predict._read_batch_uploads([_upload(payload)])
+    assert excinfo.value.status_code == 413
+
+
+def test_total_cap_applies_without_per_file_limit(monkeypatch):
+    monkeypatch.setattr(predict, "MAX_UPLOAD_BYTES", 0)
+    monkeypatch.setattr(predict, "BATCH_MAX_TOTAL_BYTES", 1024 * 1024)
+    with pytest.raises(ImageRejected):
+        predict._read_batch_uploads([_upload(_bomb(1, 4 * 1024 * 1024))])
+
+
+def test_total_cap_counts_multipart_files(monkeypatch):
+    monkeypatch.setattr(predict, "BATCH_MAX_TOTAL_BYTES", 1500)
+    files = [FileStorage(io.BytesIO(b"x" * 1000), filename=f"{i}.jpg") for i in range(2)]
+    with pytest.raises(ImageRejected):
+        predict._read_batch_uploads(files)
+
+
+def test_batch_within_total_cap_is_read(monkeypatch):
+    monkeypatch.setattr(predict, "BATCH_MAX_TOTAL_BYTES", 1000)
+    uploads = predict._read_batch_uploads([_upload(_bomb(4, 250))])
+    assert [len(data) for _, data in uploads] == [250] * 4
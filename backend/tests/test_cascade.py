@@ -0,0 +1,57 @@
+import os
+
+import numpy as np
+import pytest
+from PIL import Image, ImageOps
+
+from benchmarks.images import synthetic_leaf
+from cascade import CASCADE_CHECKS, CASCADE_STAGES, Cascade, build_cascade, check_thumbnail
+from image_context import ImageContext
+from routes.predict import analyze_image
+
+
+def sample_images():
+    leaf = synthetic_leaf(800, 600)
+    warm = np.asarray(leaf).astype("float32") * (1.3, 1.0, 0.6)
+    return {
+        "leaf": leaf,
+        "grayscale_leaf": ImageOps.grayscale(leaf).convert("RGB"),
+        "white_balance_leaf": Image.fromarray(np.clip(warm, 0, 255).astype("uint8")),
+        "black": Image.new("RGB", (800, 600)),
+        "flat_gray": Image.new("RGB", (800, 600), (128, 128, 128)),
+        "noise": Image.fromarray(np.random.default_rng(0).integers(0, 256, (600, 800, 3), dtype="uint8")),
+    }
+
+
+@pytest.mark.skipif("CASCADE_STAGES" in os.environ, reason="CASCADE_STAGES được đặt từ môi trường")
+def test_cascade_off_by_default():
+    assert CASCADE_STAGES == []
+
+
+@pytest.mark.skipif("CASCADE_STAGES" in os.environ, reason="CASCADE_STAGES được đặt từ môi trường")
+@pytest.mark.parametrize("name", sorted(sample_images()))
+def test_default_pipeline_matches_baseline(name):
+    # Pipeline gốc không loại ảnh nào trước model: leaf_score luôn >= 0.5
+    response, analysis = analyze_image(ImageContext(sample_images()[name]))
+    assert response is None
+    assert analysis["leaf_score"] >= 0.5
+
+
+def test_thumbnail_stage_adds_rejections():
+    # Lý do cascade tắt mặc định: ảnh lá đen trắng bị loại dù pipeline gốc vẫn chạy model
+    stage = Cascade([("thumbnail", check_thumbnail)])
+    assert stage.run(ImageContext(sample_images()["grayscale_leaf"])) is not None
+    assert stage.run(ImageContext(sample_images()["leaf"])) is None
+
+
+def test_build_cascade_keeps_stage_order():
+    stages = list(reversed(list(CASCADE_CHECKS)))
+    assert list(build_cascade(stages).stats()) == stages
+
+
+def test_unknown_stage_is_a_clear_error():
+    with pytest.raises(ValueError) as excinfo:
+        build_cascade(["thumbnail", "thumbnial"])
+    message = str(excinfo.value)
+    assert "thumbnial" in message
+    assert all(name in message for name in CASCADE_CHECKS)
@@ -0,0 +1,36 @@
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+from benchmarks.images import synthetic_leaf
+from image_context import ImageContext
+from routes import predict
+
+
+@pytest.mark.skipif("ENHANCE_MODE" in os.environ, reason="ENHANCE_MODE được đặt từ môi trường")
+def test_full_enhancement_by_default():
+    assert predict.ENHANCE_MODE == "full"
+
+
+@pytest.mark.parametrize("max_side", [0, predict.ENHANCE_MAX_SIDE])
+def test_large_photo_is_denoised(monkeypatch, max_side):
+    # Ảnh điện thoại (cạnh dài > 1600px): giảm nhiễu không được bị bỏ qua ở cả hai chế độ
+    calls = []
+    bilateral = cv2.bilateralFilter
+
+    def spy(image, diameter, *args):
+        calls.append((image.shape[:2], diameter))
+        return bilateral(image, diameter, *args)
+
+    monkeypatch.setattr(predict.cv2, "bilateralFilter", spy)
+    ctx = ImageContext(synthetic_leaf(2400, 1800))
+    enhanced = predict.enhance_image_quality(ctx, max_side)
+
+    assert len(calls) == 1
+    shape, diameter = calls[0]
+    assert diameter >= 3
+    assert max(shape) == (max_side or 2400)
+    assert max(enhanced.size) == (max_side or 2400)
+    assert not np.array_equal(np.asarray(enhanced), ctx.rgb)
@@ -0,0 +1,77 @@
+import glob
+import os
+
+import cv2
+import numpy as np
+import pytest
+from PIL import Image
+
+from benchmarks.images import synthetic_leaf
+from feature_engine import environmental_ratios, extract_leaf_features, gabor_texture
+from image_context import ImageContext
+
+# Ảnh lá thật đi kèm ứng dụng mobile
+ASSET_IMAGES = sorted(glob.glob(os.path.join(
+    os.path.dirname(__file__), "..", "..", "coffee-rn", "assets", "images", "*.jpg"
+)))
+
+
+def sample_images():
+    images = {os.path.basename(path): Image.open(path).convert("RGB") for path in ASSET_IMAGES}
+    images.update({
+        "synthetic_leaf": synthetic_leaf(800, 600),
+        "synthetic_leaf_small": synthetic_leaf(333, 211, seed=3),
+        "noise": Image.fromarray(np.random.default_rng(0).integers(0, 256, (240, 320, 3), dtype="uint8")),
+        "black": Image.new("RGB", (64, 48)),
+    })
+    return images
+
+
+def reference_features(image):
+    """Cách tính từng pixel trước khi có feature_engine (bản gốc trong routes/predict.py)."""
+    img_array = np.array(image)
+    hsv = cv2.cvtColor(img_array, cv2.COLOR_RGB2HSV)
+    h, s, v = cv2.split(hsv)
+    num_pixels = img_array.shape[0] * img_array.shape[1]
+    gray = cv2.cvtColor(img_array, cv2.COLOR_RGB2GRAY)
+
+    gabor = []
+    for theta in np.arange(0, np.pi, np.pi/4):
+        kernel = cv2.getGaborKernel((21, 21), 5, theta, 10, 0.5, 0)
+        gabor.append(np.mean(cv2.filter2D(gray, cv2.CV_32F, kernel)))
+
+    return {
+        "green_ratio": np.sum(cv2.inRange(h, 35, 85) > 0) / num_pixels,
+        "brown_ratio": np.sum(cv2.inRange(h, 15, 35) > 0) / num_pixels,
+        "avg_saturation": np.mean(s),
+        "avg_texture": np.mean(gabor),
+        "shadow_ratio": np.sum(cv2.inRange(v, 0, 50) > 0) / num_pixels,
+        "highlight_ratio": np.sum(cv2.inRange(v, 230, 255) > 0) / num_pixels,
+        "edge_density": np.sum(cv2.Canny(gray, 100, 200) > 0) / num_pixels,
+    }
+
+
+@pytest.mark.parametrize("name", sorted(sample_images()))
+def test_features_match_per_pixel_implementation(name):
+    image = sample_images()[name]
+    expected = reference_features(image)
+    ctx = ImageContext(image)
+    actual = dict(extract_leaf_features(ctx, analysis_max_side=0), **environmental_ratios(ctx, analysis_max_side=0))
+
+    # Histogram HSV: đếm đúng từng pixel như inRange
+    for key in ("green_ratio", "brown_ratio", "shadow_ratio", "highlight_ratio", "edge_density"):
+        assert actual[key] == expected[key], key
+    assert actual["avg_saturation"] == pytest.approx(expected["avg_saturation"], rel=1e-9)
+    # Ảnh tích phân thay cho 4 lần filter2D (filter2D tính bằng float32)
+    assert actual["avg_texture"] == pytest.approx(expected["avg_texture"], rel=1e-4, abs=1e-3)
+
+
+@pytest.mark.parametrize("shape", [(21, 21), (30, 17), (480, 640)])
+def test_gabor_texture_matches_filter2d(shape):
+    gray = np.random.default_rng(1).integers(0, 256, shape, dtype="uint8")
+    expected = np.mean([
+        np.mean(cv2.filter2D(gray, cv2.CV_64F, cv2.getGaborKernel((21, 21), 5, theta, 10, 0.5, 0)))
+        for theta in np.arange(0, np.pi, np.pi/4)
+    ])
+    # filter2D dùng DFT với kernel 21x21 nên chỉ khớp tới sai số làm tròn
+    assert gabor_texture(gray) == pytest.approx(expected, rel=1e-6)
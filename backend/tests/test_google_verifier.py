@@ -0,0 +1,64 @@
+import base64
+import json
+import threading
+import time
+
+import pytest
+
+from google_verifier import GoogleTokenVerifier
+
+
+def _token(kid):
+    def segment(value):
+        return base64.urlsafe_b64encode(json.dumps(value).encode()).rstrip(b"=").decode()
+    return f"{segment({'alg': 'RS256', 'kid': kid})}.{segment({})}.c2ln"
+
+
+class FakeSource:
+    def __init__(self, certs, delay=0.0, fail=False):
+        self.certs = certs
+        self.delay = delay
+        self.fail = fail
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.delay)
+        if self.fail:
+            raise ConnectionError("certs endpoint down")
+        return dict(self.certs), 3600.0
+
+
+@pytest.fixture
+def verifier():
+    verifier = GoogleTokenVerifier(certs_url="http://certs.invalid")
+    verifier._load = FakeSource({"old": "pem"})
+    verifier.refresh()
+    # Lần tải đầu đã lâu, cho phép tải lại khi gặp kid lạ
+    verifier._attempted_at -= 3600
+    return verifier
+
+
+def test_unknown_kid_refresh_is_single_flight(verifier):
+    verifier._load = source = FakeSource({"old": "pem", "new": "pem"}, delay=0.1)
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(verifier._certs_for(_token("new"))))
+        for _ in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert source.calls == 1
+    assert all("new" in certs for certs in results)
+
+
+def test_refresh_error_falls_back_to_cached_certs(verifier):
+    verifier._load = FakeSource({}, fail=True)
+    assert verifier._certs_for(_token("new")) == {"old": "pem"}
+    # Token có kid không có trong chứng chỉ bị từ chối như token sai (401), không phải 500
+    with pytest.raises(ValueError):
+        verifier.verify(_token("new"), "client-id")
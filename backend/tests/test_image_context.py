@@ -0,0 +1,44 @@
+import io
+
+import pytest
+from PIL import Image
+
+from benchmarks.images import encode_jpeg, synthetic_leaf
+from feature_engine import extract_leaf_features
+from image_context import decode_image
+
+ANALYSIS_SIDE = 512
+
+
+@pytest.fixture(scope="module")
+def large_jpeg():
+    return encode_jpeg(synthetic_leaf(4000, 3000))
+
+
+def test_draft_decode_records_scale(large_jpeg):
+    ctx = decode_image(large_jpeg, max_side=ANALYSIS_SIDE)
+    assert max(ctx.size) < 4000
+    assert ctx.scale == pytest.approx(max(ctx.size) / 4000)
+    assert ctx.downscaled(ANALYSIS_SIDE).scale == pytest.approx(ANALYSIS_SIDE / 4000)
+
+
+def test_scale_ignores_exif_rotation():
+    image = synthetic_leaf(4000, 3000)
+    exif = Image.Exif()
+    exif[0x0112] = 6  # xoay 90 độ
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", exif=exif)
+    ctx = decode_image(buffer.getvalue(), max_side=ANALYSIS_SIDE)
+    assert ctx.size[1] > ctx.size[0]
+    assert ctx.scale == pytest.approx(max(ctx.size) / 4000)
+
+
+def test_features_independent_of_decode_max_side(large_jpeg):
+    full = extract_leaf_features(decode_image(large_jpeg), analysis_max_side=ANALYSIS_SIDE)
+    drafted = extract_leaf_features(decode_image(large_jpeg, max_side=ANALYSIS_SIDE),
+                                    analysis_max_side=ANALYSIS_SIDE)
+    # Ảnh phân tích giống nhau trừ sai số nội suy: ngưỡng Hough phải cùng tỉ lệ
+    assert drafted["vein_count"] == pytest.approx(full["vein_count"], rel=0.15)
+    for key in ("green_ratio", "brown_ratio"):
+        assert drafted[key] == pytest.approx(full[key], abs=0.01)
+    assert drafted["avg_saturation"] == pytest.approx(full["avg_saturation"], rel=0.01)
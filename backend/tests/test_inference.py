@@ -0,0 +1,135 @@
+import threading
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
+
+import numpy as np
+import pytest
+
+from inference import BatchScheduler, QueueFullError
+
+
+class FakeLoaded:
+    def __init__(self, model, version="v1"):
+        self.model = model
+        self.version = version
+
+
+class FakeModel:
+    """Model giả ghi lại các batch đã chạy; release chặn predict tới khi được set."""
+
+    def __init__(self, outputs=1):
+        self.outputs = outputs
+        self.batches = []
+        self.release = threading.Event()
+        self.release.set()
+        self.started = threading.Event()
+
+    def predict(self, batch, verbose=0):
+        self.started.set()
+        self.release.wait(5)
+        self.batches.append(batch.copy())
+        if self.outputs == 1:
+            return batch * 2
+        return [batch * 2, batch.sum(axis=1, keepdims=True)]
+
+
+def _scheduler(model, **kwargs):
+    @contextmanager
+    def lease():
+        yield FakeLoaded(model) if model is not None else None
+
+    return BatchScheduler("test", lease, **kwargs)
+
+
+def _rows(start, n):
+    return np.arange(start, start + n, dtype="float32").reshape(n, 1).repeat(2, axis=1)
+
+
+def test_batch_results_are_sliced_per_request():
+    model = FakeModel()
+    # Batch chỉ đóng khi đủ 6 dòng nên cả ba request nằm chung một batch
+    scheduler = _scheduler(model, max_batch_size=6, max_wait_ms=2000)
+    inputs = [_rows(0, 1), _rows(10, 3), _rows(20, 2)]
+    futures = [scheduler.submit(x) for x in inputs]
+
+    for x, future in zip(inputs, futures):
+        np.testing.assert_array_equal(future.result(timeout=5), x * 2)
+        assert future.model_version == "v1"
+    assert [len(b) for b in model.batches] == [6]
+    assert scheduler.stats()["batch_size_counts"] == {6: 1}
+
+
+def test_multi_output_results_are_sliced_per_output():
+    model = FakeModel(outputs=2)
+    scheduler = _scheduler(model, max_batch_size=3, max_wait_ms=2000)
+    inputs = [_rows(0, 2), _rows(5, 1)]
+    futures = [scheduler.submit(x) for x in inputs]
+
+    for x, future in zip(inputs, futures):
+        doubled, summed = future.result(timeout=5)
+        np.testing.assert_array_equal(doubled, x * 2)
+        np.testing.assert_array_equal(summed, x.sum(axis=1, keepdims=True))
+
+
+def test_predict_reports_model_version():
+    scheduler = _scheduler(FakeModel(), max_wait_ms=0)
+    versions = {}
+    scheduler.predict(_rows(0, 1), timeout=5, versions=versions)
+    assert versions == {"test": "v1"}
+
+
+def test_cancelled_request_is_skipped():
+    model = FakeModel()
+    model.release.clear()
+    scheduler = _scheduler(model, max_batch_size=1, max_wait_ms=0)
+
+    first = scheduler.submit(_rows(0, 1))
+    assert model.started.wait(5)
+    # Batch đầu đang chạy: request thứ hai còn trong hàng đợi và bị hủy
+    cancelled = scheduler.submit(_rows(10, 1))
+    assert cancelled.cancel()
+    last = scheduler.submit(_rows(20, 1))
+    model.release.set()
+
+    np.testing.assert_array_equal(first.result(timeout=5), _rows(0, 1) * 2)
+    np.testing.assert_array_equal(last.result(timeout=5), _rows(20, 1) * 2)
+    assert [b[0, 0] for b in model.batches] == [0, 20]
+
+
+def test_timed_out_request_is_cancelled_before_running():
+    model = FakeModel()
+    model.release.clear()
+    scheduler = _scheduler(model, max_batch_size=1, max_wait_ms=0)
+
+    first = scheduler.submit(_rows(0, 1))
+    assert model.started.wait(5)
+    with pytest.raises(FutureTimeoutError):
+        scheduler.predict(_rows(10, 1), timeout=0.05)
+    last = scheduler.submit(_rows(20, 1))
+    model.release.set()
+
+    first.result(timeout=5)
+    last.result(timeout=5)
+    assert [b[0, 0] for b in model.batches] == [0, 20]
+
+
+def test_model_not_ready_fails_whole_batch():
+    scheduler = _scheduler(None, max_batch_size=2, max_wait_ms=2000)
+    futures = [scheduler.submit(_rows(0, 1)), scheduler.submit(_rows(1, 1))]
+    for future in futures:
+        with pytest.raises(RuntimeError, match="chưa sẵn sàng"):
+            future.result(timeout=5)
+
+
+def test_full_queue_rejects_request():
+    model = FakeModel()
+    model.release.clear()
+    scheduler = _scheduler(model, max_batch_size=1, max_wait_ms=0, max_queue=1)
+
+    scheduler.submit(_rows(0, 1))
+    assert model.started.wait(5)
+    scheduler.submit(_rows(1, 1))
+    with pytest.raises(QueueFullError):
+        scheduler.submit(_rows(2, 1))
+    model.release.set()
+    assert scheduler.stats()["rejected"] == 1
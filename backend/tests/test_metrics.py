@@ -0,0 +1,112 @@
+import io
+import re
+
+import pytest
+
+from benchmarks import environment
+from benchmarks.images import encode_jpeg, synthetic_leaf
+from metrics import MetricsRegistry, stage_timer
+
+SAMPLE = re.compile(r"^([a-z_]+)(\{[^}]*\})? (\S+)$")
+
+
+def parse(text):
+    """{(tên, chuỗi label): giá trị} của các dòng mẫu; bỏ qua HELP/TYPE."""
+    samples = {}
+    for line in text.splitlines():
+        if line.startswith("#") or not line:
+            continue
+        match = SAMPLE.match(line)
+        assert match, f"dòng không đúng định dạng: {line!r}"
+        name, labels, value = match.groups()
+        samples[(name, labels or "")] = float(value)
+    return samples
+
+
+def test_counter_rendering():
+    registry = MetricsRegistry()
+    counter = registry.counter("test_requests_total", "Số request", ["outcome"])
+    counter.inc(outcome="ok")
+    counter.inc(2, outcome="ok")
+    counter.inc(outcome='lỗi "xấu"\n')
+
+    text = registry.render()
+    assert "# HELP test_requests_total Số request\n# TYPE test_requests_total counter\n" in text
+    assert 'test_requests_total{outcome="ok"} 3\n' in text
+    assert 'test_requests_total{outcome="lỗi \\"xấu\\"\\n"} 1\n' in text
+
+
+def test_histogram_rendering_is_cumulative():
+    registry = MetricsRegistry()
+    histogram = registry.histogram("test_seconds", "Thời gian", ["stage"], buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        histogram.observe(value, stage="decode")
+
+    samples = parse(registry.render())
+    assert samples[("test_seconds_bucket", '{stage="decode",le="0.1"}')] == 2
+    assert samples[("test_seconds_bucket", '{stage="decode",le="1.0"}')] == 3
+    assert samples[("test_seconds_bucket", '{stage="decode",le="+Inf"}')] == 4
+    assert samples[("test_seconds_sum", '{stage="decode"}')] == pytest.approx(3.65)
+    assert samples[("test_seconds_count", '{stage="decode"}')] == 4
+
+
+def test_gauge_reads_value_at_render():
+    registry = MetricsRegistry()
+    depth = {"value": 1}
+    registry.gauge("test_queue_depth", "Độ sâu", [], lambda: {(): depth["value"]})
+    depth["value"] = 7
+    assert "# TYPE test_queue_depth gauge\ntest_queue_depth 7\n" in registry.render()
+
+
+def test_stage_timer_as_context_manager_and_decorator():
+    registry = MetricsRegistry()
+    histogram = registry.histogram("test_stage_seconds", "Bước", ["stage"])
+
+    with stage_timer("decode", histogram):
+        pass
+
+    @stage_timer("features", histogram)
+    def features():
+        return 42
+
+    assert features() == 42
+    assert features() == 42
+    samples = parse(registry.render())
+    assert samples[("test_stage_seconds_count", '{stage="decode"}')] == 1
+    assert samples[("test_stage_seconds_count", '{stage="features"}')] == 2
+
+
+def test_stage_timer_records_failed_stage():
+    registry = MetricsRegistry()
+    histogram = registry.histogram("test_stage_seconds", "Bước", ["stage"])
+    with pytest.raises(RuntimeError):
+        with stage_timer("decode", histogram):
+            raise RuntimeError("lỗi")
+    assert parse(registry.render())[("test_stage_seconds_count", '{stage="decode"}')] == 1
+
+
+def test_metrics_endpoint_after_predict():
+    client = environment.create_app().test_client()
+    before = parse(client.get("/metrics").get_data(as_text=True))
+
+    data = encode_jpeg(synthetic_leaf(640, 480))
+    response = client.post("/predict", data={"file": (io.BytesIO(data), "leaf.jpg")},
+                           content_type="multipart/form-data")
+    assert response.status_code == 200
+
+    scrape = client.get("/metrics")
+    assert scrape.status_code == 200
+    assert scrape.mimetype == "text/plain"
+    after = parse(scrape.get_data(as_text=True))
+
+    def delta(name, labels=""):
+        return after.get((name, labels), 0) - before.get((name, labels), 0)
+
+    label = response.get_json()["predicted_label"]
+    assert delta("coffee_predict_requests_total", f'{{outcome="{label}",cached="false"}}') == 1
+    for stage in ("total", "decode", "extract_leaf_features"):
+        assert delta("coffee_predict_stage_seconds_count", f'{{stage="{stage}"}}') == 1
+    assert delta("coffee_model_batch_size_count", '{model="coffee"}') == 1
+    assert delta("coffee_model_batch_size_count", '{model="disease"}') == 1
+    assert ("coffee_model_queue_depth", '{model="coffee"}') in after
+    assert ("coffee_admission_inflight", "") in after
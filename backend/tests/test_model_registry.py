@@ -0,0 +1,163 @@
+import threading
+
+import pytest
+
+import models
+from models import ModelRegistry
+
+
+class StubModel:
+    def __init__(self, path):
+        self.path = path
+
+    def predict(self, batch, verbose=0):
+        return batch
+
+
+@pytest.fixture
+def model_files(tmp_path, monkeypatch):
+    def load(path):
+        if "broken" in path:
+            raise OSError(f"không đọc được {path}")
+        return StubModel(path)
+
+    monkeypatch.setattr(models, "load_model", load)
+    monkeypatch.setattr(models, "MODEL_BACKEND", "tflite")
+    monkeypatch.setattr(models, "MODEL_WARMUP_BATCH", 1)
+
+    def write(name, content=b"v1"):
+        path = tmp_path / name
+        path.write_bytes(content)
+        return str(path)
+
+    return write
+
+
+def _loaded_registry(paths):
+    registry = ModelRegistry(paths)
+    assert registry.wait_until_loaded(5)
+    return registry
+
+
+def test_load_all_reports_readiness_and_errors(model_files):
+    registry = _loaded_registry({"coffee": model_files("coffee.keras"), "disease": model_files("broken.keras")})
+    assert registry.get("coffee") is not None
+    assert registry.get("disease") is None
+    assert not registry.is_ready()
+
+
+def test_lease_keeps_old_version_until_released(model_files):
+    path = model_files("coffee.keras")
+    registry = _loaded_registry({"coffee": path})
+    old_version = registry.versions()["coffee"]
+
+    with registry.lease("coffee") as leased:
+        old_model = leased.model
+        model_files("coffee.keras", b"v2-longer")
+        results = registry.reload(["coffee"], wait=True)
+        new_version = results["coffee"]["version"]
+        assert new_version != old_version
+        assert registry.versions() == {"coffee": new_version}
+        # Batch đang chạy vẫn dùng phiên bản cũ, chưa bị giải phóng
+        assert leased.version == old_version
+        assert leased.model is old_model
+        assert leased.retired
+
+    assert leased.model is None
+    with registry.lease("coffee") as current:
+        assert current.version == new_version
+        assert current.model is not old_model
+
+
+def test_old_version_is_released_after_all_leases_drain(model_files):
+    registry = _loaded_registry({"coffee": model_files("coffee.keras")})
+    first = registry.lease("coffee")
+    second = registry.lease("coffee")
+    old = first.__enter__()
+    second.__enter__()
+
+    model_files("coffee.keras", b"v2-longer")
+    registry.reload(["coffee"], wait=True)
+    assert old.in_use == 2 and old in registry._draining
+
+    first.__exit__(None, None, None)
+    assert old.model is not None
+    second.__exit__(None, None, None)
+    assert old.model is None
+    assert registry._draining == []
+
+
+def test_unused_old_version_is_released_immediately(model_files):
+    registry = _loaded_registry({"coffee": model_files("coffee.keras")})
+    with registry.lease("coffee") as old:
+        pass
+    model_files("coffee.keras", b"v2-longer")
+    registry.reload(["coffee"], wait=True)
+    assert old.model is None
+
+
+def test_failed_reload_keeps_active_version(model_files):
+    registry = _loaded_registry({"coffee": model_files("coffee.keras")})
+    version = registry.versions()["coffee"]
+
+    results = registry.reload(paths={"coffee": model_files("broken.keras")}, wait=True)
+    assert "error" in results["coffee"]
+    assert registry.versions() == {"coffee": version}
+    assert registry.is_ready()
+    with registry.lease("coffee") as current:
+        assert current.model is not None and not current.retired
+
+
+def test_concurrent_reload_is_refused(model_files, monkeypatch):
+    registry = _loaded_registry({"coffee": model_files("coffee.keras")})
+    started, release = threading.Event(), threading.Event()
+    load_version = registry._load_version
+
+    def slow_load(name, path):
+        started.set()
+        release.wait(5)
+        return load_version(name, path)
+
+    monkeypatch.setattr(registry, "_load_version", slow_load)
+    assert registry.reload() is True
+    assert started.wait(5)
+    assert registry.reload() is False
+    release.set()
+
+
+def test_reload_of_unknown_model_raises(model_files):
+    registry = _loaded_registry({"coffee": model_files("coffee.keras")})
+    with pytest.raises(KeyError):
+        registry.reload(["disease"])
+
+
+def test_use_models_serves_stubs_without_loading():
+    registry = ModelRegistry({"coffee": "unused.keras"})
+    stub = StubModel("stub")
+    registry.use_models({"coffee": stub})
+    assert not registry.loading and registry.is_ready()
+    assert registry.get("coffee") is stub
+    assert registry.versions() == {"coffee": "stub"}
+
+
+def test_load_failure_is_logged(model_files, caplog):
+    with caplog.at_level("INFO", logger="models"):
+        _loaded_registry({"coffee": model_files("coffee.keras"), "disease": model_files("broken.keras")})
+    records = {record.levelname: record for record in caplog.records}
+    assert "coffee" in records["INFO"].getMessage()
+    assert "disease" in records["ERROR"].getMessage()
+    assert records["ERROR"].exc_info is not None
+
+
+def test_activation_listeners_see_previous_version(model_files):
+    registry = ModelRegistry({"coffee": model_files("coffee.keras")})
+    seen = []
+    registry.on_activate(lambda loaded, previous: seen.append((loaded.version, previous and previous.version)))
+    registry.on_activate(lambda loaded, previous: 1 / 0)
+    assert registry.wait_until_loaded(5)
+    first = registry.versions()["coffee"]
+
+    model_files("coffee.keras", b"v2-longer")
+    registry.reload(["coffee"], wait=True)
+    # Callback lỗi không làm hỏng việc thay phiên bản
+    assert seen == [(first, None), (registry.versions()["coffee"], first)]
@@ -0,0 +1,18 @@
+from werkzeug.security import generate_password_hash
+
+from password_hashing import PasswordHasher, werkzeug_default_method
+
+
+def test_default_follows_installed_werkzeug():
+    hasher = PasswordHasher(method="")
+    assert hasher.method == werkzeug_default_method()
+    # Hash do werkzeug tạo với mặc định của nó (vd. người dùng cũ) không bị băm lại
+    assert not hasher.needs_rehash(generate_password_hash("secret"))
+    assert not hasher.needs_rehash(hasher.hash("secret"))
+
+
+def test_changed_parameters_trigger_rehash():
+    hasher = PasswordHasher(method="pbkdf2:sha256:1000")
+    assert hasher.needs_rehash(generate_password_hash("secret", "pbkdf2:sha256:2000"))
+    assert not hasher.needs_rehash(hasher.hash("secret"))
+    assert hasher.verify(hasher.hash("secret"), "secret")
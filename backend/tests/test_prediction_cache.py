@@ -0,0 +1,148 @@
+import os
+import time
+
+import prediction_cache as cache_module
+from prediction_cache import DiskCacheBackend, PredictionCache
+
+VERSIONS = {"coffee": "a", "disease": "b"}
+
+
+def test_key_depends_on_content_versions_and_config():
+    cache = PredictionCache(max_entries=4)
+    key = cache.make_key(b"img", VERSIONS, "cfg")
+    assert key == cache.make_key(b"img", VERSIONS, "cfg")
+    assert key != cache.make_key(b"other", VERSIONS, "cfg")
+    assert key != cache.make_key(b"img", VERSIONS, "cfg2")
+    assert key != cache.make_key(b"img", {"coffee": "a", "disease": "c"}, "cfg")
+
+
+def test_make_key_has_no_side_effects():
+    cache = PredictionCache(max_entries=4)
+    key = cache.make_key(b"img", VERSIONS)
+    cache.put(key, {"label": "old"})
+    cache.make_key(b"img", {"coffee": "a2", "disease": "b"})
+    assert cache.get(key) == {"label": "old"}
+    assert cache.stats()["invalidations"] == 0
+
+
+def test_invalidate_clears_memory_entries():
+    cache = PredictionCache(max_entries=4)
+    cache.put("a", 1)
+    cache.invalidate()
+    assert cache.get("a") is None
+    stats = cache.stats()
+    assert (stats["size"], stats["invalidations"]) == (0, 1)
+
+
+def test_model_activation_invalidates_cache(monkeypatch):
+    from models import LoadedModel
+    from routes import predict
+
+    cache = PredictionCache(max_entries=4)
+    monkeypatch.setattr(predict, "prediction_cache", cache)
+    cache.put("a", 1)
+
+    # Lần tải đầu và tải lại cùng phiên bản không xóa cache
+    predict._invalidate_prediction_cache(LoadedModel("coffee", None, "", "v1"), None)
+    predict._invalidate_prediction_cache(
+        LoadedModel("coffee", None, "", "v1"), LoadedModel("coffee", None, "", "v1")
+    )
+    assert cache.get("a") == 1
+
+    predict._invalidate_prediction_cache(
+        LoadedModel("coffee", None, "", "v2"), LoadedModel("coffee", None, "", "v1")
+    )
+    assert cache.get("a") is None
+    assert predict._invalidate_prediction_cache in predict.model_registry._listeners
+
+
+def test_lru_evicts_least_recently_used():
+    cache = PredictionCache(max_entries=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache_module.time, "monotonic", lambda: now[0])
+    cache = PredictionCache(max_entries=4, ttl=10)
+    cache.put("a", 1)
+
+    now[0] += 9
+    assert cache.get("a") == 1
+    now[0] += 2
+    assert cache.get("a") is None
+    assert cache.stats()["size"] == 0
+
+
+def test_disabled_cache_stores_nothing():
+    cache = PredictionCache(max_entries=0)
+    cache.put("a", 1)
+    assert cache.get("a") is None
+
+
+def test_backend_hit_fills_memory(tmp_path):
+    backend = DiskCacheBackend(str(tmp_path))
+    PredictionCache(max_entries=4, backend=backend).put("a", {"label": "x"})
+
+    # Process khác (cache bộ nhớ rỗng) đọc được qua backend phụ
+    cache = PredictionCache(max_entries=4, backend=backend)
+    assert cache.get("a") == {"label": "x"}
+    assert cache.get("a") == {"label": "x"}
+    stats = cache.stats()
+    assert (stats["backend_hits"], stats["hits"]) == (1, 1)
+
+
+def _age(path, seconds):
+    mtime = time.time() - seconds
+    os.utime(path, (mtime, mtime))
+
+
+def test_disk_prune_removes_expired_files(tmp_path):
+    backend = DiskCacheBackend(str(tmp_path), max_entries=0)
+    backend.set("old", 1, ttl=60)
+    backend.set("new", 2, ttl=60)
+    _age(backend._path("old"), 120)
+
+    assert backend.prune(ttl=60) == 1
+    assert sorted(os.listdir(tmp_path)) == ["new.json"]
+
+
+def test_disk_prune_caps_entries_keeping_newest(tmp_path):
+    backend = DiskCacheBackend(str(tmp_path), max_entries=2)
+    for age, key in enumerate(["c", "b", "a"]):
+        backend.set(key, key, ttl=3600)
+        _age(backend._path(key), age * 10)
+
+    assert backend.prune(ttl=3600) == 1
+    assert sorted(os.listdir(tmp_path)) == ["b.json", "c.json"]
+
+
+def test_disk_backend_prunes_periodically_on_write(tmp_path):
+    backend = DiskCacheBackend(str(tmp_path), max_entries=0, prune_interval=0)
+    backend.set("old", 1, ttl=60)
+    _age(backend._path("old"), 120)
+    backend.set("new", 2, ttl=60)
+    assert sorted(os.listdir(tmp_path)) == ["new.json"]
+
+
+def test_backend_errors_do_not_fail_lookups():
+    class BrokenBackend:
+        def get(self, key, ttl):
+            raise ConnectionError("down")
+
+        def set(self, key, value, ttl):
+            raise ConnectionError("down")
+
+    cache = PredictionCache(max_entries=4, backend=BrokenBackend())
+    cache.put("a", 1)
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+    assert cache.stats()["backend_errors"] == 2
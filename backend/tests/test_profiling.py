@@ -0,0 +1,150 @@
+import re
+import threading
+import time
+
+import numpy as np
+import pytest
+from flask import Flask
+
+from metrics import MetricsRegistry, stage_timer
+from profiling import Profiler, ProfilingBusy, profiler
+from routes import admin
+from routes.admin import admin_bp
+
+TOKEN = "test-admin-token"
+# "frame;frame;frame giá_trị": frame không chứa ";" (có thể có dấu cách, vd. "<frozen runpy>")
+FOLDED_LINE = re.compile(r"^[^;]+(;[^;]+)* \d+$")
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(admin, "ADMIN_TOKEN", TOKEN)
+    app = Flask(__name__)
+    app.register_blueprint(admin_bp)
+    yield app.test_client()
+    profiler.stop()
+
+
+def _headers(token=TOKEN):
+    return {"X-Admin-Token": token}
+
+
+def _spin(stop):
+    while not stop.is_set():
+        sum(i * i for i in range(1000))
+
+
+def test_admin_endpoints_disabled_without_token(client, monkeypatch):
+    monkeypatch.setattr(admin, "ADMIN_TOKEN", "")
+    assert client.get("/admin/profile", headers=_headers()).status_code == 404
+
+
+@pytest.mark.parametrize("headers", [{}, {"X-Admin-Token": "sai"}, {"X-Admin-Token": TOKEN + "x"}])
+def test_admin_endpoints_reject_wrong_token(client, headers):
+    assert client.get("/admin/profile", headers=headers).status_code == 403
+    assert client.post("/admin/profile", headers=headers).status_code == 403
+
+
+def test_admin_endpoints_accept_token(client):
+    response = client.get("/admin/profile", headers=_headers())
+    assert response.status_code == 200
+    assert "active" in response.get_json()
+
+
+def test_second_profile_is_rejected_while_running(client):
+    body = {"seconds": 30, "memory": False, "interval_ms": 5}
+    first = client.post("/admin/profile", json=body, headers=_headers())
+    assert first.status_code == 202
+    assert first.get_json()["active"]
+
+    second = client.post("/admin/profile", json=body, headers=_headers())
+    assert second.status_code == 409
+    assert second.get_json()["status"]["active"]
+    # Kết quả chưa tải được khi phiên chưa kết thúc
+    assert client.get("/admin/profile/cpu.folded", headers=_headers()).status_code == 409
+
+    stopped = client.post("/admin/profile/stop", headers=_headers())
+    assert stopped.status_code == 200
+    assert not stopped.get_json()["active"]
+    assert client.post("/admin/profile", json=body, headers=_headers()).status_code == 202
+
+
+def test_invalid_profile_parameters(client):
+    for body in ({"seconds": 0}, {"sample_rate": 2}, {"cpu": False, "memory": False}, {"seconds": "x"}):
+        assert client.post("/admin/profile", json=body, headers=_headers()).status_code == 400
+
+
+def test_folded_download(client):
+    assert client.get("/admin/profile/gpu.folded", headers=_headers()).status_code == 404
+
+    client.post("/admin/profile", json={"seconds": 30, "memory": False, "interval_ms": 1}, headers=_headers())
+    stop = threading.Event()
+    worker = threading.Thread(target=_spin, args=(stop,))
+    worker.start()
+    time.sleep(0.2)
+    client.post("/admin/profile/stop", headers=_headers())
+    stop.set()
+    worker.join()
+
+    response = client.get("/admin/profile/cpu.folded", headers=_headers())
+    assert response.status_code == 200
+    assert response.headers["Content-Disposition"].startswith('attachment; filename="cpu-')
+    lines = response.get_data(as_text=True).splitlines()
+    assert lines and all(FOLDED_LINE.match(line) for line in lines)
+
+
+def test_profiler_is_single_session():
+    session = Profiler()
+    session.start(30, memory=False)
+    try:
+        with pytest.raises(ProfilingBusy):
+            session.start(30, memory=False)
+    finally:
+        session.stop()
+    assert not session.active
+
+
+def test_cpu_folded_stacks_count_samples():
+    session = Profiler()
+    assert session.folded("cpu") is None
+
+    session.start(30, memory=False, interval_ms=1)
+    stop = threading.Event()
+    worker = threading.Thread(target=_spin, args=(stop,))
+    worker.start()
+    time.sleep(0.2)
+    assert session.folded("cpu") is None
+    session.stop()
+    stop.set()
+    worker.join()
+
+    stacks = [line.rsplit(" ", 1) for line in session.folded("cpu").splitlines()]
+    assert all(FOLDED_LINE.match(" ".join(item)) for item in stacks)
+    # Gốc trước, lá sau; giá trị là số mẫu
+    spin = [(stack, int(count)) for stack, count in stacks if "test_profiling:_spin" in stack]
+    assert spin
+    assert all(stack.startswith("threading:") for stack, _ in spin)
+    assert sum(int(count) for _, count in stacks) >= sum(count for _, count in spin) > 0
+    assert session.results()["cpu_samples"] > 0
+
+
+def test_memory_profile_records_stages_and_folded_bytes():
+    session = Profiler()
+    histogram = MetricsRegistry().histogram("test_stage_seconds", "Bước", ["stage"])
+    session.start(30, cpu=False)
+    try:
+        with stage_timer("total", histogram):
+            with stage_timer("allocate", histogram):
+                kept = np.ones((512, 1024))
+    finally:
+        session.stop()
+
+    results = session.results()
+    assert results["requests_sampled"] == 1
+    assert results["stages"]["allocate"]["peak_bytes_max"] >= kept.nbytes
+    assert results["stages"]["total"]["peak_bytes_max"] >= kept.nbytes
+
+    lines = session.folded("memory").splitlines()
+    assert lines and all(FOLDED_LINE.match(line) for line in lines)
+    sizes = [int(line.rsplit(" ", 1)[1]) for line in lines]
+    assert sizes == sorted(sizes, reverse=True)
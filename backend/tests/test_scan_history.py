@@ -0,0 +1,65 @@
+import threading
+
+import scan_history
+from scan_history import ScanWriter
+
+
+class FakeObjects:
+    def __init__(self, block=None):
+        self.batches = []
+        self.block = block
+
+    def insert(self, batch, load_bulk=True):
+        if self.block is not None:
+            self.block.wait(5)
+        self.batches.append(list(batch))
+
+
+def _fake_scan(monkeypatch, block=None):
+    objects = FakeObjects(block)
+    monkeypatch.setattr(scan_history, "Scan", type("Scan", (), {"objects": objects}))
+    return objects
+
+
+def test_writer_flushes_in_batches_and_on_close(monkeypatch):
+    objects = _fake_scan(monkeypatch)
+    writer = ScanWriter(flush_size=3, flush_interval=5.0)
+    for i in range(7):
+        assert writer.enqueue(i)
+    writer.close()
+
+    assert [len(b) for b in objects.batches] == [3, 3, 1]
+    assert sum(objects.batches, []) == list(range(7))
+    stats = writer.stats()
+    assert (stats["enqueued"], stats["written"], stats["flushes"]) == (7, 7, 3)
+
+
+def test_writer_flushes_partial_batch_after_interval(monkeypatch):
+    objects = _fake_scan(monkeypatch)
+    writer = ScanWriter(flush_size=100, flush_interval=0.05)
+    writer.enqueue("a")
+    for _ in range(500):
+        if objects.batches:
+            break
+        threading.Event().wait(0.01)
+    assert objects.batches == [["a"]]
+    writer.close()
+
+
+def test_full_queue_drops_scan(monkeypatch):
+    block = threading.Event()
+    objects = _fake_scan(monkeypatch, block)
+    writer = ScanWriter(flush_size=1, flush_interval=0, max_queue=1)
+    # Bản ghi đầu đang được ghi (bị chặn), bản thứ hai chiếm chỗ duy nhất trong hàng đợi
+    writer.enqueue("a")
+    for _ in range(500):
+        if writer.queue_depth() == 0:
+            break
+        threading.Event().wait(0.01)
+    assert writer.enqueue("b")
+    assert not writer.enqueue("c")
+    block.set()
+    writer.close()
+
+    assert sum(objects.batches, []) == ["a", "b"]
+    assert writer.stats()["dropped"] == 1
@@ -0,0 +1,55 @@
+import os
+
+import pytest
+
+pytest.importorskip("gunicorn")
+
+# serve đặt các biến môi trường cho gunicorn lúc import: khôi phục lại cho các test khác
+_environ = dict(os.environ)
+import serve  # noqa: E402
+from serve import available_cpus, cgroup_cpu_limit  # noqa: E402
+os.environ.clear()
+os.environ.update(_environ)
+
+
+def _write(root, relative, content):
+    path = root / relative
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(content)
+
+
+@pytest.mark.parametrize("content, expected", [
+    ("max 100000", None),
+    ("200000 100000", 2),
+    ("150000 100000", 2),
+    ("50000 100000", 1),
+])
+def test_cgroup_v2_quota(tmp_path, content, expected):
+    _write(tmp_path, "cpu.max", content)
+    assert cgroup_cpu_limit(str(tmp_path)) == expected
+
+
+@pytest.mark.parametrize("quota, expected", [("-1", None), ("300000", 3)])
+def test_cgroup_v1_quota(tmp_path, quota, expected):
+    _write(tmp_path, "cpu/cpu.cfs_quota_us", quota)
+    _write(tmp_path, "cpu/cpu.cfs_period_us", "100000")
+    assert cgroup_cpu_limit(str(tmp_path)) == expected
+
+
+def test_no_cgroup_files_means_no_limit(tmp_path):
+    assert cgroup_cpu_limit(str(tmp_path)) is None
+
+
+def test_available_cpus_uses_affinity_and_quota(tmp_path, monkeypatch):
+    monkeypatch.setattr(serve.os, "sched_getaffinity", lambda pid: set(range(8)), raising=False)
+    monkeypatch.setattr(serve.os, "cpu_count", lambda: 64)
+    assert available_cpus(str(tmp_path)) == 8
+
+    _write(tmp_path, "cpu.max", "300000 100000")
+    assert available_cpus(str(tmp_path)) == 3
+
+
+def test_available_cpus_falls_back_to_cpu_count(tmp_path, monkeypatch):
+    monkeypatch.delattr(serve.os, "sched_getaffinity", raising=False)
+    monkeypatch.setattr(serve.os, "cpu_count", lambda: 4)
+    assert available_cpus(str(tmp_path)) == 4
@@ -0,0 +1,117 @@
+from concurrent.futures import Future
+
+import pytest
+
+import speculation
+from speculation import GATE_LEAF_SCORE, SpeculationPolicy, SpeculativePrediction
+
+LOW = GATE_LEAF_SCORE - 0.1
+
+
+def _policy(**kwargs):
+    kwargs.setdefault("mode", "adaptive")
+    kwargs.setdefault("min_pass_rate", 0.8)
+    kwargs.setdefault("window", 10)
+    kwargs.setdefault("min_samples", 5)
+    return SpeculationPolicy(**kwargs)
+
+
+def _record(policy, outcomes, leaf_score=LOW):
+    for passed in outcomes:
+        policy.record_gate(leaf_score, passed)
+
+
+def _clock(monkeypatch, values):
+    values = iter(values)
+    monkeypatch.setattr(speculation.time, "perf_counter", lambda: next(values))
+
+
+@pytest.mark.parametrize("mode, expected", [("always", True), ("off", False)])
+def test_fixed_modes_ignore_gate_outcomes(mode, expected):
+    policy = _policy(mode=mode)
+    _record(policy, [False] * 10)
+    assert policy.should_speculate(LOW) is expected
+    assert policy.should_speculate(GATE_LEAF_SCORE) is expected
+
+
+def test_adaptive_speculates_until_enough_samples():
+    policy = _policy()
+    _record(policy, [False] * 4)
+    assert policy.should_speculate(LOW)
+    _record(policy, [False])
+    assert not policy.should_speculate(LOW)
+
+
+def test_adaptive_switches_off_and_back_on_with_pass_rate():
+    policy = _policy()
+    _record(policy, [True] * 8 + [False] * 2)
+    assert policy.pass_rate() == 0.8
+    assert policy.should_speculate(LOW)
+
+    # Nhiều ảnh bị cổng từ chối: ngừng chạy trước
+    _record(policy, [False] * 3)
+    assert policy.pass_rate() == 0.5
+    assert not policy.should_speculate(LOW)
+
+    # Cửa sổ trượt: tỉ lệ qua cổng hồi phục thì chạy trước lại
+    _record(policy, [True] * 10)
+    assert policy.should_speculate(LOW)
+
+
+def test_gate_leaf_score_bypasses_pass_rate():
+    policy = _policy()
+    _record(policy, [False] * 10)
+    assert not policy.should_speculate(LOW)
+    # Cổng không thể từ chối ảnh có leaf_score >= GATE_LEAF_SCORE
+    assert policy.should_speculate(GATE_LEAF_SCORE)
+    assert policy.should_speculate(0.95)
+
+
+def test_gate_outcomes_above_threshold_are_not_recorded():
+    policy = _policy()
+    _record(policy, [False] * 10, leaf_score=GATE_LEAF_SCORE)
+    assert policy.pass_rate() is None
+    assert policy.stats()["gate_samples"] == 0
+
+
+def test_used_speculation_counts_saved_time(monkeypatch):
+    policy = _policy()
+    # Gửi lúc 10.0, model bệnh xong lúc 10.3
+    _clock(monkeypatch, [10.0, 10.3])
+    future = Future()
+    speculative = SpeculativePrediction(future)
+    future.set_result("preds")
+
+    # Tuần tự: coffee 0.4s + bệnh 0.3s; chạy song song hết 0.5s
+    policy.record_used(speculative, coffee_seconds=0.4, total_seconds=0.5)
+    stats = policy.stats()
+    assert (stats["speculated"], stats["used"], stats["wasted"]) == (1, 1, 0)
+    assert stats["saved_ms_total"] == pytest.approx(200.0)
+    assert stats["saved_ms_avg"] == pytest.approx(200.0)
+
+
+def test_discarded_before_running_is_cancelled():
+    policy = _policy()
+    speculative = SpeculativePrediction(Future())
+    policy.record_discarded(speculative)
+
+    assert speculative.future.cancelled()
+    stats = policy.stats()
+    assert (stats["speculated"], stats["cancelled"], stats["wasted"]) == (1, 1, 0)
+    assert stats["wasted_ms_total"] == 0.0
+
+
+def test_discarded_while_running_counts_wasted_time(monkeypatch):
+    policy = _policy()
+    _clock(monkeypatch, [20.0, 20.25])
+    future = Future()
+    assert future.set_running_or_notify_cancel()
+    speculative = SpeculativePrediction(future)
+
+    policy.record_discarded(speculative)
+    stats = policy.stats()
+    assert (stats["cancelled"], stats["wasted"]) == (0, 1)
+    # Thời gian phí chỉ được cộng khi model bệnh chạy xong
+    assert stats["wasted_ms_total"] == 0.0
+    future.set_result("preds")
+    assert policy.stats()["wasted_ms_total"] == pytest.approx(250.0)
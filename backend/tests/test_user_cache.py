@@ -0,0 +1,100 @@
+import mongoengine
+import mongomock
+import pytest
+
+import user_cache as cache_module
+from models import User
+from user_cache import UserCache
+
+
+@pytest.fixture
+def db():
+    mongoengine.disconnect()
+    mongoengine.connect(host="mongodb://localhost/coffee_test", mongo_client_class=mongomock.MongoClient,
+                        uuidRepresentation="standard")
+    yield
+    mongoengine.disconnect()
+
+
+@pytest.fixture
+def user(db):
+    user = User(email="nong.dan@example.com", fullName="Nông Dân", password="mat-khau-cu")
+    user.hash_password()
+    user.save()
+    return user
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    # Cache riêng cho test, nhận tín hiệu lưu / xóa User như cache dùng chung
+    cache = UserCache(max_entries=4, ttl=60)
+    monkeypatch.setattr(cache_module, "user_cache", cache)
+    return cache
+
+
+def _delete_behind_cache(user):
+    # Xóa trực tiếp trong collection (không phát tín hiệu): chỉ cache còn dữ liệu
+    User._get_collection().delete_one({"_id": user.id})
+
+
+def test_profile_is_served_from_cache(user, cache):
+    profile = cache.get_profile(user.id)
+    assert profile["email"] == "nong.dan@example.com"
+    assert "password" not in profile
+
+    _delete_behind_cache(user)
+    assert cache.get_profile(str(user.id)) == profile
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"]) == (1, 1)
+
+
+def test_entry_expires_after_ttl(user, cache, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache_module.time, "monotonic", lambda: now[0])
+    cache.get_profile(user.id)
+
+    now[0] += 59
+    _delete_behind_cache(user)
+    assert cache.get_profile(user.id) is not None
+    now[0] += 2
+    assert cache.get_profile(user.id) is None
+
+
+def test_profile_change_invalidates_entry(user, cache):
+    cache.get_profile(user.id)
+    user.fullName = "Tên Mới"
+    user.save()
+
+    assert cache.stats()["invalidations"] == 1
+    assert cache.get_profile(user.id)["fullName"] == "Tên Mới"
+
+
+def test_password_change_invalidates_entry(user, cache):
+    cache.get_profile(user.id)
+    user.password = "mat-khau-moi"
+    user.hash_password()
+    user.save()
+
+    assert cache.stats()["size"] == 0
+    assert User.objects(id=user.id).first().check_password("mat-khau-moi")
+
+
+def test_deleted_user_is_not_served(user, cache):
+    cache.get_profile(user.id)
+    user.delete()
+    assert cache.get_profile(user.id) is None
+
+
+def test_lru_evicts_oldest_user(db, cache):
+    users = [User(email=f"u{i}@example.com", fullName=f"U{i}").save() for i in range(5)]
+    for u in users:
+        cache.get_profile(u.id)
+    stats = cache.stats()
+    assert (stats["size"], stats["evictions"]) == (4, 1)
+
+
+def test_disabled_cache_always_reads_database(user):
+    cache = UserCache(max_entries=0)
+    cache.get_profile(user.id)
+    _delete_behind_cache(user)
+    assert cache.get_profile(user.id) is None
@@ -0,0 +1,237 @@
+"""
+Dựng model hợp nhất (MODEL_MODE=fused): một lần chạy ResNet50 trả lời cả hai câu
+hỏi "có phải lá cà phê không" và "bệnh gì".
+
+Chạy từ thư mục backend:
+    python -m tools.build_fused_model --train-dir anh_mau/ --validation-dir anh_kiem_tra/
+
+- Đầu vào là ảnh RGB 0..255 kích thước 224x224; bước tiền xử lý của ResNet50
+  (RGB -> BGR, trừ trung bình ImageNet) nằm trong graph dưới dạng Conv2D 1x1 cố
+  định nên model lưu được mà không cần custom layer.
+- Đầu ra "disease" là model bệnh hiện tại, không đổi.
+- Đầu ra "coffee" là một head sigmoid đặt trên đặc trưng của backbone (đầu vào
+  của lớp phân loại cuối cùng), được huấn luyện để bắt chước xác suất
+  prob_not_coffee của model coffee hiện tại (distillation, không cần nhãn) trên
+  các ảnh đã qua được cascade và bộ lọc lá. Thư mục huấn luyện cần có cả ảnh
+  không phải lá cà phê.
+- Trước khi lưu, quyết định cuối cùng (coffee_gate với adjusted_threshold và
+  disease_response) của model hợp nhất được so với hai model hiện tại trên
+  --validation-dir (bắt buộc, là ảnh không dùng để huấn luyện); model chỉ được
+  lưu nếu tỉ lệ khớp >= --min-agreement (hoặc có --force).
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+from image_context import ImageRejected, decode_image
+from models import MODEL_COFFEE_PATH, MODEL_DISEASE_PATH, MODEL_FUSED_PATH, MODEL_INPUT_SHAPE, load_model
+from routes.predict import (
+    DECODE_MAX_SIDE, MAX_IMAGE_PIXELS, analyze_image, coffee_gate, disease_response,
+    preprocess_image_advanced,
+)
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+# Giá trị trung bình theo kênh BGR của ImageNet (giống resnet50_preprocess_input)
+RESNET50_MEAN_BGR = (103.939, 116.779, 123.68)
+
+
+def iter_images(folder):
+    for root, dirs, files in os.walk(folder):
+        dirs.sort()
+        for name in sorted(files):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                yield os.path.join(root, name)
+
+
+def prepared_batches(folder, batch_size):
+    """
+    Các batch ảnh đi tới bước model trong predict_image (đã qua cascade và bộ
+    lọc lá), kèm đầu vào của cả hai model và ảnh gốc 0..255 cho model hợp nhất.
+    """
+    batch = []
+    for path in iter_images(folder):
+        try:
+            with open(path, "rb") as f:
+                ctx = decode_image(f.read(), max_side=DECODE_MAX_SIDE, max_pixels=MAX_IMAGE_PIXELS)
+            response, analysis = analyze_image(ctx)
+        except ImageRejected:
+            continue
+        if response is not None:
+            continue
+        coffee_input, quality_score = preprocess_image_advanced(ctx, is_coffee_model=True)
+        disease_input, _ = preprocess_image_advanced(ctx, is_coffee_model=False)
+        batch.append({
+            "file": path,
+            "analysis": analysis,
+            "quality_score": quality_score,
+            "coffee_input": coffee_input,
+            "disease_input": disease_input,
+            # Đầu vào coffee là ảnh / 255 nên nhân lại được đúng ảnh resize
+            "raw_input": np.round(coffee_input * 255.0).astype("float32"),
+        })
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _stack(batch, key):
+    return np.concatenate([item[key] for item in batch])
+
+
+# ============ Dựng graph ============
+
+def feature_tensor(disease, layer_name=None):
+    """Đặc trưng của backbone: đầu ra của layer_name, mặc định là đầu vào lớp cuối."""
+    if layer_name:
+        return disease.get_layer(layer_name).output
+    return disease.layers[-1].input
+
+
+def resnet50_preprocess_layer(keras):
+    """Conv2D 1x1 cố định: đảo RGB -> BGR và trừ trung bình ImageNet."""
+    layer = keras.layers.Conv2D(3, 1, use_bias=True, trainable=False, name="resnet50_preprocess")
+    layer.build((None,) + MODEL_INPUT_SHAPE)
+    kernel = np.zeros((1, 1, 3, 3), dtype="float32")
+    for channel in range(3):
+        kernel[0, 0, 2 - channel, channel] = 1.0
+    layer.set_weights([kernel, -np.array(RESNET50_MEAN_BGR, dtype="float32")])
+    return layer
+
+
+def train_coffee_head(keras, features, targets, epochs, seed=0):
+    """Head sigmoid học lại prob_not_coffee của model coffee từ đặc trưng backbone."""
+    keras.utils.set_random_seed(seed)
+    # Chuẩn hóa đặc trưng (trung bình / độ lệch của tập huấn luyện) nằm trong head
+    normalization = keras.layers.Normalization(name="coffee_feature_norm")
+    normalization.adapt(features)
+    head = keras.Sequential([
+        keras.Input(shape=features.shape[1:]),
+        normalization,
+        keras.layers.Dense(1, activation="sigmoid", name="coffee_head"),
+    ], name="coffee_head")
+    head.compile(optimizer=keras.optimizers.Adam(1e-2), loss="binary_crossentropy")
+    history = head.fit(features, targets, epochs=epochs, batch_size=64, verbose=0, shuffle=True)
+    return head, float(history.history["loss"][-1])
+
+
+def build_fused(keras, disease, head, layer_name=None):
+    """Model RGB 0..255 -> [prob_not_coffee (N, 1), xác suất bệnh (N, 5)]."""
+    backbone = keras.Model(disease.inputs, [feature_tensor(disease, layer_name), disease.output])
+    image = keras.Input(shape=MODEL_INPUT_SHAPE, name="image")
+    normalized = resnet50_preprocess_layer(keras)(image)
+    features, disease_probs = backbone(normalized)
+    coffee = keras.layers.Identity(name="coffee")(head(features))
+    disease_out = keras.layers.Identity(name="disease")(disease_probs)
+    # Thứ tự đầu ra [coffee, disease] là giao ước với predict_image
+    return keras.Model(image, [coffee, disease_out], name="coffee_fused")
+
+
+# ============ So khớp quyết định ============
+
+def _decision(analysis, prob_not_coffee, preds_disease, quality_score):
+    response = coffee_gate(analysis, prob_not_coffee, quality_score)
+    if response is None:
+        response = disease_response(preds_disease, quality_score, analysis["environmental"])
+    return response["predicted_label"]
+
+
+def parity_report(folder, batch_size, coffee, disease, fused):
+    """So quyết định cuối cùng của hai model hiện tại và model hợp nhất."""
+    rows = []
+    timings = {"separate": 0.0, "fused": 0.0}
+    for batch in prepared_batches(folder, batch_size):
+        started = time.perf_counter()
+        prob_separate = coffee.predict(_stack(batch, "coffee_input"), verbose=0)[:, 0]
+        disease_separate = disease.predict(_stack(batch, "disease_input"), verbose=0)
+        timings["separate"] += time.perf_counter() - started
+
+        started = time.perf_counter()
+        prob_fused, disease_fused = fused.predict(_stack(batch, "raw_input"), verbose=0)
+        timings["fused"] += time.perf_counter() - started
+
+        for i, item in enumerate(batch):
+            args = (item["analysis"], item["quality_score"])
+            separate = _decision(args[0], float(prob_separate[i]), disease_separate[i:i + 1], args[1])
+            merged = _decision(args[0], float(prob_fused[i, 0]), disease_fused[i:i + 1], args[1])
+            rows.append({
+                "file": item["file"],
+                "separate": separate,
+                "fused": merged,
+                "prob_not_coffee": {"separate": float(prob_separate[i]), "fused": float(prob_fused[i, 0])},
+                "disease_max_abs_diff": float(np.abs(disease_separate[i] - disease_fused[i]).max()),
+            })
+
+    if not rows:
+        return {"images": 0}, rows
+    prob_diff = np.array([abs(r["prob_not_coffee"]["separate"] - r["prob_not_coffee"]["fused"]) for r in rows])
+    images = len(rows)
+    return {
+        "images": images,
+        "decision_agreement": float(np.mean([r["separate"] == r["fused"] for r in rows])),
+        "mean_abs_prob_not_coffee_diff": float(prob_diff.mean()),
+        "max_abs_prob_not_coffee_diff": float(prob_diff.max()),
+        "max_disease_prob_diff": float(max(r["disease_max_abs_diff"] for r in rows)),
+        "model_ms_per_image": {name: seconds / images * 1000.0 for name, seconds in timings.items()},
+    }, rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Dựng model hợp nhất coffee + bệnh trên backbone ResNet50")
+    parser.add_argument("--train-dir", required=True, help="Ảnh để huấn luyện head coffee (có cả ảnh không phải cà phê)")
+    parser.add_argument("--validation-dir", required=True,
+                        help="Ảnh để so khớp quyết định, không trùng với ảnh huấn luyện")
+    parser.add_argument("--output", default=MODEL_FUSED_PATH, help="File .keras đầu ra")
+    parser.add_argument("--feature-layer", help="Tên layer đặc trưng của backbone (mặc định: đầu vào lớp cuối)")
+    parser.add_argument("--epochs", type=int, default=200)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--min-agreement", type=float, default=0.99, help="Tỉ lệ khớp quyết định tối thiểu")
+    parser.add_argument("--force", action="store_true", help="Lưu model kể cả khi không đạt --min-agreement")
+    parser.add_argument("--report", help="Ghi kết quả so khớp chi tiết ra file JSON")
+    args = parser.parse_args()
+    if os.path.realpath(args.validation_dir) == os.path.realpath(args.train_dir):
+        parser.error("--validation-dir phải khác --train-dir (so khớp trên ảnh đã huấn luyện không có ý nghĩa)")
+
+    import keras
+
+    coffee = load_model(MODEL_COFFEE_PATH)
+    disease = load_model(MODEL_DISEASE_PATH)
+    extractor = keras.Model(disease.inputs, feature_tensor(disease, args.feature_layer))
+
+    features, targets = [], []
+    for batch in prepared_batches(args.train_dir, args.batch_size):
+        targets.append(coffee.predict(_stack(batch, "coffee_input"), verbose=0)[:, 0])
+        features.append(extractor.predict(_stack(batch, "disease_input"), verbose=0))
+    if not features:
+        sys.exit("Không có ảnh nào qua được cascade và bộ lọc lá trong --train-dir")
+    features = np.concatenate(features)
+    targets = np.concatenate(targets)
+    print(f"Huấn luyện head coffee trên {len(features)} ảnh, {features.shape[1]} đặc trưng")
+
+    head, loss = train_coffee_head(keras, features, targets, args.epochs)
+    fused = build_fused(keras, disease, head, args.feature_layer)
+
+    summary, rows = parity_report(args.validation_dir, args.batch_size, coffee, disease, fused)
+    summary["train_images"] = len(features)
+    summary["train_loss"] = loss
+    print(json.dumps(summary, indent=2, ensure_ascii=False))
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump({"summary": summary, "images": rows}, f, indent=2, ensure_ascii=False)
+
+    if not summary["images"]:
+        sys.exit("Không có ảnh nào trong --validation-dir tới được bước model, không lưu model")
+    if summary["decision_agreement"] < args.min_agreement and not args.force:
+        sys.exit(f"Tỉ lệ khớp quyết định thấp hơn {args.min_agreement}, không lưu model")
+    fused.save(args.output)
+    print(f"Đã lưu {args.output} (dùng với MODEL_MODE=fused)")
+
+
+if __name__ == "__main__":
+    main()
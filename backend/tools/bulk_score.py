@@ -0,0 +1,424 @@
+"""
+Chấm điểm hàng loạt ảnh lưu trữ (offline) với đúng logic quyết định của /predict.
+
+Chạy từ thư mục backend:
+    python -m tools.bulk_score <thư_mục | file.tar[.gz]> --output ket_qua.csv
+    python -m tools.bulk_score anh_vuon.tar.gz --output ket_qua.parquet --workers 8
+
+- Giải mã, cascade, đặc trưng thủ công và tiền xử lý chạy trên một pool process
+  (analyze_image + preprocess_image_advanced của routes/predict.py).
+- Hai model (models.py, theo MODEL_BACKEND), hoặc model hợp nhất khi
+  MODEL_MODE=fused, chạy theo batch trong process chính, quyết định bằng
+  coffee_gate và disease_response như trên server.
+- Kết quả được ghi dần ra CSV hoặc Parquet (thư mục các file part-*.parquet) sau
+  mỗi --checkpoint-every ảnh. Chạy lại với cùng --output thì các ảnh đã có trong
+  kết quả được bỏ qua, tiếp tục từ lần dừng trước; ảnh lỗi phía server (status
+  5xx) được chấm lại và dòng mới ghi sau, nên dòng cuối cùng của một file là kết
+  quả hiện hành.
+- Model không tải được thì dừng ngay, không ghi kết quả nào.
+- Cuối cùng in ra throughput: ảnh/giây theo thời gian thực và ảnh/giây cho mỗi
+  core (theo thời gian CPU của tất cả các process) để ước lượng job chạy đêm.
+"""
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import resource
+import tarfile
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import numpy as np
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+COLUMNS = (
+    "file",
+    "status",
+    "predicted_label",
+    "confidence",
+    "is_leaf",
+    "rejected_by",
+    "quality_score",
+    "leaf_score",
+    "prob_not_coffee",
+    "warning",
+    "error",
+    "models",
+)
+
+
+# ============ Nguồn ảnh ============
+
+def iter_directory(folder):
+    """(tên tương đối, đường dẫn) của các ảnh trong thư mục (đệ quy, theo thứ tự tên)."""
+    for root, dirs, files in os.walk(folder):
+        dirs.sort()
+        for name in sorted(files):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                path = os.path.join(root, name)
+                yield os.path.relpath(path, folder), path
+
+
+def iter_tar(path, skip=()):
+    """(tên trong archive, nội dung) của các ảnh trong file tar (đọc tuần tự)."""
+    with tarfile.open(path, "r:*") as archive:
+        for member in archive:
+            if not member.isfile() or not member.name.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            if member.name in skip:
+                continue
+            yield member.name, archive.extractfile(member).read()
+
+
+def iter_sources(source, skip=()):
+    if os.path.isdir(source):
+        return ((name, path) for name, path in iter_directory(source) if name not in skip)
+    return iter_tar(source, skip)
+
+
+# ============ Bước CPU (chạy trong process con) ============
+
+def _init_worker():
+    import cv2
+
+    # Mỗi process con dùng một core, song song hóa bằng số process
+    cv2.setNumThreads(1)
+
+
+def prepare(name, source):
+    """
+    Giải mã và chạy phần trước model của pipeline cho một ảnh.
+    Returns: dict có "response" (ảnh đã bị loại / lỗi) hoặc các tensor đầu vào
+    model cùng kết quả phân tích.
+    """
+    from image_context import ImageRejected, decode_image
+    from models import MODEL_MODE
+    from routes.predict import (
+        DECODE_MAX_SIDE, MAX_IMAGE_PIXELS, analyze_image, preprocess_image_advanced, preprocess_image_fused,
+    )
+
+    started = time.perf_counter()
+    item = {"file": name}
+    try:
+        if isinstance(source, str):
+            with open(source, "rb") as f:
+                source = f.read()
+        ctx = decode_image(source, max_side=DECODE_MAX_SIDE, max_pixels=MAX_IMAGE_PIXELS)
+        response, analysis = analyze_image(ctx)
+        if response is not None:
+            item.update(response=response, status=200)
+        elif MODEL_MODE == "fused":
+            fused_input, quality_score = preprocess_image_fused(ctx)
+            item.update(analysis=analysis, quality_score=quality_score, fused_input=fused_input)
+        else:
+            coffee_input, quality_score = preprocess_image_advanced(ctx, is_coffee_model=True)
+            disease_input, _ = preprocess_image_advanced(ctx, is_coffee_model=False)
+            item.update(
+                analysis=analysis,
+                quality_score=quality_score,
+                coffee_input=coffee_input,
+                disease_input=disease_input,
+            )
+    except ImageRejected as e:
+        item.update(response={"error": str(e)}, status=e.status_code)
+    except Exception as e:
+        item.update(response={"error": str(e)}, status=500)
+    item["prepare_seconds"] = time.perf_counter() - started
+    return item
+
+
+# ============ Bước model (process chính, theo batch) ============
+
+def _retryable(status):
+    """Lỗi phía server (5xx): không tính là đã xong, lần chạy sau sẽ chấm lại."""
+    try:
+        return int(status) >= 500
+    except (TypeError, ValueError):
+        return True
+
+
+def score_batch(items, models):
+    """Chạy hai model trên một batch ảnh đã chuẩn bị và điền "response" cho từng ảnh."""
+    from routes.predict import coffee_gate, disease_response
+
+    fused = models.get("fused")
+    if fused is not None:
+        preds_coffee, preds_disease = fused.predict(
+            np.concatenate([item["fused_input"] for item in items]), verbose=0
+        )
+        for item, coffee_row, disease_row in zip(items, preds_coffee, preds_disease):
+            item["prob_not_coffee"] = float(coffee_row[0])
+            response = coffee_gate(item["analysis"], item["prob_not_coffee"], item["quality_score"])
+            if response is None:
+                response = disease_response(
+                    disease_row[np.newaxis], item["quality_score"], item["analysis"]["environmental"]
+                )
+            item.update(response=response, status=200)
+        return
+
+    coffee = models.get("coffee")
+    if coffee is not None:
+        preds = coffee.predict(np.concatenate([item["coffee_input"] for item in items]), verbose=0)
+        for item, row in zip(items, preds):
+            item["prob_not_coffee"] = float(row[0])
+            rejection = coffee_gate(item["analysis"], item["prob_not_coffee"], item["quality_score"])
+            if rejection is not None:
+                item.update(response=rejection, status=200)
+
+    remaining = [item for item in items if "response" not in item]
+    if not remaining:
+        return
+    disease = models.get("disease")
+    if disease is None:
+        for item in remaining:
+            item.update(response={"error": "Model phân loại bệnh không khả dụng"}, status=500)
+        return
+    preds = disease.predict(np.concatenate([item["disease_input"] for item in remaining]), verbose=0)
+    for item, row in zip(remaining, preds):
+        response = disease_response(row[np.newaxis], item["quality_score"], item["analysis"]["environmental"])
+        item.update(response=response, status=200)
+
+
+def _percent(value):
+    try:
+        return float(str(value).rstrip("%"))
+    except ValueError:
+        return None
+
+
+def result_row(item, versions):
+    response = item["response"]
+    analysis = item.get("analysis") or {}
+    quality_score = item.get("quality_score", response.get("quality_score"))
+    return {
+        "file": item["file"],
+        "status": item["status"],
+        "predicted_label": response.get("predicted_label"),
+        "confidence": _percent(response["confidence"]) if "confidence" in response else None,
+        "is_leaf": response.get("is_leaf"),
+        "rejected_by": response.get("rejected_by"),
+        "quality_score": float(quality_score) if quality_score is not None else None,
+        "leaf_score": analysis.get("leaf_score"),
+        "prob_not_coffee": item.get("prob_not_coffee"),
+        "warning": response.get("warning") or response.get("quality_warning"),
+        "error": response.get("error"),
+        "models": versions,
+    }
+
+
+# ============ Ghi kết quả (có checkpoint) ============
+
+class CsvResults:
+    """Ghi nối vào file CSV; các ảnh đã có trong file được coi là đã xong."""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+        self._writer = None
+
+    def completed(self):
+        if not os.path.exists(self.path):
+            return set()
+        with open(self.path, newline="", encoding="utf-8") as f:
+            return {row["file"] for row in csv.DictReader(f) if not _retryable(row["status"])}
+
+    def write(self, rows):
+        if self._file is None:
+            new_file = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+            self._file = open(self.path, "a", newline="", encoding="utf-8")
+            self._writer = csv.DictWriter(self._file, fieldnames=COLUMNS)
+            if new_file:
+                self._writer.writeheader()
+        self._writer.writerows(rows)
+        # Checkpoint: dữ liệu đã nằm trên đĩa trước khi chấm tiếp
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+
+class ParquetResults:
+    """
+    Mỗi checkpoint là một file part-NNNNN.parquet trong thư mục kết quả
+    (Parquet không ghi nối được). Cần cài thêm gói `pyarrow`.
+    """
+
+    def __init__(self, path):
+        import pyarrow  # noqa: F401 (báo lỗi sớm nếu chưa cài)
+
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self._parts = len(self._part_files())
+
+    def _part_files(self):
+        return sorted(n for n in os.listdir(self.path) if n.startswith("part-") and n.endswith(".parquet"))
+
+    def completed(self):
+        import pyarrow.parquet as pq
+
+        done = set()
+        for name in self._part_files():
+            table = pq.read_table(os.path.join(self.path, name), columns=["file", "status"])
+            for file, status in zip(table.column("file").to_pylist(), table.column("status").to_pylist()):
+                if not _retryable(status):
+                    done.add(file)
+        return done
+
+    def write(self, rows):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        table = pa.Table.from_pylist(rows, schema=pa.schema([
+            ("file", pa.string()),
+            ("status", pa.int32()),
+            ("predicted_label", pa.string()),
+            ("confidence", pa.float64()),
+            ("is_leaf", pa.bool_()),
+            ("rejected_by", pa.string()),
+            ("quality_score", pa.float64()),
+            ("leaf_score", pa.float64()),
+            ("prob_not_coffee", pa.float64()),
+            ("warning", pa.string()),
+            ("error", pa.string()),
+            ("models", pa.string()),
+        ]))
+        final = os.path.join(self.path, f"part-{self._parts:05d}.parquet")
+        # Ghi file tạm rồi đổi tên để không bao giờ có part ghi dở
+        pq.write_table(table, final + ".tmp")
+        os.replace(final + ".tmp", final)
+        self._parts += 1
+
+    def close(self):
+        pass
+
+
+def open_results(path):
+    return ParquetResults(path) if path.endswith(".parquet") else CsvResults(path)
+
+
+# ============ Điều phối ============
+
+def _cpu_seconds():
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+
+def run(source, output, workers, batch_size, checkpoint_every):
+    from models import model_registry, model_versions
+
+    load_started = time.perf_counter()
+    model_registry.wait_until_loaded()
+    if not model_registry.is_ready():
+        # Chấm tiếp sẽ ghi mọi ảnh thành lỗi 500; dừng trước khi ghi gì
+        errors = {name: info["error"] for name, info in model_registry.status()["models"].items() if info["error"]}
+        raise SystemExit(f"Không tải được model: {json.dumps(errors, ensure_ascii=False)}")
+    models = {name: model_registry.get(name) for name in model_registry.paths}
+    load_seconds = time.perf_counter() - load_started
+
+    versions = ";".join(f"{name}={version}" for name, version in sorted(model_versions().items()))
+
+    results = open_results(output)
+    done = results.completed()
+    if done:
+        print(f"Tiếp tục: bỏ qua {len(done)} ảnh đã có trong {output}")
+
+    # "spawn": process con không thừa hưởng TensorFlow đã khởi tạo ở process chính
+    pool = ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context("spawn"), initializer=_init_worker
+    )
+
+    # Throughput tính từ sau khi tải model (chi phí cố định của mỗi job)
+    cpu_started = _cpu_seconds()
+    started = time.perf_counter()
+
+    stats = {"images": 0, "errors": 0, "prepare_seconds": 0.0, "model_seconds": 0.0}
+    rows = []
+    batch = []
+
+    def emit(items):
+        for item in items:
+            stats["images"] += 1
+            stats["errors"] += item["status"] != 200
+            rows.append(result_row(item, versions))
+        if len(rows) >= checkpoint_every:
+            results.write(rows)
+            rows.clear()
+            print(f"  {stats['images']} ảnh, {stats['images'] / (time.perf_counter() - started):.1f} ảnh/s")
+
+    def flush_batch():
+        if batch:
+            model_started = time.perf_counter()
+            score_batch(batch, models)
+            stats["model_seconds"] += time.perf_counter() - model_started
+            emit(batch)
+            batch.clear()
+
+    def collect(futures):
+        for future in futures:
+            item = future.result()
+            stats["prepare_seconds"] += item.pop("prepare_seconds")
+            if "response" in item:
+                emit([item])
+            else:
+                batch.append(item)
+                if len(batch) >= batch_size:
+                    flush_batch()
+
+    try:
+        pending = set()
+        for name, source_item in iter_sources(source, done):
+            pending.add(pool.submit(prepare, name, source_item))
+            # Giới hạn số ảnh đang nằm trong bộ nhớ
+            if len(pending) >= workers * 4:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                collect(finished)
+        collect(pending)
+        flush_batch()
+    finally:
+        pool.shutdown()
+        if rows:
+            results.write(rows)
+        results.close()
+
+    wall_seconds = time.perf_counter() - started
+    cpu_seconds = _cpu_seconds() - cpu_started
+    images = stats["images"]
+    return {
+        "images": images,
+        "skipped": len(done),
+        "errors": stats["errors"],
+        "workers": workers,
+        "model_load_seconds": load_seconds,
+        "wall_seconds": wall_seconds,
+        "cpu_seconds": cpu_seconds,
+        "images_per_second": images / wall_seconds if wall_seconds > 0 else 0.0,
+        # Theo thời gian CPU của process chính và các process con: số core cần
+        # cho N ảnh/giây xấp xỉ N / giá trị này
+        "images_per_second_per_core": images / cpu_seconds if cpu_seconds > 0 else 0.0,
+        "prepare_ms_per_image": stats["prepare_seconds"] / images * 1000.0 if images else 0.0,
+        "model_ms_per_image": stats["model_seconds"] / images * 1000.0 if images else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chấm điểm hàng loạt ảnh lưu trữ bằng pipeline /predict")
+    parser.add_argument("source", help="Thư mục ảnh hoặc file .tar / .tar.gz")
+    parser.add_argument("--output", required=True, help="File .csv hoặc thư mục .parquet để ghi kết quả")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) - 1),
+                        help="Số process giải mã + trích xuất đặc trưng")
+    parser.add_argument("--batch-size", type=int, default=32, help="Số ảnh mỗi lần chạy model")
+    parser.add_argument("--checkpoint-every", type=int, default=500, help="Ghi kết quả sau mỗi N ảnh")
+    args = parser.parse_args()
+
+    summary = run(args.source, args.output, max(1, args.workers), max(1, args.batch_size),
+                  max(1, args.checkpoint_every))
+    print(json.dumps(summary, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+So sánh đặc trưng thủ công giữa ảnh gốc và độ phân giải phân tích.
+
+Chạy từ thư mục backend:
+    python -m tools.compare_analysis_resolution <thư_mục_ảnh> --max-side 512
+
+Với mỗi ảnh, tính extract_leaf_features / detect_environmental_artifacts /
+is_coffee_leaf_advanced ở độ phân giải gốc và ở độ phân giải phân tích, rồi báo
+cáo độ lệch từng đặc trưng, số ảnh bị đổi quyết định và mức tăng tốc.
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+from PIL import Image
+
+from image_context import ImageContext
+from routes.predict import (
+    extract_leaf_features,
+    detect_environmental_artifacts,
+    is_coffee_leaf_advanced,
+)
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+
+def leaf_decision(leaf_score):
+    """
+    Nhánh quyết định của /predict chỉ phụ thuộc vào leaf_score: ảnh có
+    leaf_score < 0.6 mới có thể bị coffee_gate loại. (leaf_score luôn >= 0.5 nên
+    nhánh "không phải lá cây" theo leaf_score < 0.3 không bao giờ xảy ra.)
+    """
+    if leaf_score < 0.6:
+        return "weak_leaf"
+    return "leaf"
+
+
+def analyze(image, max_side):
+    ctx = ImageContext(image)
+    started = time.perf_counter()
+    features = extract_leaf_features(ctx, analysis_max_side=max_side)
+    environmental = detect_environmental_artifacts(ctx, analysis_max_side=max_side)
+    elapsed = time.perf_counter() - started
+    leaf_score = is_coffee_leaf_advanced(ctx, features)
+    return {
+        "features": {k: float(v) for k, v in features.items()},
+        "environmental": {k: bool(v) for k, v in environmental.items()},
+        "leaf_score": float(leaf_score),
+        "decision": leaf_decision(leaf_score),
+        "seconds": elapsed,
+    }
+
+
+def compare_folder(folder, max_side):
+    paths = sorted(
+        os.path.join(folder, name) for name in os.listdir(folder)
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    )
+    rows = []
+    for path in paths:
+        image = Image.open(path).convert("RGB")
+        full = analyze(image, 0)
+        reduced = analyze(image, max_side)
+        rows.append({"file": os.path.basename(path), "full": full, "reduced": reduced})
+        print(
+            f"{os.path.basename(path)}: leaf_score {full['leaf_score']:.2f} -> "
+            f"{reduced['leaf_score']:.2f}, {full['seconds'] * 1000:.0f}ms -> "
+            f"{reduced['seconds'] * 1000:.0f}ms"
+        )
+    return rows
+
+
+def summarize(rows):
+    if not rows:
+        return {}
+
+    feature_names = rows[0]["full"]["features"].keys()
+    drift = {}
+    for name in feature_names:
+        full = np.array([r["full"]["features"][name] for r in rows])
+        reduced = np.array([r["reduced"]["features"][name] for r in rows])
+        abs_diff = np.abs(full - reduced)
+        rel_diff = abs_diff / np.maximum(np.abs(full), 1e-9)
+        drift[name] = {
+            "mean_abs_diff": float(abs_diff.mean()),
+            "max_abs_diff": float(abs_diff.max()),
+            "mean_rel_diff": float(rel_diff.mean()),
+        }
+
+    env_flips = {
+        name: sum(r["full"]["environmental"][name] != r["reduced"]["environmental"][name] for r in rows)
+        for name in rows[0]["full"]["environmental"]
+    }
+    decision_changes = [
+        r["file"] for r in rows if r["full"]["decision"] != r["reduced"]["decision"]
+    ]
+    full_time = sum(r["full"]["seconds"] for r in rows)
+    reduced_time = sum(r["reduced"]["seconds"] for r in rows)
+
+    return {
+        "images": len(rows),
+        "feature_drift": drift,
+        "environmental_flips": env_flips,
+        "leaf_score_mean_abs_diff": float(np.mean(
+            [abs(r["full"]["leaf_score"] - r["reduced"]["leaf_score"]) for r in rows]
+        )),
+        "decision_changes": decision_changes,
+        "speedup": full_time / reduced_time if reduced_time > 0 else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="So sánh đặc trưng ở ảnh gốc và ảnh thu nhỏ")
+    parser.add_argument("folder", help="Thư mục chứa ảnh mẫu")
+    parser.add_argument("--max-side", type=int, default=512, help="Cạnh dài tối đa khi phân tích (px)")
+    parser.add_argument("--output", help="Ghi kết quả chi tiết ra file JSON")
+    args = parser.parse_args()
+
+    rows = compare_folder(args.folder, args.max_side)
+    summary = summarize(rows)
+    print(json.dumps(summary, indent=2, ensure_ascii=False))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"summary": summary, "images": rows}, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+So sánh hai chế độ tăng cường ảnh (ENHANCE_MODE=full và fast) trên ảnh mẫu.
+
+Chạy từ thư mục backend:
+    python -m tools.compare_enhancement <thư_mục_ảnh>
+
+Chỉ ảnh có quality_score < 0.7 mới được tăng cường nên mặc định chỉ báo cáo các
+ảnh đó (--all để báo cáo tất cả). Với mỗi ảnh, tiền xử lý theo từng chế độ rồi
+chạy cả hai model, báo cáo song song: thời gian tăng cường, prob_not_coffee,
+nhãn bệnh và độ tin cậy, cùng tỉ lệ khớp quyết định coffee_gate giữa hai chế độ.
+Ảnh được giải mã bằng decode_image như /predict. Với MODEL_MODE=fused, model
+hợp nhất được dùng thay cho hai model.
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from image_context import ImageRejected, decode_image
+from models import model_registry, load_model, LABELS_DISEASE
+from routes.predict import (
+    DECODE_MAX_SIDE, MAX_IMAGE_PIXELS, analyze_image, coffee_gate, detect_image_quality,
+    preprocess_image_advanced, preprocess_image_fused,
+)
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+MODES = ("full", "fast")
+
+
+def decode(data):
+    return decode_image(data, max_side=DECODE_MAX_SIDE, max_pixels=MAX_IMAGE_PIXELS)
+
+
+def run_mode(data, analysis, mode, models):
+    # Ngữ cảnh mới cho mỗi chế độ để thời gian đo không dùng lại kết quả cache
+    ctx = decode(data)
+    detect_image_quality(ctx)
+    started = time.perf_counter()
+    if "fused" in models:
+        fused_input, quality_score = preprocess_image_fused(ctx, enhance_mode=mode)
+        elapsed = time.perf_counter() - started
+        preds_coffee, preds_disease = models["fused"].predict(fused_input, verbose=0)
+        prob_not_coffee = float(preds_coffee[0][0])
+        preds_disease = preds_disease[0]
+    else:
+        coffee_input, quality_score = preprocess_image_advanced(ctx, is_coffee_model=True, enhance_mode=mode)
+        disease_input, _ = preprocess_image_advanced(ctx, is_coffee_model=False, enhance_mode=mode)
+        elapsed = time.perf_counter() - started
+        prob_not_coffee = float(models["coffee"].predict(coffee_input, verbose=0)[0][0])
+        preds_disease = models["disease"].predict(disease_input, verbose=0)[0]
+    class_id = int(np.argmax(preds_disease))
+    return {
+        "preprocess_ms": elapsed * 1000.0,
+        "prob_not_coffee": prob_not_coffee,
+        "coffee_rejected": coffee_gate(analysis, prob_not_coffee, quality_score) is not None,
+        "label": LABELS_DISEASE[class_id],
+        "confidence": float(preds_disease[class_id]),
+    }
+
+
+def compare_folder(folder, models, include_all):
+    names = sorted(n for n in os.listdir(folder) if n.lower().endswith(IMAGE_EXTENSIONS))
+    rows = []
+    for name in names:
+        with open(os.path.join(folder, name), "rb") as f:
+            data = f.read()
+        try:
+            ctx = decode(data)
+        except ImageRejected as e:
+            print(f"Bỏ qua {name}: {e}")
+            continue
+        quality_score = detect_image_quality(ctx)[0]
+        if quality_score >= 0.7 and not include_all:
+            continue
+        # Phân tích lá không phụ thuộc chế độ tăng cường
+        response, analysis = analyze_image(ctx)
+        if response is not None:
+            print(f"Bỏ qua {name}: bị loại trước model ({response['predicted_label']})")
+            continue
+        row = {"file": name, "quality_score": quality_score}
+        row.update({mode: run_mode(data, analysis, mode, models) for mode in MODES})
+        rows.append(row)
+        print(
+            f"{name}: quality {quality_score:.2f} | "
+            + " | ".join(
+                f"{mode}: {row[mode]['label']} {row[mode]['confidence'] * 100:.1f}% "
+                f"({row[mode]['preprocess_ms']:.0f}ms)"
+                for mode in MODES
+            )
+        )
+    return rows
+
+
+def summarize(rows):
+    if not rows:
+        return {}
+
+    full = {key: np.array([r["full"][key] for r in rows]) for key in ("confidence", "prob_not_coffee", "preprocess_ms")}
+    fast = {key: np.array([r["fast"][key] for r in rows]) for key in ("confidence", "prob_not_coffee", "preprocess_ms")}
+    confidence_diff = fast["confidence"] - full["confidence"]
+    return {
+        "images": len(rows),
+        "label_agreement": float(np.mean([r["full"]["label"] == r["fast"]["label"] for r in rows])),
+        "coffee_decision_agreement": float(np.mean(
+            [r["full"]["coffee_rejected"] == r["fast"]["coffee_rejected"] for r in rows]
+        )),
+        "mean_confidence": {"full": float(full["confidence"].mean()), "fast": float(fast["confidence"].mean())},
+        "mean_confidence_diff": float(confidence_diff.mean()),
+        "worst_confidence_drop": float(confidence_diff.min()),
+        "mean_abs_prob_not_coffee_diff": float(np.abs(fast["prob_not_coffee"] - full["prob_not_coffee"]).mean()),
+        "preprocess_ms": {
+            "full": {"p50": float(np.percentile(full["preprocess_ms"], 50)),
+                     "max": float(full["preprocess_ms"].max())},
+            "fast": {"p50": float(np.percentile(fast["preprocess_ms"], 50)),
+                     "max": float(fast["preprocess_ms"].max())},
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="So sánh ENHANCE_MODE=full và fast")
+    parser.add_argument("folder", help="Thư mục chứa ảnh mẫu")
+    parser.add_argument("--all", action="store_true", help="Báo cáo cả ảnh không cần tăng cường")
+    parser.add_argument("--output", help="Ghi kết quả chi tiết ra file JSON")
+    args = parser.parse_args()
+
+    models = {name: load_model(path) for name, path in model_registry.paths.items()}
+    rows = compare_folder(args.folder, models, args.all)
+    summary = summarize(rows)
+    print(json.dumps(summary, indent=2, ensure_ascii=False))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"summary": summary, "images": rows}, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+"""
+Export các model Keras sang TFLite (tùy chọn lượng tử hóa) và báo cáo độ khớp.
+
+Chạy từ thư mục backend:
+    python -m tools.export_models --quantize int8 --calibration-dir samples/ --report
+
+File .tflite được ghi cạnh file Keras (cùng tên, đổi đuôi) để dùng với
+MODEL_BACKEND=tflite (chỉ chế độ MODEL_MODE=separate: model hợp nhất có hai
+đầu ra nên chỉ chạy bằng Keras). Với --report, dự đoán của hai backend được so sánh trên
+ảnh mẫu: tỉ lệ khớp nhãn LABELS_DISEASE / quyết định coffee_gate, độ lệch xác
+suất, độ trễ và bộ nhớ khi tải model. Ảnh mẫu đi qua đúng đường của /predict
+(decode_image, analyze_image, tiền xử lý).
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from image_context import ImageRejected, decode_image
+from models import (
+    MODEL_COFFEE_PATH,
+    MODEL_DISEASE_PATH,
+    MODEL_MODE,
+    LABELS_DISEASE,
+    TFLiteModel,
+    tflite_path,
+)
+from routes.predict import (
+    DECODE_MAX_SIDE, MAX_IMAGE_PIXELS, analyze_image, coffee_gate, preprocess_image_advanced,
+)
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+# Tên model -> (file Keras, dùng tiền xử lý của model coffee hay không)
+MODELS = {
+    "coffee": (MODEL_COFFEE_PATH, True),
+    "disease": (MODEL_DISEASE_PATH, False),
+}
+
+
+def load_samples(folder, is_coffee_model, limit):
+    """
+    Tiền xử lý ảnh mẫu đúng như /predict.
+    Returns: danh sách (tensor (1, 224, 224, 3), gate) với gate = (analysis,
+    quality_score) để quyết định bằng coffee_gate, hoặc None nếu ảnh đã bị loại
+    trước model.
+    """
+    if not folder:
+        return []
+    names = sorted(n for n in os.listdir(folder) if n.lower().endswith(IMAGE_EXTENSIONS))
+    samples = []
+    for name in names[:limit]:
+        with open(os.path.join(folder, name), "rb") as f:
+            data = f.read()
+        try:
+            ctx = decode_image(data, max_side=DECODE_MAX_SIDE, max_pixels=MAX_IMAGE_PIXELS)
+        except ImageRejected as e:
+            print(f"Bỏ qua {name}: {e}")
+            continue
+        tensor, quality_score = preprocess_image_advanced(ctx, is_coffee_model=is_coffee_model)
+        gate = None
+        if is_coffee_model:
+            response, analysis = analyze_image(ctx)
+            gate = (analysis, quality_score) if response is None else None
+        samples.append((tensor.astype("float32"), gate))
+    return samples
+
+
+def _coffee_rejections(preds, gates):
+    """Quyết định của coffee_gate cho các ảnh đi tới model coffee."""
+    return np.array([
+        coffee_gate(gate[0], float(row[0]), gate[1]) is not None
+        for row, gate in zip(preds, gates) if gate is not None
+    ])
+
+
+def convert(keras_model, quantize, samples):
+    import tensorflow as tf
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(keras_model)
+    if quantize in ("dynamic", "int8"):
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantize == "int8":
+        if not samples:
+            raise SystemExit("Lượng tử hóa int8 cần --calibration-dir có ảnh mẫu")
+
+        def representative_dataset():
+            for sample, _ in samples:
+                yield [sample]
+
+        converter.representative_dataset = representative_dataset
+    return converter.convert()
+
+
+def rss_mb():
+    """Bộ nhớ RSS hiện tại của process (MB), chỉ có trên Linux."""
+    try:
+        with open("/proc/self/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    return None
+
+
+def _latency_ms(model, samples):
+    times = []
+    for sample, _ in samples:
+        started = time.perf_counter()
+        model.predict(sample, verbose=0)
+        times.append((time.perf_counter() - started) * 1000.0)
+    return {
+        "p50": float(np.percentile(times, 50)),
+        "p95": float(np.percentile(times, 95)),
+    }
+
+
+def parity_report(name, keras_model, tflite_model, samples):
+    keras_preds = np.concatenate([keras_model.predict(s, verbose=0) for s, _ in samples])
+    tflite_preds = np.concatenate([tflite_model.predict(s) for s, _ in samples])
+    abs_diff = np.abs(keras_preds - tflite_preds)
+
+    report = {
+        "samples": len(samples),
+        "mean_abs_prob_diff": float(abs_diff.mean()),
+        "max_abs_prob_diff": float(abs_diff.max()),
+    }
+    if name == "disease":
+        keras_labels = keras_preds.argmax(axis=1)
+        tflite_labels = tflite_preds.argmax(axis=1)
+        report["label_agreement"] = float(np.mean(keras_labels == tflite_labels))
+        report["label_counts"] = {
+            label: {
+                "keras": int(np.sum(keras_labels == i)),
+                "tflite": int(np.sum(tflite_labels == i)),
+            }
+            for i, label in enumerate(LABELS_DISEASE)
+        }
+    else:
+        gates = [gate for _, gate in samples]
+        keras_reject = _coffee_rejections(keras_preds, gates)
+        tflite_reject = _coffee_rejections(tflite_preds, gates)
+        report["gated_samples"] = len(keras_reject)
+        if len(keras_reject):
+            report["decision_agreement"] = float(np.mean(keras_reject == tflite_reject))
+
+    report["latency_ms"] = {
+        "keras": _latency_ms(keras_model, samples),
+        "tflite": _latency_ms(tflite_model, samples),
+    }
+    return report
+
+
+def export_model(name, quantize, calibration_dir, eval_dir, limit, with_report):
+    import tensorflow as tf
+
+    keras_path, is_coffee_model = MODELS[name]
+    output_path = tflite_path(keras_path)
+
+    rss_before = rss_mb()
+    keras_model = tf.keras.models.load_model(keras_path)
+    rss_keras = rss_mb()
+
+    calibration = load_samples(calibration_dir, is_coffee_model, limit)
+    with open(output_path, "wb") as f:
+        f.write(convert(keras_model, quantize, calibration))
+    print(f"Đã export '{name}' -> {output_path} ({quantize})")
+
+    result = {
+        "output": output_path,
+        "quantize": quantize,
+        "size_mb": {
+            "keras": os.path.getsize(keras_path) / 1e6,
+            "tflite": os.path.getsize(output_path) / 1e6,
+        },
+    }
+    if not with_report:
+        return result
+
+    rss_before_tflite = rss_mb()
+    tflite_model = TFLiteModel(output_path)
+    rss_tflite = rss_mb()
+    if None not in (rss_before, rss_keras, rss_before_tflite, rss_tflite):
+        result["load_rss_mb"] = {
+            "keras": rss_keras - rss_before,
+            "tflite": rss_tflite - rss_before_tflite,
+        }
+
+    samples = load_samples(eval_dir, is_coffee_model, limit) if eval_dir != calibration_dir else calibration
+    if samples:
+        result["parity"] = parity_report(name, keras_model, tflite_model, samples)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export model Keras sang TFLite")
+    parser.add_argument("--model", choices=["coffee", "disease", "all"], default="all")
+    parser.add_argument("--quantize", choices=["none", "dynamic", "int8"], default="none",
+                        help="none: float32, dynamic: trọng số int8, int8: lượng tử hóa đầy đủ có hiệu chỉnh")
+    parser.add_argument("--calibration-dir", help="Thư mục ảnh mẫu để hiệu chỉnh int8")
+    parser.add_argument("--eval-dir", help="Thư mục ảnh để so sánh (mặc định dùng ảnh hiệu chỉnh)")
+    parser.add_argument("--samples", type=int, default=200, help="Số ảnh tối đa lấy từ mỗi thư mục")
+    parser.add_argument("--report", action="store_true", help="So sánh độ khớp, độ trễ và bộ nhớ")
+    parser.add_argument("--output", help="Ghi báo cáo ra file JSON")
+    args = parser.parse_args()
+
+    if MODEL_MODE == "fused":
+        raise SystemExit("MODEL_MODE=fused chỉ hỗ trợ Keras, không có model TFLite để export")
+
+    names = list(MODELS) if args.model == "all" else [args.model]
+    eval_dir = args.eval_dir or args.calibration_dir
+    results = {
+        name: export_model(name, args.quantize, args.calibration_dir, eval_dir, args.samples, args.report)
+        for name in names
+    }
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
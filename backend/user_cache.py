@@ -0,0 +1,115 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from mongoengine import signals
+
+from models import User
+
+# ============ Cache thông tin người dùng ============
+#
+# Ứng dụng mobile gọi /auth/profile ở mỗi màn hình. Thông tin công khai của
+# người dùng (email, tên, ngày tạo) được cache trong bộ nhớ có giới hạn và TTL,
+# đọc từ MongoDB khi chưa có (chỉ lấy đúng các trường cần, không bao giờ tải
+# hash mật khẩu) và bị xóa mỗi khi document User được lưu hoặc xóa.
+
+# Số người dùng tối đa trong cache (0 = tắt cache)
+USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", "10000"))
+# Thời gian sống của một mục (giây)
+USER_CACHE_TTL = float(os.environ.get("USER_CACHE_TTL", "300"))
+
+# Các trường công khai trả về bởi /auth/profile
+PROFILE_FIELDS = ("email", "fullName", "createdAt")
+
+
+def profile_of(user):
+    """Thông tin công khai của người dùng (không bao gồm mật khẩu)."""
+    return {
+        "id": str(user.id),
+        "email": user.email,
+        "fullName": user.fullName,
+        "createdAt": user.createdAt.isoformat() if user.createdAt else None,
+    }
+
+
+class UserCache:
+    """
+    LRU có TTL đặt trước các truy vấn User theo id.
+    """
+
+    def __init__(self, max_entries=USER_CACHE_SIZE, ttl=USER_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._invalidations = 0
+
+    def get_profile(self, user_id):
+        """
+        Thông tin công khai của người dùng, đọc từ cache hoặc MongoDB.
+        Returns: dict, hoặc None nếu không tồn tại người dùng.
+        """
+        user_id = str(user_id)
+        now = time.monotonic()
+        if self.max_entries > 0:
+            with self._lock:
+                entry = self._entries.get(user_id)
+                if entry is not None and entry[0] > now:
+                    self._entries.move_to_end(user_id)
+                    self._hits += 1
+                    return entry[1]
+                self._misses += 1
+
+        user = User.objects(id=user_id).only(*PROFILE_FIELDS).first()
+        if user is None:
+            return None
+        profile = profile_of(user)
+        if self.max_entries > 0:
+            with self._lock:
+                self._entries[user_id] = (now + self.ttl, profile)
+                self._entries.move_to_end(user_id)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self._evictions += 1
+        return profile
+
+    def invalidate(self, user_id):
+        with self._lock:
+            if self._entries.pop(str(user_id), None) is not None:
+                self._invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "enabled": self.max_entries > 0,
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_ratio": self._hits / lookups if lookups else 0.0,
+                "evictions": self._evictions,
+                "invalidations": self._invalidations,
+            }
+
+
+user_cache = UserCache()
+
+
+def _invalidate_user(sender, document, **kwargs):
+    user_cache.invalidate(document.id)
+
+
+# Document User được lưu / xóa thì thông tin trong cache không còn đúng
+signals.post_save.connect(_invalidate_user, sender=User)
+signals.post_delete.connect(_invalidate_user, sender=User)